@@ -1,25 +1,172 @@
-from django.db import models
-import random
+from django.db import models, IntegrityError, transaction
+from django.db.models import F
+import hashlib
 import string
+import threading
+from django.conf import settings
 from django.core.exceptions import ValidationError 
 
 
+# --- ACCESS CODES ---
+# Codes are handed out from a numbered sequence instead of being guessed at
+# random and checked one by one against the database. Each number is passed
+# through a keyed shuffle (a small Feistel network) that maps every number in
+# the code space to a different number, so consecutive quizzes still get
+# unrelated-looking codes and no code is ever handed out twice. Processes
+# reserve numbers in blocks, so most codes cost no queries at all.
+#
+# The shuffle is keyed with ACCESS_CODE_KEY. Changing it changes every code
+# the sequence hands out from then on, so older codes can come up again
+# (Quiz.save takes the next code when they do); leave it alone once set.
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 5
+
+
+class AccessCodeSequence(models.Model):
+    """The next unreserved sequence number for each code allocator."""
+    name = models.CharField(max_length=50, primary_key=True)
+    next_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class AccessCodeAllocator:
+    ROUNDS = 4
+
+    def __init__(self, name='quiz-access-code', alphabet=CODE_ALPHABET, length=CODE_LENGTH, block_size=None, key=None):
+        self.name = name
+        self.alphabet = alphabet
+        self.length = length
+        self.space = len(alphabet) ** length
+        self.block_size = block_size or getattr(settings, 'ACCESS_CODE_BLOCK_SIZE', 50)
+        self.key = (key if key is not None else settings.ACCESS_CODE_KEY).encode()
+
+        # The Feistel network works on an even number of bits that covers the code space.
+        self.half_bits = ((self.space - 1).bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(value.to_bytes(8, 'big'), key=self.key[:64], digest_size=8, person=bytes([i]) * 16).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+    def _shuffle(self, n):
+        left, right = n >> self.half_bits, n & self.half_mask
+        for i in range(self.ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << self.half_bits) | right
+
+    def code_for(self, n):
+        """The code for sequence number n. Different n always give different codes."""
+        if not 0 <= n < self.space:
+            raise ValueError(f"Access code space exhausted ({self.space} codes).")
+        # Walk the cycle until we land back inside the code space.
+        n = self._shuffle(n)
+        while n >= self.space:
+            n = self._shuffle(n)
+
+        chars = []
+        for _ in range(self.length):
+            n, digit = divmod(n, len(self.alphabet))
+            chars.append(self.alphabet[digit])
+        return ''.join(reversed(chars))
+
+    def _reserve_block(self):
+        """Reserves the next block_size sequence numbers with a single UPDATE."""
+        while True:
+            try:
+                with transaction.atomic():
+                    updated = AccessCodeSequence.objects.filter(name=self.name).update(
+                        next_value=F('next_value') + self.block_size
+                    )
+                    if not updated:
+                        AccessCodeSequence.objects.create(name=self.name, next_value=self.block_size)
+                        return 0
+                    end = AccessCodeSequence.objects.values_list('next_value', flat=True).get(name=self.name)
+                    return end - self.block_size
+            except IntegrityError:
+                # Another process created the row first; reserve from it instead.
+                continue
+
+    def _keep(self, start, end):
+        """Hands out start..end-1 next, unless another block was reserved meanwhile."""
+        with self._lock:
+            if self._next >= self._end:
+                self._next, self._end = start, end
+
+    def allocate(self):
+        with self._lock:
+            if self._next < self._end:
+                n = self._next
+                self._next += 1
+                return self.code_for(n)
+            start = self._reserve_block()
+        # Inside the caller's transaction the reservation is only real once it
+        # commits: if it rolls back, another process will reserve the same
+        # block. So use one number now and keep the rest only after the commit
+        # (outside a transaction, on_commit runs straight away).
+        transaction.on_commit(lambda: self._keep(start + 1, start + self.block_size))
+        return self.code_for(start)
+
+
+access_code_allocator = AccessCodeAllocator()
+
+
 def generate_access_code():
     """Generates a unique 5-character uppercase alphanumeric code."""
-    while True:
-        code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
-        if not Quiz.objects.filter(access_code=code).exists():
-            return code
+    return access_code_allocator.allocate()
 
 class Quiz(models.Model):
     title = models.CharField(max_length=200)
     class_name = models.CharField(max_length=100, blank=True, null=True)
     access_code = models.CharField(max_length=5, unique=True, default=generate_access_code)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped whenever the quiz or one of its questions changes (quiz_app/signals.py).
+    # Cached copies of the quiz are keyed by it, so every worker stops using
+    # its old copy as soon as the change is committed.
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # Study guides (quiz_app/question_bank.py) only reuse questions, answers
+    # included, from quizzes their teacher has shared, so students can't get
+    # the answers to another class's quiz that is still open.
+    share_in_question_bank = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Backs the dashboard's keyset pagination (newest first).
+            models.Index(fields=['-created_at', '-id'], name='quiz_newest_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.access_code})"
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            if kwargs.get('update_fields') is None:
+                # version is only changed by quiz_app/signals.py's UPDATE ... version + 1,
+                # never written back from an instance that may have been loaded before it.
+                kwargs['update_fields'] = [
+                    f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'version'
+                ]
+            return super().save(*args, **kwargs)
+
+        # Codes from the allocator never repeat, but quizzes made before it
+        # existed (or before ACCESS_CODE_KEY changed) have codes that one of
+        # its codes might hit. Take the next code when that happens.
+        for _ in range(10):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                if not Quiz.objects.filter(access_code=self.access_code).exists():
+                    raise
+                self.access_code = generate_access_code()
+        raise IntegrityError(f"Could not find a free access code for '{self.title}'.")
+
 class Question(models.Model):
     quiz = models.ForeignKey(Quiz, related_name='questions', on_delete=models.CASCADE)
     text = models.TextField()
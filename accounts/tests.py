@@ -1,3 +1,65 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+
+from .models import AccessCodeAllocator, AccessCodeSequence, Quiz
+
+
+class AccessCodeAllocatorTests(TestCase):
+
+    def test_every_number_maps_to_a_different_code(self):
+        allocator = AccessCodeAllocator(length=3, key='test')
+        codes = {allocator.code_for(n) for n in range(allocator.space)}
+        self.assertEqual(len(codes), allocator.space)
+        self.assertTrue(all(len(code) == 3 for code in codes))
+
+    def test_separate_allocators_never_share_a_block(self):
+        first = AccessCodeAllocator(name='test', block_size=5)
+        second = AccessCodeAllocator(name='test', block_size=5)
+        codes = [first.allocate(), second.allocate(), first.allocate(), second.allocate()]
+        self.assertEqual(len(set(codes)), 4)
+
+    def test_code_space_can_run_out(self):
+        allocator = AccessCodeAllocator(length=1, key='test')
+        with self.assertRaises(ValueError):
+            allocator.code_for(allocator.space)
+
+
+class AccessCodeBlockTests(TransactionTestCase):
+    # Blocks are only kept once the reservation commits, so these run outside a test transaction.
+
+    def test_codes_are_reserved_one_block_at_a_time(self):
+        allocator = AccessCodeAllocator(name='test', block_size=10)
+        # Ten codes cost one reservation (begin, update, insert/select, commit).
+        with self.assertNumQueries(4):
+            codes = [allocator.allocate() for _ in range(10)]
+        with self.assertNumQueries(4):
+            codes += [allocator.allocate() for _ in range(10)]
+        self.assertEqual(len(set(codes)), 20)
+        self.assertEqual(AccessCodeSequence.objects.get(name='test').next_value, 20)
+
+    def test_block_reserved_in_a_rolled_back_transaction_is_not_kept(self):
+        first = AccessCodeAllocator(name='test', block_size=5)
+        first.allocate()  # creates the sequence row
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                for _ in range(5):
+                    first.allocate()
+                raise RuntimeError("rolled back")
+
+        # Another process reserves the rolled-back block again.
+        second = AccessCodeAllocator(name='test', block_size=5)
+        codes = [second.allocate() for _ in range(5)] + [first.allocate() for _ in range(5)]
+        self.assertEqual(len(set(codes)), 10)
+
+
+class QuizAccessCodeTests(TransactionTestCase):
+
+    def test_collision_with_an_older_random_code_takes_the_next_code(self):
+        taken = Quiz.objects.create(title='Old quiz', access_code='AAAAA')
+        with mock.patch('accounts.models.generate_access_code', side_effect=['BBBBB']):
+            quiz = Quiz(title='New quiz', access_code=taken.access_code)
+            quiz.save()
+        self.assertEqual(quiz.access_code, 'BBBBB')
+        self.assertEqual(Quiz.objects.count(), 2)
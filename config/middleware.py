@@ -0,0 +1,182 @@
+# In config/middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from quiz_app import metrics
+
+budget_exceeded = metrics.counter('query_budget_exceeded', 'Requests that ran more queries than their budget')
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise, but usable from async views under ASGI.
+
+    Stock WhiteNoiseMiddleware is sync-only, and one sync-only middleware
+    makes Django run every request, async views included, one at a time
+    on its single sync thread. Serving a static file is just an in-memory
+    lookup plus opening the file, so this does it inline and awaits the rest.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = self.find_file(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return self.serve(static_file, request)
+        return await self.get_response(request)
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header to every response: the time of each
+    metrics.span() run during the request (e.g. score, persist), the time
+    spent in database queries (db) and the whole request (total). Browsers
+    show it in the network tab's Timing panel.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timings, token = metrics.start_request_timings()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.stop_request_timings(token)
+        return self.add_header(response, timings, start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timings, token = metrics.start_request_timings()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.stop_request_timings(token)
+        return self.add_header(response, timings, start)
+
+    def add_header(self, response, timings, start):
+        timings = timings + [('total', time.perf_counter() - start)]
+        response['Server-Timing'] = metrics.server_timing(timings)
+        return response
+
+
+class QueryCounter:
+    """A connection.execute_wrapper() that counts queries and the time spent in them."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - start
+
+
+class QueryBudgetMiddleware:
+    """
+    Counts the database queries (and the time spent in them) of every request.
+
+    Each URL name has a budget in settings.QUERY_BUDGETS (anything else gets
+    QUERY_BUDGET_DEFAULT). A request that goes over it is logged, which is
+    how N+1 queries show up. With DEBUG on, every response also carries
+    X-DB-Queries, X-DB-Time-Ms and X-DB-Query-Budget headers.
+
+    A streaming response's queries are counted while it is sent, and checked
+    once it has been sent (its headers are gone by then, so it has no X-DB-*
+    headers). Async streams aren't counted: their queries run in other threads.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+        return self.check(request, response, counter)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = await self.get_response(request)
+        return self.check(request, response, counter)
+
+    def check(self, request, response, counter):
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.counted(response.streaming_content, counter,
+                                                      lambda: self.check_budget(request, counter))
+            return response
+        budget = self.check_budget(request, counter)
+        if settings.DEBUG:
+            response['X-DB-Queries'] = str(counter.count)
+            response['X-DB-Time-Ms'] = f"{counter.seconds * 1000:.1f}"
+            response['X-DB-Query-Budget'] = str(budget)
+        return response
+
+    def counted(self, content, counter, done):
+        """Yields the stream's chunks, counting the queries run to make each one; calls done() at the end."""
+        try:
+            chunks = iter(content)
+            while True:
+                with connection.execute_wrapper(counter):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            done()
+
+    def check_budget(self, request, counter):
+        """Records the request's query time and logs it if it went over its budget. Returns the budget."""
+        if counter.count:
+            metrics.record('db', counter.seconds)
+        view_name = request.resolver_match.view_name if request.resolver_match else None
+        budget = query_budget(view_name)
+        if counter.count > budget:
+            budget_exceeded.inc()
+            print(f"!!! QUERY BUDGET: {request.method} {request.path} ({view_name}) ran {counter.count} queries "
+                  f"in {counter.seconds * 1000:.1f} ms, budget {budget}")
+        return budget
+
+
+def query_budget(view_name):
+    """The most queries a request to this URL name should run."""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(view_name, getattr(settings, 'QUERY_BUDGET_DEFAULT', 20))
@@ -21,6 +21,33 @@ load_dotenv()
 LOGIN_REDIRECT_URL = '/dashboard/'
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-lite')
+GEMINI_API_BASE_URL = os.getenv('GEMINI_API_BASE_URL', 'https://generativelanguage.googleapis.com')
+GEMINI_TIMEOUT = float(os.getenv('GEMINI_TIMEOUT', 15))  # seconds, per attempt
+GEMINI_MAX_CONNECTIONS = int(os.getenv('GEMINI_MAX_CONNECTIONS', 100))
+
+# LLM client (see quiz_app/ai.py). 'gemini', or 'stub' to run offline.
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+LLM_REPLAY_FILE = os.getenv('LLM_REPLAY_FILE')  # recorded answers for the stub
+LLM_STUB_LATENCY = float(os.getenv('LLM_STUB_LATENCY', 0))  # seconds
+# Keep the deadline under gunicorn's 30 second worker timeout.
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', 25))  # seconds, all attempts
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', 3))
+LLM_RETRY_BACKOFF = float(os.getenv('LLM_RETRY_BACKOFF', 0.5))  # seconds
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', 5))  # failures in a row
+LLM_BREAKER_RESET = float(os.getenv('LLM_BREAKER_RESET', 30))  # seconds
+
+# --- AI GENERATOR ADMISSION CONTROL (see quiz_app/admission.py) ---
+# Every limit is kept per worker process, including the per-user ones: with
+# N web workers a user can get N times AI_QUESTIONS_PER_MINUTE and
+# AI_QUESTIONS_BURST. To stay within a Gemini quota, divide it by N.
+AI_MAX_QUESTIONS = int(os.getenv('AI_MAX_QUESTIONS', 50))  # per generated quiz
+AI_DEFAULT_QUESTIONS = int(os.getenv('AI_DEFAULT_QUESTIONS', 10))  # cost of a request without a count
+AI_QUESTIONS_PER_MINUTE = float(os.getenv('AI_QUESTIONS_PER_MINUTE', 100))  # per user
+AI_QUESTIONS_BURST = int(os.getenv('AI_QUESTIONS_BURST', 100))  # per user, must be >= AI_MAX_QUESTIONS
+AI_MAX_IN_FLIGHT = int(os.getenv('AI_MAX_IN_FLIGHT', 4))  # per worker process
+AI_MAX_QUEUED = int(os.getenv('AI_MAX_QUEUED', 8))  # per worker process
+AI_QUEUE_TIMEOUT = float(os.getenv('AI_QUEUE_TIMEOUT', 5))  # seconds
 # Email Configuration for Development
 # In settings.py
 
@@ -41,6 +68,56 @@ ANYMAIL = {
 
 DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL")
 
+# --- EMAIL OUTBOX (quiz_app/outbox.py) ---
+# Emails are queued in the database and sent in batches, one connection per batch.
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 6))  # then the email is dead-lettered
+OUTBOX_RETRY_BACKOFF = int(os.getenv('OUTBOX_RETRY_BACKOFF', 60))  # seconds, doubled every try
+# Wait this long after queueing an email before sending, so emails queued together go together.
+OUTBOX_FLUSH_DELAY = int(os.getenv('OUTBOX_FLUSH_DELAY', 5))  # seconds
+
+# --- BACKGROUND TASKS (django-background-tasks) ---
+# Study guides are generated, rendered and emailed by `python manage.py process_tasks`.
+# Each pipeline stage retries on its own with backoff; give up after a few tries
+# instead of the library default of 25.
+MAX_ATTEMPTS = int(os.getenv('BACKGROUND_TASK_MAX_ATTEMPTS', 5))
+
+# --- QUIZ ACCESS CODES ---
+# How many access codes each process reserves from the database at a time.
+ACCESS_CODE_BLOCK_SIZE = int(os.getenv('ACCESS_CODE_BLOCK_SIZE', 50))
+# Key for the shuffle that turns sequence numbers into codes (its own key, not
+# SECRET_KEY, so rotating the secret doesn't change the codes). Changing it
+# makes older codes come up again now and then; set it once per deployment.
+ACCESS_CODE_KEY = os.getenv('ACCESS_CODE_KEY', 'smartstudy-access-codes')
+
+# --- CACHING ---
+# Each worker keeps its own in-memory cache. Point this at Redis or Memcached
+# to share cached quiz pages between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'smartstudy',
+    }
+}
+
+# How long a student quiz page's questions may stay cached. Entries are keyed by
+# the quiz's version, so an edit takes effect in every worker right away.
+QUIZ_DISPLAY_CACHE_TIMEOUT = int(os.getenv('QUIZ_DISPLAY_CACHE_TIMEOUT', 60 * 60))  # seconds
+
+# --- STUDY GUIDE CACHE ---
+# Students who miss the same questions on a quiz share one generated guide.
+STUDY_GUIDE_CACHE_MAX_AGE = int(os.getenv('STUDY_GUIDE_CACHE_MAX_AGE', 30 * 24 * 60 * 60))  # seconds
+STUDY_GUIDE_CACHE_MAX_BYTES = int(os.getenv('STUDY_GUIDE_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# Study guides for the same quiz requested within this window share one LLM call.
+STUDY_GUIDE_BATCH_WINDOW = int(os.getenv('STUDY_GUIDE_BATCH_WINDOW', 10))  # seconds
+STUDY_GUIDE_BATCH_MAX_SIZE = int(os.getenv('STUDY_GUIDE_BATCH_MAX_SIZE', 10))  # guides per call
+# Ask the LLM for study guides as JSON (structured output) instead of plain text.
+STUDY_GUIDE_STRUCTURED_OUTPUT = os.getenv('STUDY_GUIDE_STRUCTURED_OUTPUT', 'True').lower() == 'true'
+# Make study guides from similar questions already in the bank when it has
+# good enough matches, instead of asking the LLM (see quiz_app/question_bank.py).
+STUDY_GUIDE_FROM_QUESTION_BANK = os.getenv('STUDY_GUIDE_FROM_QUESTION_BANK', 'True').lower() == 'true'
+STUDY_GUIDE_BANK_MIN_CONFIDENCE = float(os.getenv('STUDY_GUIDE_BANK_MIN_CONFIDENCE', 0.3))  # 0 to 1
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -81,7 +158,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'config.middleware.AsyncWhiteNoiseMiddleware',
+    'config.middleware.ServerTimingMiddleware',
+    'config.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +170,41 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# --- METRICS (GET /metrics, see quiz_app/metrics.py) ---
+# If set, Prometheus has to send "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+# A directory every process (web workers and process_tasks) writes its numbers
+# to, so /metrics can add them all up. It has to be on the same machine or a
+# shared volume. Empty: /metrics only shows the worker that answered.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+# How often each process rewrites its file (from a background thread), in seconds.
+METRICS_DUMP_INTERVAL = float(os.getenv('METRICS_DUMP_INTERVAL', 5))
+
+# --- QUERY BUDGETS (config.middleware.QueryBudgetMiddleware) ---
+# The most database queries a request to each URL name should run; requests
+# over budget are logged. quiz_app/tests.py checks every quiz_app URL.
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', 20))
+QUERY_BUDGETS = {
+    # 9 once the quiz's answer key and stats exist (8 without an Idempotency-Key).
+    # The first submission after the quiz is created or edited also compiles
+    # the key (3) and creates the stats row (3).
+    'quiz_app:submit_quiz': 15,
+    'quiz_app:submit_quiz_async': 15,
+    'quiz_app:api_dashboard_data': 5,
+    # 7, plus 4 when the request has to reserve a new block of access codes.
+    'quiz_app:api_save_quiz': 11,
+    'quiz_app:api_generate_ai': 11,
+    'quiz_app:api_generate_ai_async': 11,
+    # 1 per streamed question plus 6 (plus 4 when reserving access codes), for
+    # quizzes of up to AI_MAX_QUESTIONS (50) questions. Counted until the stream ends.
+    'quiz_app:api_generate_ai_stream': 60,
+    'quiz_app:api_delete_quiz': 16,
+    'quiz_app:api_item_analysis': 3,
+    'quiz_app:api_cache_stats': 0,
+    'quiz_app:api_submission_status': 1,
+    'quiz_app:quiz_display': 2,
+}
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -130,6 +244,12 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Under concurrent submissions, SQLite transactions that start reading and
+    # then write fail at once with "database is locked". Taking the write lock
+    # at BEGIN makes them wait their turn (up to `timeout` seconds) instead.
+    DATABASES['default'].setdefault('OPTIONS', {}).update({'transaction_mode': 'IMMEDIATE', 'timeout': 20})
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -28,6 +28,9 @@ urlpatterns = [
     # The main URL for your dashboard
     path('dashboard/', quiz_views.teacher_dashboard_view, name='teacher_dashboard'),
 
+    # Prometheus scrapes this (see quiz_app/metrics.py)
+    path('metrics', quiz_views.metrics_view, name='metrics'),
+
     # Include your other apps
     path('quiz/', include("quiz_app.urls")),
     path('accounts/', include("accounts.urls")),
@@ -1,37 +1,27 @@
 # In quiz_app/admin.py
-import csv
-from django.http import HttpResponse
 from django.contrib import admin
-from .models import Quiz, Question, Submission
+from . import outbox, rescore, tasks
+from .exports import stream_submissions_csv
+from .models import Quiz, Question, Submission, StudyGuide, OutboxEmail, RescoreJob
 
-# --- This is the new function that handles the CSV export ---
+# --- CSV export (streamed, see quiz_app/exports.py) ---
 def export_to_csv(modeladmin, request, queryset):
-    # Set up the response to be a downloadable CSV file
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="submissions.csv"'
-    
-    # Create a CSV writer
-    writer = csv.writer(response)
-    
-    # Write the header row
-    writer.writerow(['Quiz Title', 'Student Name', 'Email', 'Score', 'Submitted At'])
-    
-    # Write the data rows
-    for submission in queryset:
-        writer.writerow([
-            submission.quiz.title,
-            submission.student_name,
-            submission.student_email,
-            submission.score,
-            submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S') # Format the date
-        ])
-        
-    return response
+    return stream_submissions_csv(queryset)
 
 # Give the action a user-friendly name in the admin
 export_to_csv.short_description = "Export Selected Submissions to CSV"
 # ----------------------------------------------------------------
 
+# --- Rescoring (see quiz_app/rescore.py) ---
+def rescore_submissions(modeladmin, request, queryset):
+    for quiz in queryset:
+        job = rescore.start(quiz.id)
+        tasks.rescore_quiz(job.id)
+    modeladmin.message_user(request, f"Rescoring {queryset.count()} quiz(zes) in the background. Progress is under Rescore jobs.")
+
+rescore_submissions.short_description = "Rescore submissions (after fixing a question)"
+# ----------------------------------------------------------------
+
 class SubmissionInline(admin.TabularInline):
     model = Submission
     extra = 0
@@ -43,11 +33,42 @@ class QuestionInline(admin.TabularInline):
 
 @admin.register(Quiz)
 class QuizAdmin(admin.ModelAdmin):
-    list_display = ('title', 'access_code', 'created_at')
+    list_display = ('title', 'access_code', 'share_in_question_bank', 'created_at')
+    list_filter = ('share_in_question_bank',)
     inlines = [QuestionInline, SubmissionInline]
+    actions = [rescore_submissions]
 
 @admin.register(Submission)
 class SubmissionAdmin(admin.ModelAdmin):
     list_display = ('student_name', 'student_email', 'quiz', 'score', 'submitted_at')
     list_filter = ('quiz', 'submitted_at')
-    actions = [export_to_csv] # <-- Add the new action here
\ No newline at end of file
+    list_select_related = ('quiz',)  # one query for the list, not one per row
+    actions = [export_to_csv] # <-- Add the new action here
+
+@admin.register(StudyGuide)
+class StudyGuideAdmin(admin.ModelAdmin):
+    list_display = ('submission', 'stages', 'updated_at')
+    readonly_fields = ('submission', 'missed_question_ids', 'stages', 'text', 'error', 'updated_at')
+    exclude = ('pdf',)
+
+# --- Email outbox (see quiz_app/outbox.py) ---
+def requeue_dead_emails(modeladmin, request, queryset):
+    count = outbox.requeue_dead(queryset)
+    modeladmin.message_user(request, f"Queued {count} dead email(s) to be sent again.")
+
+requeue_dead_emails.short_description = "Retry selected dead emails"
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'to', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    readonly_fields = ('study_guide', 'attempts', 'claimed_by', 'last_error', 'created_at', 'sent_at')
+    exclude = ('attachment',)
+    actions = [requeue_dead_emails]
+
+@admin.register(RescoreJob)
+class RescoreJobAdmin(admin.ModelAdmin):
+    list_display = ('quiz', 'status', 'processed', 'total', 'changed', 'updated_at')
+    list_filter = ('status',)
+    readonly_fields = ('quiz', 'status', 'key_hash', 'last_submission_id', 'total', 'processed', 'changed',
+                       'started_at', 'updated_at', 'finished_at')
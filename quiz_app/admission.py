@@ -0,0 +1,324 @@
+# In quiz_app/admission.py
+# Admission control for the views that call the LLM (the AI quiz generator).
+#
+# Two limits, checked before any LLM call is made:
+#   - Per user, a token bucket of questions: each request costs the number of
+#     questions it asks for, and the bucket refills at AI_QUESTIONS_PER_MINUTE
+#     up to AI_QUESTIONS_BURST. One teacher asking for 100-question quizzes
+#     runs out long before everyone else does.
+#   - Per worker, at most AI_MAX_IN_FLIGHT generations at once. Up to
+#     AI_MAX_QUEUED more wait (first come, first served) for AI_QUEUE_TIMEOUT
+#     seconds at most; anything past that is turned away straight away.
+# Either way a request that can't run gets a 429 with a Retry-After header
+# instead of tying up a worker, so students submitting quizzes still get one.
+#
+# Like the circuit breaker in ai.py, the limits live in each worker process.
+# That is what the in-flight cap is for (a worker's own capacity), but it
+# means the per-user budget is per worker too: with N web workers a user can
+# generate up to N times AI_QUESTIONS_BURST questions at once, and N times
+# AI_QUESTIONS_PER_MINUTE a minute. To protect the Gemini quota, divide the
+# numbers by the number of workers (see config/settings.py).
+# Their state is in the cache stats API and /metrics (ai_in_flight, ai_queued
+# and the admission_* counters); time spent waiting is the queue_wait stage.
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+admitted = metrics.counter('admission_admitted', 'LLM requests let through')
+queued = metrics.counter('admission_queued', 'LLM requests that had to wait for a free slot')
+rate_limited = metrics.counter('admission_rejected_rate_limit', "LLM requests over their user's question budget")
+queue_full = metrics.counter('admission_rejected_queue_full', 'LLM requests turned away because the queue was full')
+timed_out = metrics.counter('admission_rejected_timeout', 'LLM requests that waited too long for a slot')
+cancelled = metrics.counter('admission_cancelled', 'Queued LLM requests whose client went away')
+
+
+class Rejected(Exception):
+    """The request can't run now; try again in `retry_after` seconds."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate  # tokens per second
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost):
+        """Takes `cost` tokens and returns 0, or returns how many seconds until there are enough."""
+        self.refill()
+        if cost <= self.tokens:
+            self.tokens -= cost
+            return 0
+        if cost > self.capacity or not self.rate:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def give_back(self, cost):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class Waiter:
+    """A request waiting for a slot. grant() hands it one, from any thread."""
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        if loop is None:
+            self.event = threading.Event()
+        else:
+            self.future = loop.create_future()
+
+    def grant(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+
+class Limiter:
+    # Once there are this many buckets, full ones (idle users) are dropped.
+    MAX_BUCKETS = 10_000
+
+    def __init__(self, questions_per_minute=100, burst=100, max_in_flight=4, max_queued=8, queue_timeout=5,
+                 clock=time.monotonic):
+        self.rate = questions_per_minute / 60
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.buckets = {}
+        self.in_flight = 0
+        self.waiters = deque()
+        self._lock = threading.Lock()
+
+    def bucket(self, key):
+        if key not in self.buckets:
+            if len(self.buckets) >= self.MAX_BUCKETS:
+                for k, b in list(self.buckets.items()):
+                    b.refill()
+                    if b.tokens >= b.capacity:
+                        del self.buckets[k]
+            self.buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+        return self.buckets[key]
+
+    def try_admit(self, key, cost, loop=None):
+        """
+        Returns None if the request can run now, or a Waiter to wait on.
+        Raises Rejected if it's over its user's budget or the queue is full.
+        """
+        with self._lock:
+            wait = self.bucket(key).take(cost)
+            if wait:
+                rate_limited.inc()
+                if wait == math.inf:
+                    raise Rejected(f"At most {self.burst} questions can be generated at a time.", 60)
+                raise Rejected("Too many questions generated recently, please wait a moment.", wait)
+            if self.in_flight < self.max_in_flight and not self.waiters:
+                self.in_flight += 1
+                admitted.inc()
+                return None
+            if len(self.waiters) >= self.max_queued:
+                self.buckets[key].give_back(cost)
+                queue_full.inc()
+                raise Rejected("The AI generator is busy, please try again shortly.", self.queue_timeout)
+            waiter = Waiter(loop)
+            self.waiters.append(waiter)
+            queued.inc()
+            return waiter
+
+    def give_up(self, waiter, key, cost):
+        """
+        Called when a waiter stops waiting (timed out or cancelled). Returns
+        True if it was still queued (and is now out of the queue), False if
+        it was granted a slot just in time, which it then has to release().
+        """
+        with self._lock:
+            if waiter not in self.waiters:
+                return False
+            self.waiters.remove(waiter)
+            self.bucket(key).give_back(cost)
+        return True
+
+    def stop_waiting(self, waiter, key, cost):
+        """The waiting request went away (its client disconnected): leave the queue, or hand back the slot."""
+        cancelled.inc()
+        if not self.give_up(waiter, key, cost):
+            self.release()
+
+    def admit(self, key, cost):
+        """Waits for a slot. Call release() when done."""
+        waiter = self.try_admit(key, cost)
+        if waiter is None:
+            return
+        try:
+            with metrics.span('queue_wait'):
+                granted = waiter.event.wait(self.queue_timeout)
+        except BaseException:
+            self.stop_waiting(waiter, key, cost)
+            raise
+        if not granted and self.give_up(waiter, key, cost):
+            timed_out.inc()
+            raise Rejected("The AI generator is busy, please try again shortly.", self.queue_timeout)
+        admitted.inc()
+
+    async def aadmit(self, key, cost):
+        """admit() for async views; waits without blocking the event loop."""
+        waiter = self.try_admit(key, cost, loop=asyncio.get_running_loop())
+        if waiter is None:
+            return
+        try:
+            with metrics.span('queue_wait'):
+                await asyncio.wait([waiter.future], timeout=self.queue_timeout)
+        except BaseException:
+            # Usually CancelledError: the client disconnected while queued. Left
+            # in the queue, the waiter would be handed a slot nobody releases.
+            self.stop_waiting(waiter, key, cost)
+            raise
+        if not waiter.future.done() and self.give_up(waiter, key, cost):
+            timed_out.inc()
+            raise Rejected("The AI generator is busy, please try again shortly.", self.queue_timeout)
+        admitted.inc()
+
+    def release(self):
+        """Frees a slot, handing it straight to the longest-waiting request if there is one."""
+        with self._lock:
+            if self.waiters:
+                self.waiters.popleft().grant()
+            else:
+                self.in_flight -= 1
+
+    def state(self):
+        with self._lock:
+            return {
+                'in_flight': self.in_flight,
+                'queued': len(self.waiters),
+                'max_in_flight': self.max_in_flight,
+                'max_queued': self.max_queued,
+                'users': len(self.buckets),
+            }
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """The process-wide limiter, built from settings the first time it's used."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = Limiter(
+                questions_per_minute=settings.AI_QUESTIONS_PER_MINUTE,
+                burst=settings.AI_QUESTIONS_BURST,
+                max_in_flight=settings.AI_MAX_IN_FLIGHT,
+                max_queued=settings.AI_MAX_QUEUED,
+                queue_timeout=settings.AI_QUEUE_TIMEOUT,
+            )
+        return _limiter
+
+
+@receiver(setting_changed)
+def reset_limiter(setting=None, **kwargs):
+    """Rebuilds the limiter after override_settings() touches an AI_ setting."""
+    global _limiter
+    if setting is None or setting.startswith('AI_'):
+        with _limiter_lock:
+            _limiter = None
+
+
+metrics.gauge('ai_in_flight', 'LLM requests running in this worker', lambda: get_limiter().in_flight)
+metrics.gauge('ai_queued', 'LLM requests waiting for a slot in this worker', lambda: len(get_limiter().waiters))
+
+
+def user_key(request, user=None):
+    """Whose budget a request comes out of: the logged-in user, or else the client's address."""
+    user = user or request.user
+    if user.is_authenticated:
+        return f"user:{user.pk}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def request_cost(data):
+    """
+    The number of questions a generate request asks for, which is what it
+    costs. Raises ValueError if it isn't a number from 1 to AI_MAX_QUESTIONS.
+    """
+    count = data.get('count')
+    if count is None:
+        return settings.AI_DEFAULT_QUESTIONS
+    if isinstance(count, bool) or not isinstance(count, (int, str)):
+        raise ValueError("count must be a number")
+    count = int(count)
+    if not 1 <= count <= settings.AI_MAX_QUESTIONS:
+        raise ValueError(f"count must be between 1 and {settings.AI_MAX_QUESTIONS}")
+    return count
+
+
+@contextmanager
+def slot(request, cost):
+    """Holds one of this worker's LLM slots for the block. Raises Rejected."""
+    limiter = get_limiter()
+    limiter.admit(user_key(request), cost)
+    try:
+        yield
+    finally:
+        limiter.release()
+
+
+@asynccontextmanager
+async def aslot(request, cost):
+    limiter = get_limiter()
+    await limiter.aadmit(user_key(request, await request.auser()), cost)
+    try:
+        yield
+    finally:
+        limiter.release()
+
+
+class Holding:
+    """
+    Wraps a streaming response's content so the slot is held until the
+    stream ends, or until Django closes the response (client went away).
+    """
+
+    def __init__(self, limiter, content):
+        self.limiter = limiter
+        self.content = content
+        self.released = False
+
+    def __iter__(self):
+        try:
+            yield from self.content
+        finally:
+            self.close()
+
+    def close(self):
+        if not self.released:
+            self.released = True
+            self.limiter.release()
+
+
+def hold_while_streaming(request, cost, content):
+    """Takes a slot now (raises Rejected) and returns `content` wrapped to give it back."""
+    limiter = get_limiter()
+    limiter.admit(user_key(request), cost)
+    return Holding(limiter, content)
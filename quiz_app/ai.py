@@ -0,0 +1,488 @@
+# In quiz_app/ai.py
+# The one way the app talks to the LLM. Used by the views and the background tasks:
+#   text = ai.generate_content(prompt)
+#   text = await ai.agenerate_content(prompt)
+#   for chunk in ai.stream_content(prompt): ...   (text as it is generated)
+# Each takes an optional `schema`: the answer is then JSON following that
+# schema (Gemini's structured output), e.g. study_guide_parser.STUDY_GUIDE_SCHEMA.
+#
+# settings.LLM_BACKEND picks who answers:
+#   'gemini' - Gemini's REST API over pooled keep-alive connections (httpx)
+#   'stub'   - a deterministic local stand-in for offline runs and load tests.
+#              Answers recorded in LLM_REPLAY_FILE are replayed as-is.
+#
+# Every call gets LLM_DEADLINE seconds in total. Timeouts, connection errors,
+# 429s and 5xx answers are retried with jittered exponential backoff until
+# the deadline or LLM_MAX_RETRIES runs out. After LLM_BREAKER_THRESHOLD
+# failed calls in a row the circuit breaker opens and calls fail at once
+# (AIUnavailableError) for LLM_BREAKER_RESET seconds, so a Gemini outage
+# can't tie up every worker until gunicorn kills it.
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+
+
+class AIError(Exception):
+    pass
+
+
+class AIResponseError(AIError):
+    """The LLM answered, but not with anything we can use."""
+
+
+class AIUnavailableError(AIError):
+    """The LLM couldn't be reached in time, or the circuit breaker is open."""
+
+
+class RetryableError(AIError):
+    """One attempt failed in a way that is worth trying again."""
+
+
+def _response_text(payload):
+    """Pulls the generated text out of a generateContent response."""
+    try:
+        parts = payload['candidates'][0]['content']['parts']
+    except (KeyError, IndexError, TypeError) as e:
+        raise AIResponseError(f"Unexpected Gemini response: {payload}") from e
+    return ''.join(part.get('text', '') for part in parts)
+
+
+def _chunk_text(payload):
+    """The text in one streamed chunk (the last one may only say why it stopped)."""
+    candidates = payload.get('candidates') or [{}]
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    return ''.join(part.get('text', '') for part in parts)
+
+
+# --------------------------------------------------------------------------
+# --- BACKENDS ---
+# --------------------------------------------------------------------------
+
+class GeminiBackend:
+    """Gemini's generateContent REST endpoint."""
+
+    def __init__(self, api_key, model, base_url, max_connections):
+        # httpx is only imported once a backend is built (on the first call),
+        # so loading the URLconf or running manage.py doesn't pay for it.
+        import httpx
+
+        self.httpx = httpx
+        self.api_key = api_key or ''
+        self.path = f"/v1beta/models/{model}:generateContent"
+        self.stream_path = f"/v1beta/models/{model}:streamGenerateContent?alt=sse"
+        self.base_url = base_url
+        self.limits = self.httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        # One blocking client shared by all threads (httpx clients are thread
+        # safe), and one async client per event loop (they can't be shared).
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        with self._client_lock:
+            if self._client is None:
+                self._client = self.httpx.Client(base_url=self.base_url, limits=self.limits)
+            return self._client
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self.httpx.AsyncClient(base_url=self.base_url, limits=self.limits)
+            self._async_clients[loop] = client
+        return client
+
+    def request_kwargs(self, prompt, timeout, schema=None):
+        body = {'contents': [{'parts': [{'text': prompt}]}]}
+        if schema is not None:
+            body['generationConfig'] = {'responseMimeType': 'application/json', 'responseSchema': schema}
+        return {
+            'headers': {'x-goog-api-key': self.api_key},
+            'json': body,
+            'timeout': timeout,
+        }
+
+    def handle_response(self, response):
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RetryableError(f"Gemini returned HTTP {response.status_code}")
+        if response.status_code >= 400:
+            raise AIResponseError(f"Gemini returned HTTP {response.status_code}: {response.text[:200]}")
+        return _response_text(response.json())
+
+    def generate(self, prompt, timeout, schema=None):
+        try:
+            response = self.client().post(self.path, **self.request_kwargs(prompt, timeout, schema))
+        except self.httpx.TransportError as e:
+            raise RetryableError(f"Gemini request failed: {e!r}") from e
+        return self.handle_response(response)
+
+    async def agenerate(self, prompt, timeout, schema=None):
+        try:
+            response = await self.async_client().post(self.path, **self.request_kwargs(prompt, timeout, schema))
+        except self.httpx.TransportError as e:
+            raise RetryableError(f"Gemini request failed: {e!r}") from e
+        return self.handle_response(response)
+
+    def stream(self, prompt, timeout, schema=None):
+        # With alt=sse every "data:" line is a small generateContent response.
+        try:
+            with self.client().stream('POST', self.stream_path, **self.request_kwargs(prompt, timeout, schema)) as response:
+                if response.status_code >= 400:
+                    response.read()
+                    self.handle_response(response)
+                for line in response.iter_lines():
+                    if line.startswith('data:'):
+                        yield _chunk_text(json.loads(line[5:]))
+        except self.httpx.TransportError as e:
+            raise RetryableError(f"Gemini request failed: {e!r}") from e
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+
+
+def prompt_key(prompt):
+    """How a prompt is looked up in a replay file."""
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+
+class StubBackend:
+    """
+    Answers locally, after `latency` seconds, without any network.
+    The same prompt always gets the same answer. If a replay file is given
+    (a JSON object of prompt_key(prompt) -> text), recorded answers win.
+    """
+
+    # How much text each streamed chunk carries.
+    CHUNK_SIZE = 40
+
+    def __init__(self, latency=0, replay_file=None):
+        self.latency = latency
+        self.replay = {}
+        if replay_file:
+            with open(replay_file, encoding='utf-8') as f:
+                self.replay = json.load(f)
+
+    def answer(self, prompt, schema=None):
+        key = prompt_key(prompt)
+        if key in self.replay:
+            return self.replay[key]
+        seed = int(key[:8], 16)
+        students = re.findall(r'^=== STUDENT (\d+) ===$', prompt, re.MULTILINE)
+        if schema is not None:
+            # A structured study guide, for one student or several.
+            if 'guides' in schema.get('properties', {}):
+                return json.dumps({'guides': [
+                    {'student': int(n), 'questions': self.study_guide_questions(f'{key[:6]}-{n}', seed + int(n))}
+                    for n in students
+                ]})
+            return json.dumps({'questions': self.study_guide_questions(key[:6], seed)})
+        if "'questions'" in prompt:
+            # The AI quiz generator wants a JSON quiz with `count` questions.
+            match = re.search(r'exactly (\d+) multiple-choice', prompt)
+            count = int(match.group(1)) if match else 5
+            return json.dumps({'questions': [{
+                'text': f"Practice question {i + 1} ({key[:6]})?",
+                'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+                'correctIndex': (seed + i) % 4,
+            } for i in range(count)]})
+        # Anything else is a study guide request, maybe for several students at once.
+        if students:
+            return '\n'.join(
+                f"=== STUDENT {n} ===\n{self.study_guide(f'{key[:6]}-{n}', seed + int(n))}"
+                for n in students
+            )
+        return self.study_guide(key[:6], seed)
+
+    def study_guide_questions(self, label, seed):
+        return [{
+            'topic': f"Topic {i + 1}",
+            'text': f"Practice question {i + 1} ({label})?",
+            'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+            'answer': 'ABCD'[(seed + i) % 4],
+        } for i in range(5)]
+
+    def study_guide(self, label, seed):
+        return '\n'.join(
+            f"Fundamental Topic: {q['topic']}\n"
+            f"Practice Question: {q['text']}\n"
+            + ''.join(f"{letter}) {option}\n" for letter, option in zip('ABCD', q['options']))
+            + f"Correct Answer: {q['answer']}\n"
+            for q in self.study_guide_questions(label, seed)
+        )
+
+    def generate(self, prompt, timeout, schema=None):
+        if self.latency:
+            time.sleep(min(self.latency, timeout))
+        return self.answer(prompt, schema)
+
+    async def agenerate(self, prompt, timeout, schema=None):
+        if self.latency:
+            await asyncio.sleep(min(self.latency, timeout))
+        return self.answer(prompt, schema)
+
+    def stream(self, prompt, timeout, schema=None):
+        text = self.answer(prompt, schema)
+        chunks = [text[i:i + self.CHUNK_SIZE] for i in range(0, len(text), self.CHUNK_SIZE)]
+        # Spread the latency over the chunks, like a model generating tokens.
+        delay = self.latency / max(len(chunks), 1)
+        for chunk in chunks:
+            if delay:
+                time.sleep(min(delay, timeout))
+            yield chunk
+
+    def close(self):
+        pass
+
+
+# --------------------------------------------------------------------------
+# --- DEADLINES, RETRIES AND THE CIRCUIT BREAKER ---
+# --------------------------------------------------------------------------
+
+class CircuitBreaker:
+    """
+    closed:    calls go through; `threshold` failures in a row open it.
+    open:      calls are refused until `reset_timeout` seconds have passed.
+    half-open: one trial call goes through; success closes, failure re-opens.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.trial_running = False
+
+
+calls = metrics.counter('llm_calls', 'LLM calls started')
+retries = metrics.counter('llm_retries', 'LLM attempts retried')
+failures = metrics.counter('llm_failures', 'LLM calls that gave up')
+rejected = metrics.counter('llm_breaker_rejections', 'LLM calls refused by the open circuit breaker')
+
+
+class LLMClient:
+    """Wraps a backend with a per-call deadline, retries and a circuit breaker."""
+
+    def __init__(self, backend, deadline=25, attempt_timeout=15, max_retries=3,
+                 backoff=0.5, breaker=None, clock=time.monotonic):
+        self.backend = backend
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.clock = clock
+
+    def _attempts(self):
+        """
+        Yields (seconds to wait first, timeout) for each try, until the
+        deadline or the retry budget runs out.
+        """
+        give_up_at = self.clock() + self.deadline
+        for attempt in range(self.max_retries + 1):
+            remaining = give_up_at - self.clock()
+            if remaining <= 0:
+                return
+            # "Full jitter": wait a random time up to the exponential step.
+            delay = random.uniform(0, self.backoff * 2 ** (attempt - 1)) if attempt else 0
+            if delay >= remaining:
+                return
+            yield delay, min(self.attempt_timeout, remaining - delay)
+
+    def _start(self):
+        calls.inc()
+        if not self.breaker.allow():
+            rejected.inc()
+            raise AIUnavailableError("The AI service is unavailable right now. Please try again shortly.")
+
+    def _give_up(self, error):
+        """error is the last attempt's, or None if the deadline left no time for any attempt."""
+        failures.inc()
+        self.breaker.record_failure()
+        if error is None:
+            error = RetryableError(f"no time left for an attempt within the {self.deadline}s deadline")
+        raise AIUnavailableError(f"The AI service did not answer in time: {error}") from error
+
+    def generate(self, prompt, schema=None):
+        self._start()
+        error = None
+        for delay, timeout in self._attempts():
+            if error is not None:
+                retries.inc()
+                time.sleep(delay)
+            try:
+                text = self.backend.generate(prompt, timeout, schema)
+            except RetryableError as e:
+                error = e
+                continue
+            except Exception:
+                # A bad answer isn't an outage, so it doesn't trip the breaker.
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return text
+        self._give_up(error)
+
+    async def agenerate(self, prompt, schema=None):
+        self._start()
+        error = None
+        for delay, timeout in self._attempts():
+            if error is not None:
+                retries.inc()
+                await asyncio.sleep(delay)
+            try:
+                text = await self.backend.agenerate(prompt, timeout, schema)
+            except RetryableError as e:
+                error = e
+                continue
+            except Exception:
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return text
+        self._give_up(error)
+
+    def stream(self, prompt, schema=None):
+        """
+        Yields the answer's text as it arrives. An attempt is only retried
+        if it fails before the first chunk; after that the caller already
+        has part of the answer, so the error is raised instead.
+        """
+        self._start()
+        error = None
+        for delay, timeout in self._attempts():
+            if error is not None:
+                retries.inc()
+                time.sleep(delay)
+            started = False
+            try:
+                for chunk in self.backend.stream(prompt, timeout, schema):
+                    started = True
+                    yield chunk
+            except RetryableError as e:
+                if started:
+                    self._give_up(e)
+                error = e
+                continue
+            except (Exception, GeneratorExit):
+                # Includes the caller stopping early, which isn't an outage either.
+                self.breaker.record_success()
+                raise
+            self.breaker.record_success()
+            return
+        self._give_up(error)
+
+
+# --------------------------------------------------------------------------
+# --- THE SHARED CLIENT ---
+# --------------------------------------------------------------------------
+
+BACKENDS = {
+    'gemini': lambda: GeminiBackend(
+        api_key=settings.GEMINI_API_KEY,
+        model=settings.GEMINI_MODEL,
+        base_url=settings.GEMINI_API_BASE_URL,
+        max_connections=settings.GEMINI_MAX_CONNECTIONS,
+    ),
+    'stub': lambda: StubBackend(
+        latency=settings.LLM_STUB_LATENCY,
+        replay_file=settings.LLM_REPLAY_FILE,
+    ),
+}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The process-wide LLMClient, built from settings the first time it's used."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            if settings.LLM_BACKEND not in BACKENDS:
+                raise AIError(f"Unknown LLM_BACKEND {settings.LLM_BACKEND!r}, expected one of {sorted(BACKENDS)}")
+            _client = LLMClient(
+                BACKENDS[settings.LLM_BACKEND](),
+                deadline=settings.LLM_DEADLINE,
+                attempt_timeout=settings.GEMINI_TIMEOUT,
+                max_retries=settings.LLM_MAX_RETRIES,
+                backoff=settings.LLM_RETRY_BACKOFF,
+                breaker=CircuitBreaker(settings.LLM_BREAKER_THRESHOLD, settings.LLM_BREAKER_RESET),
+            )
+        return _client
+
+
+@receiver(setting_changed)
+def reset_client(setting=None, **kwargs):
+    """Rebuilds the client after override_settings() touches an LLM setting."""
+    global _client
+    if setting is None or setting.startswith(('LLM_', 'GEMINI_')):
+        with _client_lock:
+            if _client is not None:
+                _client.backend.close()
+            _client = None
+
+
+def generate_content(prompt, schema=None):
+    """Sends a prompt to the LLM and returns the text of its answer."""
+    with metrics.span('llm'):
+        return get_client().generate(prompt, schema)
+
+
+async def agenerate_content(prompt, schema=None):
+    """Async version of generate_content(), for the async views."""
+    with metrics.span('llm'):
+        return await get_client().agenerate(prompt, schema)
+
+
+def stream_content(prompt, schema=None):
+    """Like generate_content(), but yields the text in chunks as the LLM writes it."""
+    with metrics.span('llm'):
+        yield from get_client().stream(prompt, schema)
@@ -0,0 +1,117 @@
+# In quiz_app/analytics.py
+# Item analysis for a quiz: how hard each question was, how well it separated
+# strong students from weak ones, and which wrong options students picked.
+#
+# A quiz's submissions are loaded once into a (students x questions) array of
+# chosen option indexes (-1 = no answer / unknown answer). Every metric is
+# then computed with whole-array NumPy operations.
+import numpy as np
+
+from .answer_key import QUESTION_ORDER, option_index
+from .models import Submission
+
+# Share of students at the top and bottom used for the discrimination index.
+GROUP_FRACTION = 0.27
+
+BLANK = -1
+
+
+def load_responses(quiz):
+    """
+    Returns (questions, responses, answer_key):
+      questions:  the quiz's Questions, in the order they were shown
+      responses:  int16 array, one row per submission, one column per question
+      answer_key: int16 array of each question's correct_index
+    """
+    questions = list(quiz.questions.order_by(*QUESTION_ORDER))
+    answer_key = np.array([q.correct_index for q in questions], dtype=np.int16)
+
+    # Submissions store the chosen option's text under the question's position.
+    # It is turned back into an index the way scoring does (answer_key.py).
+    keys = [str(i) for i in range(len(questions))]
+    option_maps = [option_index(q.options, q.correct_index) for q in questions]
+    columns = list(zip(keys, option_maps))
+
+    answers = Submission.objects.filter(quiz=quiz).values_list('answers', flat=True)
+    rows = [
+        [option_map.get(row.get(key), BLANK) for key, option_map in columns]
+        for row in answers.iterator(chunk_size=2000)
+    ]
+    responses = np.array(rows, dtype=np.int16).reshape(len(rows), len(questions))
+    return questions, responses, answer_key
+
+
+def item_statistics(responses, answer_key, num_options):
+    """
+    Computes every metric from the response array. Returns a dict of arrays:
+      difficulty:     share of students who got each question right (p-value)
+      discrimination: p(top group) - p(bottom group), by total score
+      point_biserial: correlation of each question with the rest of the quiz
+      option_counts:  (questions x num_options) how often each option was picked
+      blank_counts:   how often each question was left blank
+    """
+    students, num_questions = responses.shape
+    correct = (responses == answer_key[np.newaxis, :]).astype(np.float64)
+    totals = correct.sum(axis=1)
+
+    if students:
+        difficulty = correct.mean(axis=0)
+    else:
+        difficulty = np.zeros(num_questions)
+
+    # Discrimination index: compare the top and bottom GROUP_FRACTION of students.
+    group_size = max(int(round(students * GROUP_FRACTION)), 1) if students else 0
+    if group_size:
+        order = np.argsort(totals, kind='stable')
+        bottom = correct[order[:group_size]].mean(axis=0)
+        top = correct[order[-group_size:]].mean(axis=0)
+        discrimination = top - bottom
+    else:
+        discrimination = np.zeros(num_questions)
+
+    # Corrected point-biserial: correlate each item with the total of the *other* items.
+    rest = totals[:, np.newaxis] - correct
+    item_centered = correct - correct.mean(axis=0) if students else correct
+    rest_centered = rest - rest.mean(axis=0) if students else rest
+    covariance = (item_centered * rest_centered).sum(axis=0)
+    spread = np.sqrt((item_centered ** 2).sum(axis=0) * (rest_centered ** 2).sum(axis=0))
+    point_biserial = np.divide(covariance, spread, out=np.zeros(num_questions), where=spread > 0)
+
+    # Count every (question, option) pair at once; column 0 collects blanks.
+    slots = num_options + 1
+    flat = (np.arange(num_questions)[np.newaxis, :] * slots + (responses + 1)).ravel()
+    counts = np.bincount(flat, minlength=num_questions * slots).reshape(num_questions, slots)
+
+    return {
+        'difficulty': difficulty,
+        'discrimination': discrimination,
+        'point_biserial': point_biserial,
+        'option_counts': counts[:, 1:],
+        'blank_counts': counts[:, 0],
+    }
+
+
+def analyze_quiz(quiz):
+    """The item analysis for a quiz, ready to be returned as JSON."""
+    questions, responses, answer_key = load_responses(quiz)
+    num_options = max((len(q.options) for q in questions), default=0)
+    result = item_statistics(responses, answer_key, num_options)
+    students = responses.shape[0]
+
+    items = []
+    for i, question in enumerate(questions):
+        counts = result['option_counts'][i]
+        items.append({
+            'text': question.text,
+            'difficulty': round(float(result['difficulty'][i]), 4),
+            'discrimination': round(float(result['discrimination'][i]), 4),
+            'point_biserial': round(float(result['point_biserial'][i]), 4),
+            'blank': int(result['blank_counts'][i]),
+            'options': [{
+                'text': text,
+                'correct': j == question.correct_index,
+                'count': int(counts[j]),
+                'fraction': round(float(counts[j]) / students, 4) if students else 0.0,
+            } for j, text in enumerate(question.options)],
+        })
+    return {'students': students, 'questions': items}
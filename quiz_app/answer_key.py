@@ -0,0 +1,135 @@
+# In quiz_app/answer_key.py
+# Compiled answer keys: everything needed to score a quiz, without its questions.
+#
+# A key is {'question_ids': [...], 'correct': [...], 'options': [{text: index}, ...]},
+# one entry per question in the order the quiz page shows them. Scoring a
+# submission is then one cache lookup and a walk down two short lists.
+#
+# Keys are stored in the QuizAnswerKey table and cached in Django's cache,
+# both tagged with the Quiz.version they were compiled at. signals.py bumps
+# the version (in the database) whenever one of the quiz's questions
+# changes, so no worker scores against a key compiled before the last
+# committed edit, even though each worker has its own cache; the next
+# submission compiles a fresh one. The key pins the question order
+# (QUESTION_ORDER, which the quiz page uses too, see display_cache.py), so
+# the order students see and the order they are scored in can't drift apart.
+from django.conf import settings
+from django.core.cache import cache
+
+from accounts.models import Question, Quiz
+from .models import QuizAnswerKey
+from . import metrics
+
+# Same as the quiz page's, so a cached page and its cached key go stale together.
+CACHE_TIMEOUT = getattr(settings, 'QUIZ_DISPLAY_CACHE_TIMEOUT', 60 * 60)
+
+# How a quiz's questions are numbered, on the quiz page and in the key.
+QUESTION_ORDER = ('id',)
+
+hits = metrics.counter('answer_key_cache_hits', 'Answer keys served from the cache.')
+compiled = metrics.counter('answer_keys_compiled', 'Answer keys compiled from the questions.')
+
+
+def cache_key(quiz_id, version):
+    return f"answer_key:{quiz_id}:{version}"
+
+
+def current_version(quiz_id):
+    return Quiz.objects.values_list('version', flat=True).get(pk=quiz_id)
+
+
+def option_index(choices, correct_index):
+    """
+    {option text: index} for one question, as submissions are scored. Item
+    analysis (analytics.py) reads answers with it too, so both agree.
+    """
+    choices = choices if isinstance(choices, list) else []
+    index = {text: i for i, text in enumerate(choices) if isinstance(text, str)}
+    if 0 <= correct_index < len(choices) and isinstance(choices[correct_index], str):
+        # If two options have the same text, picking it is right.
+        index[choices[correct_index]] = correct_index
+    return index
+
+
+def build(quiz_id):
+    """Compiles the quiz's answer key straight from its questions, without storing or caching it."""
+    question_ids, correct, options = [], [], []
+    for pk, choices, correct_index in (
+        Question.objects.filter(quiz_id=quiz_id).order_by(*QUESTION_ORDER).values_list('id', 'options', 'correct_index')
+    ):
+        index = option_index(choices, correct_index)
+        if not 0 <= correct_index < len(choices if isinstance(choices, list) else []):
+            print(f"!!! DATA ERROR: Question ID {pk} has invalid index.")
+            correct_index = -1
+        question_ids.append(pk)
+        correct.append(correct_index)
+        options.append(index)
+    return {'question_ids': question_ids, 'correct': correct, 'options': options}
+
+
+def compile_key(quiz_id, version=None):
+    """Builds and stores the answer key for a quiz from its questions."""
+    if version is None:
+        version = current_version(quiz_id)
+    data = build(quiz_id)
+    # One INSERT ... ON CONFLICT DO UPDATE, so two workers compiling at once don't clash.
+    QuizAnswerKey.objects.bulk_create(
+        [QuizAnswerKey(
+            quiz_id=quiz_id,
+            question_ids=data['question_ids'],
+            correct_indices=data['correct'],
+            option_indices=data['options'],
+            quiz_version=version,
+        )],
+        update_conflicts=True,
+        unique_fields=['quiz'],
+        update_fields=['question_ids', 'correct_indices', 'option_indices', 'quiz_version', 'updated_at'],
+    )
+    compiled.inc()
+    return data
+
+
+def get(quiz_id, version=None):
+    """
+    Returns the quiz's answer key, compiling it if there isn't one for the
+    quiz's current version yet. Pass the version if the quiz row is already
+    loaded (it is looked up otherwise).
+    """
+    if version is None:
+        version = current_version(quiz_id)
+    key = cache_key(quiz_id, version)
+    data = cache.get(key)
+    if data is not None:
+        hits.inc()
+        return data
+
+    stored = QuizAnswerKey.objects.filter(quiz_id=quiz_id, quiz_version=version).values_list(
+        'question_ids', 'correct_indices', 'option_indices'
+    ).first()
+    if stored is not None:
+        data = dict(zip(['question_ids', 'correct', 'options'], stored))
+    else:
+        data = compile_key(quiz_id, version)
+    cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def score(key, answers):
+    """
+    Scores a submission's answers ({'0': option text, ...}) against a key.
+    Returns (score, IDs of the questions answered wrong).
+    """
+    points = 0
+    wrong = []
+    for i, (question_id, correct, options) in enumerate(zip(key['question_ids'], key['correct'], key['options'])):
+        submitted = answers.get(str(i))
+        if correct >= 0 and isinstance(submitted, str) and options.get(submitted) == correct:
+            points += 1
+        else:
+            wrong.append(question_id)
+    return points, wrong
+
+
+def invalidate(quiz_id):
+    """Deletes the stored key. Cached copies are keyed by version and just stop being used."""
+    QuizAnswerKey.objects.filter(quiz_id=quiz_id).delete()
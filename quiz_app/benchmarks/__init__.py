@@ -0,0 +1,67 @@
+# In quiz_app/benchmarks/__init__.py
+# Performance benchmarks, run with:
+#   python manage.py benchmark <name> [--json results.json]
+#
+# Every module in this package with a run(options) function is a benchmark.
+# run() returns a list of result rows (dicts), which the command prints as a
+# table and can also write out as JSON to compare against a saved baseline.
+# Benchmarks run against a throwaway test database, never the real one.
+import importlib
+import os
+import pkgutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def available():
+    """Maps each benchmark name to its module."""
+    return {
+        info.name: importlib.import_module(f"{__name__}.{info.name}")
+        for info in pkgutil.iter_modules(__path__)
+        if not info.name.startswith('_')
+    }
+
+
+@contextmanager
+def scratch_database():
+    """
+    Creates a fresh test database (like `manage.py test` does) and removes it
+    afterwards. Email goes to the locmem backend while it is active.
+
+    SQLite test databases normally live in memory, where threads writing at
+    the same time fail with "table is locked"; use a temporary file instead,
+    without waiting on the disk after every commit (it is thrown away anyway).
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    with tempfile.TemporaryDirectory() as tempdir:
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(tempdir, 'benchmark.sqlite3')
+            connection.settings_dict['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=OFF;'
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+
+def timed(fn, *args, **kwargs):
+    """Runs fn once and returns (seconds, result)."""
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def percentile(samples, pct):
+    """The pct-th percentile (0-100) of a list of numbers."""
+    if not samples:
+        return 0.0
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[min(max(int(pct), 1), 99) - 1]
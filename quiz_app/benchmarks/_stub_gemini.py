@@ -0,0 +1,77 @@
+# A local stand-in for Gemini's generateContent REST endpoint, for benchmarks.
+# Every request waits `latency` seconds (like a real model would) and then
+# answers with a small quiz in the same JSON shape as the real API.
+#
+# It runs as its own process (an asyncio app under uvicorn) so that hundreds
+# of open requests don't compete with the benchmark for the GIL.
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+QUIZ_JSON = json.dumps({'questions': [
+    {'text': f"Stub question {i}?", 'options': ['A', 'B', 'C', 'D'], 'correctIndex': i % 4}
+    for i in range(5)
+]})
+
+
+def make_app(latency, text):
+    body = json.dumps({'candidates': [{'content': {'parts': [{'text': text}]}}]}).encode()
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return
+        while (await receive()).get('more_body'):
+            pass
+        await asyncio.sleep(latency)
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': body})
+
+    return app
+
+
+class StubGemini:
+    def __init__(self, latency=0.2, text=QUIZ_JSON):
+        self.latency = latency
+        self.text = text
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.url = f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        env = dict(os.environ, STUB_GEMINI_TEXT=self.text)
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'quiz_app.benchmarks._stub_gemini',
+             '--port', str(self.port), '--latency', str(self.latency)],
+            env=env,
+        )
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=0.1).close()
+                return self
+            except OSError:
+                time.sleep(0.05)
+        self.process.kill()
+        raise RuntimeError("The stub Gemini server did not start.")
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait()
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    app = make_app(args.latency, os.environ.get('STUB_GEMINI_TEXT', QUIZ_JSON))
+    uvicorn.run(app, host='127.0.0.1', port=args.port, log_level='warning', backlog=4096)
@@ -0,0 +1,68 @@
+"""
+Access code allocation cost as the code space fills up.
+
+Compares the old random-code-plus-exists()-query loop with the block
+allocator in accounts/models.py. Uses 3-character codes so the code space
+(46,656) can actually be filled to 50%+ in a test database.
+"""
+import itertools
+import random
+
+from django.db import connection
+
+from accounts.models import AccessCodeAllocator, AccessCodeSequence, CODE_ALPHABET, Quiz
+from . import scratch_database, timed
+
+LENGTH = 3
+
+
+def add_arguments(parser):
+    parser.add_argument('--occupancy', type=float, nargs='+', default=[0.0, 0.5, 0.75, 0.9, 0.99])
+    parser.add_argument('--allocations', type=int, default=500)
+
+
+def retry_loop_code():
+    """The old generate_access_code, shortened to LENGTH characters."""
+    while True:
+        code = ''.join(random.choices(CODE_ALPHABET, k=LENGTH))
+        if not Quiz.objects.filter(access_code=code).exists():
+            return code
+
+
+def fill_code_space(fraction):
+    Quiz.objects.all().delete()
+    all_codes = [''.join(c) for c in itertools.product(CODE_ALPHABET, repeat=LENGTH)]
+    taken = random.sample(all_codes, int(len(all_codes) * fraction))
+    Quiz.objects.bulk_create([Quiz(title='Filler', access_code=code) for code in taken], batch_size=5000)
+
+
+def measure(allocate, count):
+    queries = 0
+
+    def count_query(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count_query):
+        seconds, _ = timed(lambda: [allocate() for _ in range(count)])
+    return seconds * 1_000_000 / count, queries / count
+
+
+def run(options):
+    rows = []
+    count = options['allocations']
+    with scratch_database():
+        for fraction in options['occupancy']:
+            fill_code_space(fraction)
+            us, queries = measure(retry_loop_code, count)
+            rows.append({'allocator': 'retry-loop', 'occupancy': fraction, 'us_per_code': us, 'queries_per_code': queries})
+
+            allocator = AccessCodeAllocator(name='benchmark', length=LENGTH)
+            space_left = allocator.space - count - allocator.block_size
+            AccessCodeSequence.objects.update_or_create(
+                name='benchmark', defaults={'next_value': min(int(allocator.space * fraction), space_left)}
+            )
+            us, queries = measure(allocator.allocate, count)
+            rows.append({'allocator': 'block', 'occupancy': fraction, 'us_per_code': us, 'queries_per_code': queries})
+    return rows
@@ -0,0 +1,45 @@
+"""
+AI quiz generation: time until the teacher sees the first question, streamed vs. not.
+
+Uses the stub LLM backend, which spreads --latency seconds over the answer
+like a model writing tokens, so the streamed view can show (and save) the
+first question long before the whole quiz is written.
+"""
+import json
+import time
+
+from django.test import Client, override_settings
+
+from . import scratch_database
+
+
+def add_arguments(parser):
+    parser.add_argument('--count', type=int, default=20, help="Questions per quiz.")
+    parser.add_argument('--latency', type=float, default=10.0, help="Seconds the stub takes for the whole answer.")
+
+
+def run(options):
+    payload = json.dumps({'subject': 'Math', 'subtopic': 'Fractions', 'gradelevel': '5', 'count': options['count']})
+    with scratch_database(), override_settings(LLM_BACKEND='stub', LLM_STUB_LATENCY=options['latency']):
+        client = Client()
+
+        start = time.perf_counter()
+        response = client.post('/quiz/api/quiz/generate-ai/', data=payload, content_type='application/json')
+        whole = time.perf_counter() - start
+        assert response.status_code == 200, response.content
+
+        start = time.perf_counter()
+        response = client.post('/quiz/api/quiz/generate-ai/stream/', data=payload, content_type='application/json')
+        first_question = None
+        questions = 0
+        for chunk in response.streaming_content:
+            if chunk.startswith(b'event: question'):
+                questions += 1
+                if first_question is None:
+                    first_question = time.perf_counter() - start
+        streamed = time.perf_counter() - start
+
+    return [
+        {'view': 'generate-ai', 'questions': options['count'], 'first_question_s': whole, 'all_questions_s': whole},
+        {'view': 'generate-ai/stream', 'questions': questions, 'first_question_s': first_question, 'all_questions_s': streamed},
+    ]
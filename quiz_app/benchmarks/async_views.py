@@ -0,0 +1,81 @@
+"""
+AI quiz generation throughput: sync views on WSGI workers vs. the async view.
+
+Both paths call a local stub of the Gemini REST API that takes --latency
+seconds per call. The WSGI path gets --workers threads (like gunicorn sync
+workers); the async path gets a single event loop.
+"""
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import AsyncClient, Client, override_settings
+
+from . import percentile, scratch_database
+from ._stub_gemini import StubGemini
+
+URL = '/quiz/api/quiz/generate-ai/'
+PAYLOAD = json.dumps({'subject': 'Math', 'subtopic': 'Fractions', 'gradelevel': '5', 'count': 5})
+
+
+def add_arguments(parser):
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds per stub LLM call.")
+    parser.add_argument('--workers', type=int, default=4, help="Sync workers for the WSGI path.")
+    parser.add_argument('--max-connections', type=int, default=100, help="Async client connection pool size.")
+
+
+def summarize(path, latencies, statuses, seconds):
+    return {
+        'path': path,
+        'requests': len(latencies),
+        'errors': sum(1 for s in statuses if s != 200),
+        'seconds': seconds,
+        'req_per_s': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def run_wsgi(count, workers):
+    # One client per worker thread: building a client loads all the middleware.
+    local = threading.local()
+
+    def one_request(_):
+        if not hasattr(local, 'client'):
+            local.client = Client()
+        start = time.perf_counter()
+        response = local.client.post(URL, data=PAYLOAD, content_type='application/json')
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(one_request, range(count)))
+        seconds = time.perf_counter() - start
+    return summarize(f"wsgi ({workers} sync workers)", [r[0] for r in results], [r[1] for r in results], seconds)
+
+
+async def run_asgi(count):
+    client = AsyncClient()
+
+    async def one_request():
+        start = time.perf_counter()
+        response = await client.post(URL + 'async/', data=PAYLOAD, content_type='application/json')
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one_request() for _ in range(count)))
+    seconds = time.perf_counter() - start
+    return summarize('asgi (1 event loop)', [r[0] for r in results], [r[1] for r in results], seconds)
+
+
+def run(options):
+    with scratch_database(), StubGemini(latency=options['latency']) as stub:
+        with override_settings(LLM_BACKEND='gemini', GEMINI_API_BASE_URL=stub.url,
+                               GEMINI_MAX_CONNECTIONS=options['max_connections']):
+            return [
+                run_wsgi(options['requests'], options['workers']),
+                asyncio.run(run_asgi(options['requests'])),
+            ]
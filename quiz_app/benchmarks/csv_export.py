@@ -0,0 +1,85 @@
+"""
+Peak memory of the submissions CSV export as the number of rows grows.
+
+Compares the streamed export (quiz_app/exports.py) with the old admin
+action, which built the whole file in an HttpResponse and loaded the quiz
+once per row.
+"""
+import csv
+import tracemalloc
+
+from django.http import HttpResponse
+
+from accounts.models import Quiz
+from quiz_app.exports import stream_submissions_csv
+from quiz_app.models import Submission
+from . import scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    parser.add_argument('--skip-old', action='store_true', help="Only measure the streamed export.")
+
+
+def old_export(queryset):
+    """The admin action before it was streamed."""
+    response = HttpResponse(content_type='text/csv')
+    writer = csv.writer(response)
+    writer.writerow(['Quiz Title', 'Student Name', 'Email', 'Score', 'Submitted At'])
+    for submission in queryset:
+        writer.writerow([
+            submission.quiz.title,
+            submission.student_name,
+            submission.student_email,
+            submission.score,
+            submission.submitted_at.strftime('%Y-%m-%d %H:%M:%S'),
+        ])
+    return len(response.content)
+
+
+def streamed_export(queryset):
+    # Consume the response the way a WSGI server would, one chunk at a time.
+    return sum(len(chunk) for chunk in stream_submissions_csv(queryset))
+
+
+def seed(quizzes, total):
+    have = Submission.objects.count()
+    batch = []
+    for i in range(have, total):
+        batch.append(Submission(
+            quiz=quizzes[i % len(quizzes)], student_name=f"Student {i}",
+            student_email=f"student{i}@example.com", answers={'0': 'A'}, score=i % 10,
+        ))
+        if len(batch) == 5000:
+            Submission.objects.bulk_create(batch)
+            batch = []
+    Submission.objects.bulk_create(batch)
+
+
+def measure(export, queryset):
+    tracemalloc.start()
+    seconds, size = timed(export, queryset)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak, size
+
+
+def run(options):
+    rows = []
+    with scratch_database():
+        quizzes = [Quiz.objects.create(title=f"Quiz {i}") for i in range(20)]
+        for total in sorted(options['rows']):
+            seed(quizzes, total)
+            paths = [('streamed', streamed_export)]
+            if not options['skip_old']:
+                paths.append(('in-memory', old_export))
+            for label, export in paths:
+                seconds, peak, size = measure(export, Submission.objects.all())
+                rows.append({
+                    'export': label,
+                    'rows': total,
+                    'seconds': seconds,
+                    'peak_mb': peak / 1024 / 1024,
+                    'csv_mb': size / 1024 / 1024,
+                })
+    return rows
@@ -0,0 +1,61 @@
+"""
+Outbox emails sent per second, by batch size and email backend.
+
+Queues --emails study-guide emails (each with a PDF attached) and drains the
+outbox with each --batch-sizes value. Besides Django's locmem and file
+backends, 'locmem+handshake' waits --handshake seconds whenever a connection
+is opened, like the TLS/API session set-up a real provider needs; that is the
+cost batching spreads over many emails.
+"""
+import tempfile
+import time
+
+from django.core.mail.backends import locmem
+from django.test import override_settings
+
+from quiz_app import outbox
+from quiz_app.models import OutboxEmail
+from . import scratch_database, timed
+
+HANDSHAKE = 0.02  # seconds, overwritten by --handshake
+
+
+class HandshakeBackend(locmem.EmailBackend):
+    def open(self):
+        time.sleep(HANDSHAKE)
+        return True
+
+
+def add_arguments(parser):
+    parser.add_argument('--emails', type=int, default=200)
+    parser.add_argument('--batch-sizes', default='1,10,50', help="Comma-separated batch sizes to try.")
+    parser.add_argument('--handshake', type=float, default=0.02, help="Seconds to open a simulated connection.")
+
+
+def run(options):
+    global HANDSHAKE
+    HANDSHAKE = options['handshake']
+    pdf = b'%PDF-1.4 ' + b'x' * 20_000
+    rows = []
+    with scratch_database(), tempfile.TemporaryDirectory() as tempdir:
+        backends = {
+            'locmem': {'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend'},
+            'file': {'EMAIL_BACKEND': 'django.core.mail.backends.filebased.EmailBackend', 'EMAIL_FILE_PATH': tempdir},
+            'locmem+handshake': {'EMAIL_BACKEND': f"{__name__}.HandshakeBackend"},
+        }
+        for backend, backend_settings in backends.items():
+            for batch_size in [int(size) for size in options['batch_sizes'].split(',')]:
+                OutboxEmail.objects.all().delete()
+                for i in range(options['emails']):
+                    outbox.enqueue(f"Study guide {i}", "Hello", [f"s{i}@example.com"],
+                                   attachment=('study_guide.pdf', pdf, 'application/pdf'))
+                with override_settings(**backend_settings):
+                    seconds, totals = timed(outbox.drain, batch_size)
+                rows.append({
+                    'backend': backend,
+                    'batch_size': batch_size,
+                    'sent': totals['sent'],
+                    'connections': -(-totals['sent'] // batch_size),
+                    'emails_per_s': totals['sent'] / seconds,
+                })
+    return rows
@@ -0,0 +1,104 @@
+"""
+Study-guide parsing time on adversarial inputs: the old DOTALL regex vs. study_guide_parser.
+
+Each input family is generated at every length in --sizes (--old-sizes for
+the old regex, which is far slower) and parsed --repeat times. 'growth' is
+how the time grows with the input between the two largest sizes: 1.0 is
+linear, 2.0 quadratic. Fails if study_guide_parser grows faster than
+--max-growth on any input. No database is needed.
+"""
+import json
+import math
+import random
+import re
+import time
+
+from django.core.management.base import CommandError
+
+from quiz_app import ai
+from quiz_app.study_guide_parser import parse_lines, parse_structured
+
+# The parser views.py used to have, for comparison.
+OLD_PATTERN = re.compile(
+    r"Fundamental Topic:\s*(.*?)\n"
+    r"Practice Question:\s*(.*?)\n"
+    r"A\)\s*(.*?)\n"
+    r"B\)\s*(.*?)\n"
+    r"C\)\s*(.*?)\n"
+    r"D\s*\)\s*(.*?)\n"
+    r"Correct Answer:\s*([A-D])",
+    re.DOTALL | re.MULTILINE | re.IGNORECASE
+)
+
+
+def parse_old(text):
+    return [match.groups() for match in OLD_PATTERN.finditer(text)][:5]
+
+
+def fill(unit, size):
+    return (unit * (size // len(unit) + 1))[:size]
+
+
+def fuzz(size, seed=0):
+    rng = random.Random(seed)
+    pieces = ['Fundamental Topic: ', 'Practice Question: ', 'A) ', 'B) ', 'C) ', 'D) ', 'Correct Answer: ',
+              'x', ' ', '\n', '**', '(', ')', ':']
+    return ''.join(rng.choice(pieces) for _ in range(size // 6))[:size]
+
+
+# name -> (parser to compare against the old regex, make(size) -> text)
+INPUTS = {
+    'valid guides': (parse_lines, lambda size: fill(ai.StubBackend().study_guide('x', 0) * 1, size)),
+    'topics, no answers': (parse_lines, lambda size: fill("Fundamental Topic: x\n", size)),
+    'questions, no answers': (parse_lines, lambda size: fill(
+        "Fundamental Topic: t\nPractice Question: q\nA) a\nB) b\nC) c\nD) d\n", size)),
+    'one long line': (parse_lines, lambda size: "Fundamental Topic: " + fill("a ", size)),
+    'random fragments': (parse_lines, fuzz),
+    'json: deep nesting': (parse_structured, lambda size: '{"questions": ' + '[' * (size - 14)),
+    'json: long strings': (parse_structured, lambda size: json.dumps({'questions': [{'text': fill('a', size)}]})),
+}
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help="Comma-separated input lengths (characters) for study_guide_parser.")
+    parser.add_argument('--old-sizes', default='200,400,800',
+                        help="Input lengths for the old regex, which takes minutes on a few thousand characters.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-growth', type=float, default=1.3)
+
+
+def best_of(parse, text, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(text)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def sizes(option):
+    return sorted(int(size) for size in option.split(','))
+
+
+def run(options):
+    rows, too_slow = [], []
+    for name, (parse, make) in INPUTS.items():
+        for label, parser, lengths in [('old regex', parse_old, sizes(options['old_sizes'])),
+                                       ('study_guide_parser', parse, sizes(options['sizes']))]:
+            timings = [best_of(parser, make(size), options['repeat']) for size in lengths]
+            growth = None
+            if len(lengths) >= 2:
+                growth = math.log(max(timings[-1], 1e-6) / max(timings[-2], 1e-6)) / math.log(lengths[-1] / lengths[-2])
+            rows.append({
+                'input': name,
+                'parser': label,
+                'chars': lengths,
+                'ms': [round(t * 1000, 3) for t in timings],
+                'growth': growth,
+            })
+            if parser is not parse_old and growth is not None and growth > options['max_growth']:
+                too_slow.append(f"{name} ({growth:.2f})")
+    if too_slow:
+        raise CommandError(f"study_guide_parser grew faster than linear on: {', '.join(too_slow)}")
+    return rows
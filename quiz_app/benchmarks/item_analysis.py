@@ -0,0 +1,80 @@
+"""
+Item analysis at class scale: 10k submissions x 100 questions by default.
+
+Times loading the answers from the database and computing the metrics
+with NumPy, next to the same metrics computed with plain Python loops.
+"""
+import random
+
+from accounts.models import Quiz, Question
+from quiz_app import analytics
+from quiz_app.models import Submission
+from . import scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--students', type=int, default=10_000)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--options', type=int, default=4)
+
+
+def python_loops(responses, answer_key):
+    """Difficulty, discrimination and option counts, one cell at a time."""
+    rows = responses.tolist()
+    key = answer_key.tolist()
+    num_questions = len(key)
+    totals = [sum(1 for j in range(num_questions) if row[j] == key[j]) for row in rows]
+    order = sorted(range(len(rows)), key=totals.__getitem__)
+    group = max(int(round(len(rows) * analytics.GROUP_FRACTION)), 1)
+    results = []
+    for j in range(num_questions):
+        right = sum(1 for row in rows if row[j] == key[j])
+        top = sum(1 for i in order[-group:] if rows[i][j] == key[j]) / group
+        bottom = sum(1 for i in order[:group] if rows[i][j] == key[j]) / group
+        counts = {}
+        for row in rows:
+            counts[row[j]] = counts.get(row[j], 0) + 1
+        results.append((right / len(rows), top - bottom, counts))
+    return results
+
+
+def seed(students, num_questions, num_options):
+    quiz = Quiz.objects.create(title='Item analysis benchmark')
+    options = [f"Option {k}" for k in range(num_options)]
+    Question.objects.bulk_create([
+        Question(quiz=quiz, text=f"Question {j}", options=options, correct_index=j % num_options)
+        for j in range(num_questions)
+    ])
+
+    rng = random.Random(42)
+    ability = [rng.random() for _ in range(students)]
+    batch = []
+    for i in range(students):
+        answers = {}
+        for j in range(num_questions):
+            right = rng.random() < 0.3 + 0.6 * ability[i]
+            answers[str(j)] = options[j % num_options] if right else rng.choice(options)
+        batch.append(Submission(quiz=quiz, student_name=f"S{i}", student_email='s@example.com', answers=answers, score=0))
+        if len(batch) == 1000:
+            Submission.objects.bulk_create(batch)
+            batch = []
+    Submission.objects.bulk_create(batch)
+    return quiz
+
+
+def run(options):
+    with scratch_database():
+        quiz = seed(options['students'], options['questions'], options['options'])
+
+        load_s, (_, responses, answer_key) = timed(analytics.load_responses, quiz)
+        numpy_s, _ = timed(analytics.item_statistics, responses, answer_key, options['options'])
+        loops_s, _ = timed(python_loops, responses, answer_key)
+        endpoint_s, _ = timed(analytics.analyze_quiz, quiz)
+
+    shape = f"{responses.shape[0]}x{responses.shape[1]}"
+    return [
+        {'step': 'load answers from db', 'shape': shape, 'seconds': load_s},
+        {'step': 'metrics (numpy)', 'shape': shape, 'seconds': numpy_s},
+        {'step': 'metrics (python loops)', 'shape': shape, 'seconds': loops_s},
+        {'step': 'analyze_quiz (end to end)', 'shape': shape, 'seconds': endpoint_s},
+    ]
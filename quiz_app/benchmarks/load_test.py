@@ -0,0 +1,220 @@
+"""
+Exam-day load test: the quiz page, submit, dashboard and AI generate views under concurrent load.
+
+Seeds --quizzes quizzes with --submissions past submissions between them,
+then sends --requests requests from --concurrency threads (like gunicorn
+sync workers), picking the view for each request from --mix. The LLM is
+the stub backend (--latency seconds per call) and email goes to locmem, so
+nothing leaves the machine. Everything random comes from --seed, so two
+runs send the same requests.
+
+Reports throughput and p50/p95/p99 latency per view and for the whole mix.
+With --pipeline it then runs the queued study guides through the worker
+stages and reports their throughput and per-stage latency too. Save a run
+with --json and pass it back as --baseline to see the change per row.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from background_task.models import Task
+from background_task.tasks import tasks as task_runner
+from django.core import mail
+from django.core.management.base import CommandError
+from django.test import Client, override_settings
+from django.utils import timezone
+
+from accounts.models import Quiz, Question
+from quiz_app import metrics, stats
+from quiz_app.models import StudyGuide, Submission
+from . import percentile, scratch_database
+
+OPTIONS = ['A', 'B', 'C', 'D']
+STAGES = ['llm', 'pdf', 'email']
+
+
+def add_arguments(parser):
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8, help="Threads sending requests at once.")
+    parser.add_argument('--mix', default='display=50,submit=40,dashboard=5,generate=5',
+                        help="Relative weight of each view: display, submit, dashboard, generate.")
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds per stub LLM call.")
+    parser.add_argument('--quizzes', type=int, default=20)
+    parser.add_argument('--questions', type=int, default=10, help="Questions per quiz.")
+    parser.add_argument('--submissions', type=int, default=5000, help="Past submissions to seed.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Also run the queued study guides through generate -> render -> deliver.")
+    parser.add_argument('--baseline', help="A JSON file from an earlier --json run to compare against.")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in FLOWS:
+            raise CommandError(f"Unknown view {name.strip()!r} in --mix, expected {', '.join(FLOWS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def seed(options, rng):
+    """Creates the quizzes and their past submissions; returns the quizzes' access codes."""
+    quizzes = []  # (quiz, correct option of each question)
+    for q in range(options['quizzes']):
+        quiz = Quiz.objects.create(title=f"Unit {q} review")
+        correct = [rng.choice(OPTIONS) for _ in range(options['questions'])]
+        Question.objects.bulk_create(
+            Question(quiz=quiz, text=f"Unit {q}, question {i}", options=OPTIONS, correct_index=OPTIONS.index(c))
+            for i, c in enumerate(correct)
+        )
+        quizzes.append((quiz, correct))
+
+    batch = []
+    for n in range(options['submissions']):
+        quiz, correct = rng.choice(quizzes)
+        # Most students get most answers right.
+        answers = {str(i): c if rng.random() < 0.7 else rng.choice(OPTIONS) for i, c in enumerate(correct)}
+        batch.append(Submission(quiz=quiz, student_name=f"Student {n}", student_email=f"s{n}@example.com",
+                                answers=answers, score=sum(answers[str(i)] == c for i, c in enumerate(correct))))
+        if len(batch) == 5000:
+            Submission.objects.bulk_create(batch)
+            batch = []
+    Submission.objects.bulk_create(batch)
+    stats.recompute()
+    return [quiz.access_code for quiz, _ in quizzes]
+
+
+# --- One request per view; each returns the response ---
+def display(client, rng, codes, options):
+    return client.get(f"/quiz/{rng.choice(codes)}/")
+
+
+def submit(client, rng, codes, options):
+    answers = {str(i): rng.choice(OPTIONS) for i in range(options['questions'])}
+    n = rng.randrange(10 ** 6)
+    return client.post('/quiz/submit/', content_type='application/json', data=json.dumps({
+        'access_code': rng.choice(codes), 'name': f"Student {n}", 'email': f"s{n}@example.com", 'answers': answers,
+    }))
+
+
+def dashboard(client, rng, codes, options):
+    return client.get('/quiz/api/dashboard-data/')
+
+
+def generate(client, rng, codes, options):
+    return client.post('/quiz/api/quiz/generate-ai/', content_type='application/json', data=json.dumps({
+        'subject': 'Math', 'subtopic': f"Topic {rng.randrange(100)}", 'gradelevel': '5', 'count': options['questions'],
+    }))
+
+
+FLOWS = {'display': display, 'submit': submit, 'dashboard': dashboard, 'generate': generate}
+
+
+def row(name, latencies, errors, seconds):
+    return {
+        'flow': name,
+        'requests': len(latencies),
+        'errors': errors,
+        'req_per_s': len(latencies) / seconds if seconds else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def run_load(options, codes, rng):
+    mix = parse_mix(options['mix'])
+    plan = rng.choices(list(mix), weights=list(mix.values()), k=options['requests'])
+    # Each request gets its own Random, so the requests don't depend on thread timing.
+    seeds = [rng.randrange(2 ** 32) for _ in plan]
+    local = threading.local()
+
+    def one_request(i):
+        if not hasattr(local, 'client'):
+            # One client per thread: building a client loads all the middleware.
+            local.client = Client()
+        start = time.perf_counter()
+        response = FLOWS[plan[i]](local.client, random.Random(seeds[i]), codes, options)
+        return plan[i], time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(one_request, range(len(plan))))
+        seconds = time.perf_counter() - start
+
+    by_flow = defaultdict(list)
+    errors = defaultdict(int)
+    for name, latency, status in results:
+        by_flow[name].append(latency)
+        errors[name] += status >= 400
+    rows = [row(name, by_flow[name], errors[name], seconds) for name in mix if by_flow[name]]
+    rows.append(row(f"all ({options['concurrency']} threads)", [r[1] for r in results], sum(errors.values()), seconds))
+    return rows
+
+
+def run_pipeline():
+    """
+    Runs every queued task (generate, render, deliver, send_outbox) in this
+    thread until none are left, ignoring their scheduled delays.
+    """
+    guides = StudyGuide.objects.exclude(stages__generate=StudyGuide.SKIPPED).count()
+    before = {stage: metrics.stage_seconds.series.get(stage, {}).get('count', 0) for stage in STAGES}
+    start = time.perf_counter()
+    while True:
+        Task.objects.filter(locked_by__isnull=True).update(run_at=timezone.now())
+        if not task_runner.run_next_task():
+            break
+    seconds = time.perf_counter() - start
+
+    rows = [{
+        'flow': 'pipeline (study guides)',
+        'requests': guides,
+        'errors': StudyGuide.objects.filter(stages__deliver=StudyGuide.FAILED).count(),
+        'req_per_s': guides / seconds if seconds else 0.0,
+        'p50_ms': None, 'p95_ms': None, 'p99_ms': None,
+    }]
+    for stage in STAGES:
+        rows.append({
+            'flow': f"stage: {stage}",
+            'requests': metrics.stage_seconds.series.get(stage, {}).get('count', 0) - before[stage],
+            'errors': 0,
+            'req_per_s': None,
+            'p50_ms': stage_ms(stage, 0.5), 'p95_ms': stage_ms(stage, 0.95), 'p99_ms': stage_ms(stage, 0.99),
+        })
+    print(f"Sent {len(mail.outbox)} study guide emails (locmem).")
+    return rows
+
+
+def stage_ms(stage, q):
+    """A stage's q-quantile in ms, estimated from the histogram buckets like Prometheus does."""
+    return (metrics.stage_seconds.quantile(q, stage) or 0.0) * 1000
+
+
+def compare(rows, path):
+    """Adds each row's change against the same row of a saved run."""
+    with open(path) as f:
+        baseline = {r['flow']: r for r in json.load(f)['results']}
+    for r in rows:
+        old = baseline.get(r['flow'], {})
+        for key in ('req_per_s', 'p99_ms'):
+            if r[key] and old.get(key):
+                r[f"{key}_change"] = f"{(r[key] / old[key] - 1) * 100:+.1f}%"
+            else:
+                r[f"{key}_change"] = '-'
+    return rows
+
+
+def run(options):
+    rng = random.Random(options['seed'])
+    with scratch_database(), override_settings(LLM_BACKEND='stub', LLM_STUB_LATENCY=options['latency']):
+        codes = seed(options, rng)
+        rows = run_load(options, codes, rng)
+        if options['pipeline']:
+            rows += run_pipeline()
+    if options['baseline']:
+        rows = compare(rows, options['baseline'])
+    return rows
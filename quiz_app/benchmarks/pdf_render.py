@@ -0,0 +1,72 @@
+"""
+Study-guide PDF renders per second per core: the study_guide_pdf renderer vs. the old multi_cell one.
+
+Renders the same guide --renders times in each of --processes worker
+processes (one per core) and reports the rate per process and in total.
+No database is needed.
+"""
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from quiz_app import ai
+
+
+def add_arguments(parser):
+    parser.add_argument('--renders', type=int, default=300, help="Renders per process.")
+    parser.add_argument('--processes', type=int, default=1)
+
+
+def render_multi_cell(quiz_title, study_guide_text):
+    """How study guides were rendered before: one multi_cell for the raw text."""
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    pdf.cell(200, 10, text=f"Study Guide for {quiz_title}", new_x='LMARGIN', new_y='NEXT', align='C')
+    pdf.multi_cell(0, 10, text=study_guide_text)
+    return bytes(pdf.output())
+
+
+def render_study_guide_pdf(quiz_title, study_guide_text):
+    from quiz_app.study_guide_pdf import render_pdf
+
+    return render_pdf(quiz_title, study_guide_text)
+
+
+RENDERERS = {
+    'multi_cell (old)': render_multi_cell,
+    'study_guide_pdf': render_study_guide_pdf,
+}
+
+
+def render_many(name, text, count):
+    render = RENDERERS[name]
+    render('Warm-up', text)
+    start = time.perf_counter()
+    for _ in range(count):
+        size = len(render('Fractions', text))
+    return time.perf_counter() - start, size
+
+
+def run(options):
+    # A guide with five practice questions, like the LLM is asked for.
+    text = ai.StubBackend().study_guide('benchmark', 0)
+
+    rows = []
+    for name in RENDERERS:
+        with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+            start = time.perf_counter()
+            results = list(pool.map(render_many, [name] * options['processes'], [text] * options['processes'],
+                                    [options['renders']] * options['processes']))
+            wall = time.perf_counter() - start
+        per_core = sum(options['renders'] / seconds for seconds, _ in results) / len(results)
+        rows.append({
+            'renderer': name,
+            'processes': options['processes'],
+            'renders_per_s_per_core': per_core,
+            'renders_per_s_total': options['renders'] * options['processes'] / wall,
+            'ms_per_render': 1000 / per_core,
+            'pdf_bytes': results[0][1],
+        })
+    return rows
@@ -0,0 +1,119 @@
+"""
+Question bank retrieval: how often a study guide can skip the LLM, how on-topic it is, and how fast.
+
+Builds a synthetic bank for each --bank-sizes value: --topics topics, each
+with its own vocabulary, and questions that mix topic words with words
+every topic uses (and now and then a neighbouring topic's words). Each
+topic also gets a "student" quiz, and --guides study guides are made for
+two missed questions from one of them.
+
+For each --thresholds value (STUDY_GUIDE_BANK_MIN_CONFIDENCE) it reports
+the share of guides served from the bank (the rest would go to the LLM),
+precision@5 (how many of a served guide's questions are on the missed
+questions' topic), recall@20 (the on-topic share of rank()'s candidates),
+the latency of study_guide() and how fast questions are indexed.
+"""
+import random
+import time
+
+from django.core.cache import cache
+
+from accounts.models import Quiz, Question
+from quiz_app import question_bank
+from quiz_app.study_guide_parser import parse_study_guide_text
+from . import percentile, scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--bank-sizes', default='1000,5000,20000', help="Comma-separated bank sizes (questions).")
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--guides', type=int, default=200, help="Study guides looked up per threshold.")
+    parser.add_argument('--thresholds', default='0.1,0.2,0.3,0.4', help="Comma-separated confidence thresholds.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+COMMON = [f"common{i}" for i in range(300)]
+
+
+def topic_words(topic):
+    return [f"topic{topic}word{i}" for i in range(15)]
+
+
+def question_text(rng, topic, topics):
+    words = rng.sample(topic_words(topic), 3) + rng.sample(COMMON, 4)
+    if rng.random() < 0.2:
+        words += rng.sample(topic_words((topic + 1) % topics), 2)
+    rng.shuffle(words)
+    return ' '.join(words).capitalize() + '?'
+
+
+def make_question(rng, quiz, topic, topics):
+    options = [f"{rng.choice(topic_words(topic))} {rng.choice(COMMON)}" for _ in range(4)]
+    return Question(quiz=quiz, text=question_text(rng, topic, topics), options=options, correct_index=rng.randrange(4))
+
+
+def build_bank(rng, size, topics):
+    """Creates the bank and the student quizzes; returns (index seconds, {quiz_id: topic}, student questions)."""
+    topic_of = {}
+    bank = []
+    for topic in range(topics):
+        quiz = Quiz.objects.create(title=f"Topic {topic} review", share_in_question_bank=True)
+        topic_of[quiz.id] = topic
+        bank += [make_question(rng, quiz, topic, topics) for _ in range(size // topics)]
+    students = {}
+    for topic in range(topics):
+        quiz = Quiz.objects.create(title=f"Topic {topic} test")
+        topic_of[quiz.id] = topic
+        students[topic] = [make_question(rng, quiz, topic, topics) for _ in range(5)]
+
+    all_questions = bank + [q for questions in students.values() for q in questions]
+    Question.objects.bulk_create(all_questions, batch_size=5000)
+    index_seconds = 0.0
+    for start in range(0, len(all_questions), 1000):
+        seconds, _ = timed(question_bank.add, all_questions[start:start + 1000])
+        index_seconds += seconds
+    return index_seconds / len(all_questions), topic_of, students
+
+
+def run(options):
+    rng = random.Random(options['seed'])
+    topics = options['topics']
+    thresholds = [float(t) for t in options['thresholds'].split(',')]
+    rows = []
+    for size in [int(s) for s in options['bank_sizes'].split(',')]:
+        with scratch_database():
+            per_question, topic_of, students = build_bank(rng, size, topics)
+            cache.clear()
+            quiz_titles = {f"Topic {topic} review": topic for topic in range(topics)}
+            lookups = [(topic, rng.sample(students[topic], 2)) for topic in rng.choices(range(topics), k=options['guides'])]
+
+            # Candidates don't depend on the threshold.
+            on_topic = total = 0
+            for topic, missed in lookups:
+                queries = [question_bank.question_terms(q.text, q.options) for q in missed]
+                for ranked in question_bank.rank(queries, exclude_quiz_id=missed[0].quiz_id):
+                    ids = [question_id for _, question_id in ranked]
+                    quiz_ids = dict(Question.objects.filter(pk__in=ids).values_list('id', 'quiz_id'))
+                    on_topic += sum(topic_of[quiz_ids[i]] == topic for i in ids)
+                    total += min(question_bank.CANDIDATES, size // topics)
+
+            for threshold in thresholds:
+                latencies, served, right = [], 0, 0
+                for topic, missed in lookups:
+                    start = time.perf_counter()
+                    text = question_bank.study_guide(missed, missed[0].quiz_id, min_confidence=threshold)
+                    latencies.append(time.perf_counter() - start)
+                    if text:
+                        served += 1
+                        right += sum(quiz_titles.get(q['topic']) == topic for q in parse_study_guide_text(text))
+                rows.append({
+                    'bank_questions': size,
+                    'min_confidence': threshold,
+                    'served_from_bank_pct': served / len(lookups) * 100,
+                    'precision_at_5': right / (served * 5) if served else 0.0,
+                    'recall_at_20': on_topic / total if total else 0.0,
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'indexed_per_s': 1 / per_question,
+                })
+    return rows
@@ -0,0 +1,49 @@
+"""
+Quiz creation time per question, bulk builder vs. one INSERT per question.
+
+The bulk path (quiz_builder.build_quiz) should stay roughly flat per
+question as quizzes get bigger; the old path pays a round trip per row.
+"""
+import statistics
+
+from accounts.models import Quiz, Question
+from quiz_app.quiz_builder import build_quiz
+from . import scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 500])
+    parser.add_argument('--repeat', type=int, default=5)
+
+
+def make_questions(size):
+    return [{
+        'text': f"Question {i}?",
+        'options': ['Option A', 'Option B', 'Option C', 'Option D'],
+        'correct_index': i % 4,
+    } for i in range(size)]
+
+
+def one_insert_per_question(title, questions_data):
+    """The way save_quiz_view used to do it."""
+    quiz = Quiz.objects.create(title=title)
+    for q_data in questions_data:
+        Question.objects.create(quiz=quiz, **q_data)
+    return quiz
+
+
+def run(options):
+    rows = []
+    with scratch_database():
+        for size in options['sizes']:
+            questions_data = make_questions(size)
+            for label, create in (('bulk', build_quiz), ('per-row', one_insert_per_question)):
+                samples = [timed(create, 'Benchmark', questions_data)[0] for _ in range(options['repeat'])]
+                median = statistics.median(samples)
+                rows.append({
+                    'path': label,
+                    'questions': size,
+                    'total_ms': median * 1000,
+                    'us_per_question': median * 1_000_000 / size,
+                })
+    return rows
@@ -0,0 +1,69 @@
+"""
+Rescoring a large quiz after a question is fixed: speed, queries and peak memory by chunk size.
+
+Creates --submissions submissions for one quiz (every student picked A or B
+on every question), then for each --chunk-sizes value swaps the first
+question's correct answer between A and B and runs the rescore job, so
+every score changes. Peak memory is measured with tracemalloc.
+"""
+import random
+import tracemalloc
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts.models import Quiz, Question
+from quiz_app import rescore
+from quiz_app.models import Submission
+from . import scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--submissions', type=int, default=200_000)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--chunk-sizes', default='500,2000,10000', help="Comma-separated chunk sizes to try.")
+
+
+def make_quiz(options):
+    rng = random.Random(1)
+    quiz = Quiz.objects.create(title='Rescore benchmark')
+    Question.objects.bulk_create(
+        Question(quiz=quiz, text=f"Question {i}", options=['A', 'B', 'C', 'D'], correct_index=0)
+        for i in range(options['questions'])
+    )
+    batch = []
+    for n in range(options['submissions']):
+        answers = {str(i): rng.choice('AB') for i in range(options['questions'])}
+        batch.append(Submission(quiz=quiz, student_name=f"Student {n}", student_email=f"s{n}@example.com",
+                                answers=answers, score=sum(a == 'A' for a in answers.values())))
+        if len(batch) == 5000:
+            Submission.objects.bulk_create(batch)
+            batch = []
+    Submission.objects.bulk_create(batch)
+    return quiz
+
+
+def run(options):
+    rows = []
+    with scratch_database():
+        quiz = make_quiz(options)
+        first = quiz.questions.order_by('id').first()
+        for chunk_size in [int(size) for size in options['chunk_sizes'].split(',')]:
+            first.correct_index = 1 - first.correct_index
+            first.save()
+
+            tracemalloc.start()
+            with CaptureQueriesContext(connection) as queries:
+                seconds, job = timed(lambda: rescore.run(rescore.start(quiz.id), chunk_size=chunk_size))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows.append({
+                'chunk_size': chunk_size,
+                'submissions': job.processed,
+                'changed': job.changed,
+                'queries': len(queries.captured_queries),
+                'seconds': seconds,
+                'submissions_per_s': job.processed / seconds,
+                'peak_mb': peak / 2 ** 20,
+            })
+    return rows
@@ -0,0 +1,82 @@
+"""
+Startup cost: time to import Django, the apps and the URLconf, like every manage.py command and worker boot does.
+
+Runs `python -X importtime` in a fresh interpreter --runs times and reports
+the median, the slowest modules, and any heavy dependency (fpdf, NumPy,
+httpx) that got imported at startup even though it
+should only be loaded on first use. Fails if the median goes over
+--budget-ms or a heavy dependency shows up, so regressions get caught.
+"""
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import CommandError
+
+# Milliseconds. Measured at about 310 ms on a laptop (620 ms when fpdf, NumPy
+# and httpx were still imported at startup); leaves room for slower machines.
+BUDGET_MS = 450
+
+# Only loaded when first needed; none of these may be imported at startup.
+LAZY_MODULES = ('fpdf', 'numpy', 'httpx')
+
+STARTUP_CODE = (
+    "import django; django.setup(); "
+    "from django.urls import get_resolver; get_resolver().url_patterns"
+)
+
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)$')
+
+
+def add_arguments(parser):
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget-ms', type=float, default=BUDGET_MS)
+    parser.add_argument('--top', type=int, default=10, help="How many of the slowest modules to list.")
+
+
+def measure_once():
+    """Returns {module: cumulative microseconds} for one fresh interpreter."""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'config.settings'))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', STARTUP_CODE],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    modules = {}
+    total = 0
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, module = match.groups()
+        modules[module] = int(cumulative)
+        if not indent:
+            # Top-level imports don't overlap, so they add up to the total.
+            total += int(cumulative)
+    return total, modules
+
+
+def run(options):
+    runs = [measure_once() for _ in range(options['runs'])]
+    total_ms = statistics.median(total for total, _ in runs) / 1000
+    modules = runs[-1][1]
+    eager = [m for m in LAZY_MODULES if m in modules]
+
+    rows = [{
+        'module': '(all imports)',
+        'ms': total_ms,
+        'budget_ms': options['budget_ms'],
+        'eager_heavy_modules': ', '.join(eager) or '-',
+    }]
+    slowest = sorted(modules.items(), key=lambda item: -item[1])
+    for module, cumulative in slowest[:options['top']]:
+        rows.append({'module': module, 'ms': cumulative / 1000, 'budget_ms': '', 'eager_heavy_modules': ''})
+
+    if total_ms > options['budget_ms'] or eager:
+        raise CommandError(
+            f"Startup imports took {total_ms:.0f} ms (budget {options['budget_ms']:.0f} ms); "
+            f"imported at startup: {', '.join(eager) or 'nothing heavy'}."
+        )
+    return rows
@@ -0,0 +1,76 @@
+"""
+Study-guide LLM calls for a whole class submitting at once, with and without batching.
+
+Every student misses a random subset of the quiz's questions; then the
+generate stage runs for each of them, as the worker would after the batch
+window. Uses the stub LLM backend and counts the calls it receives.
+"""
+import random
+from unittest import mock
+
+from django.test import override_settings
+
+from accounts.models import Quiz, Question
+from quiz_app import ai, tasks
+from quiz_app.models import StudyGuide, Submission
+from . import scratch_database, timed
+
+
+def add_arguments(parser):
+    parser.add_argument('--students', type=int, default=30)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--miss-rate', type=float, default=0.2, help="Chance each answer is wrong.")
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def make_class(options, rng):
+    quiz = Quiz.objects.create(title='Batching benchmark')
+    questions = Question.objects.bulk_create(
+        Question(quiz=quiz, text=f"Question {i}", options=['A', 'B', 'C', 'D'], correct_index=0)
+        for i in range(options['questions'])
+    )
+    guides = []
+    for s in range(options['students']):
+        missed = [q.id for q in questions if rng.random() < options['miss_rate']] or [questions[0].id]
+        submission = Submission.objects.create(
+            quiz=quiz, student_name=f"Student {s}", student_email=f"s{s}@example.com", answers={}, score=0,
+        )
+        guides.append(StudyGuide.objects.create(
+            submission=submission, missed_question_ids=missed, stages={'generate': StudyGuide.PENDING},
+        ))
+    return guides
+
+
+def run_class(label, batch_size, options):
+    rng = random.Random(options['seed'])
+    guides = make_class(options, rng)
+    calls = []
+
+    def count(fn):
+        def wrapper(prompt, schema=None):
+            calls.append(len(prompt))
+            return fn(prompt, schema)
+        return wrapper
+
+    with mock.patch.object(tasks, 'BATCH_MAX_SIZE', batch_size), \
+            mock.patch.object(ai, 'generate_content', count(ai.generate_content)), \
+            mock.patch.object(ai, 'stream_content', count(ai.stream_content)):
+        seconds, _ = timed(lambda: [tasks.generate_study_guide.now(g.id) for g in guides])
+
+    return {
+        'mode': label,
+        'students': len(guides),
+        'llm_calls': len(calls),
+        'calls_per_student': len(calls) / len(guides),
+        'largest_prompt_chars': max(calls),
+        'seconds': seconds,
+    }
+
+
+def run(options):
+    with scratch_database(), override_settings(LLM_BACKEND='stub'):
+        # Separate quizzes, so the second run can't reuse the first one's cached guides.
+        return [
+            run_class('one call per student', 1, options),
+            run_class(f"batched (up to {tasks.BATCH_MAX_SIZE})", tasks.BATCH_MAX_SIZE, options),
+        ]
@@ -0,0 +1,55 @@
+# In quiz_app/display_cache.py
+# Caches what the student quiz page needs, per access code, in Django's cache.
+#
+# Only the questions are cached, not the rendered page: the page has the
+# visitor's CSRF token in it. Each worker has its own cache, so entries are
+# keyed by the quiz's version, which signals.py bumps in the database
+# whenever the quiz or one of its questions is saved or deleted. Every page
+# load reads the quiz row (one indexed query) and so never uses a copy
+# older than the last committed edit, whichever worker made it.
+#
+# The questions are listed in answer_key.QUESTION_ORDER, the order the
+# compiled answer key scores them in, so answer '0' on the page is always
+# the question the key scores as '0'.
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Quiz, Question
+from . import answer_key, metrics
+
+CACHE_TIMEOUT = getattr(settings, 'QUIZ_DISPLAY_CACHE_TIMEOUT', 60 * 60)
+
+hits = metrics.counter('quiz_display_cache_hits', 'Quiz pages served from the cache.')
+misses = metrics.counter('quiz_display_cache_misses', 'Quiz pages loaded from the database.')
+
+
+def cache_key(quiz_id, version):
+    return f"quiz_display:{quiz_id}:{version}"
+
+
+def get_quiz_display(access_code):
+    """
+    Returns {'quiz': {'title', 'access_code'}, 'questions_for_js': [...]}.
+    Raises Http404 if there is no such quiz.
+    """
+    quiz = Quiz.objects.filter(access_code=access_code.upper()).values('id', 'title', 'access_code', 'version').first()
+    if quiz is None:
+        raise Http404("No Quiz matches the given query.")
+
+    key = cache_key(quiz['id'], quiz['version'])
+    questions = cache.get(key)
+    if questions is not None:
+        hits.inc()
+    else:
+        misses.inc()
+        questions = [
+            {"text": text, "answers": options}
+            for text, options in Question.objects.filter(quiz_id=quiz['id'])
+            .order_by(*answer_key.QUESTION_ORDER).values_list('text', 'options')
+        ]
+        cache.set(key, questions, CACHE_TIMEOUT)
+    return {
+        'quiz': {'title': quiz['title'], 'access_code': quiz['access_code']},
+        'questions_for_js': questions,
+    }
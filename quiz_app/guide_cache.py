@@ -0,0 +1,93 @@
+# In quiz_app/guide_cache.py
+# A shared cache of finished study guides.
+#
+# A guide only depends on the quiz and on which questions the student missed,
+# so two students who missed the same questions get the same guide. Entries
+# are keyed by a hash of the quiz, its title and the ID + content of every
+# missed question (the "quiz version"). Editing a question changes the key,
+# and signals.py also deletes any entry built from it.
+#
+# Entries live in the database (not the per-process cache) so every worker
+# shares them. They expire after STUDY_GUIDE_CACHE_MAX_AGE seconds, and the
+# least recently used ones are dropped once the cache holds more than
+# STUDY_GUIDE_CACHE_MAX_BYTES.
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import StudyGuideCacheEntry
+
+
+MAX_AGE = getattr(settings, 'STUDY_GUIDE_CACHE_MAX_AGE', 30 * 24 * 60 * 60)
+MAX_BYTES = getattr(settings, 'STUDY_GUIDE_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+
+def cache_key(quiz, questions):
+    """Builds the key for a quiz and the questions a student missed (any order)."""
+    fingerprint = {
+        'quiz': quiz.id,
+        'title': quiz.title,
+        'questions': sorted(
+            [q.id, q.text, q.options, q.correct_index] for q in questions
+        ),
+    }
+    raw = json.dumps(fingerprint, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get(key):
+    """Returns the (text, pdf_bytes) stored under key, or None."""
+    cutoff = timezone.now() - timedelta(seconds=MAX_AGE)
+    entry = (
+        StudyGuideCacheEntry.objects.filter(key=key, created_at__gte=cutoff)
+        .values('id', 'text', 'pdf').first()
+    )
+    if entry is None:
+        return None
+
+    StudyGuideCacheEntry.objects.filter(id=entry['id']).update(
+        hits=F('hits') + 1, last_used_at=timezone.now()
+    )
+    return entry['text'], bytes(entry['pdf'])
+
+
+def put(key, quiz, question_ids, text, pdf):
+    """Stores a finished guide, then evicts old entries if needed."""
+    try:
+        with transaction.atomic():
+            entry = StudyGuideCacheEntry.objects.create(
+                key=key, quiz=quiz, text=text, pdf=pdf, size=len(text.encode()) + len(pdf),
+            )
+            entry.questions.set(question_ids)
+    except IntegrityError:
+        # Another worker stored the same guide first; theirs is just as good.
+        return
+    evict()
+
+
+def evict():
+    """Drops expired entries, then the least recently used ones over the size limit."""
+    cutoff = timezone.now() - timedelta(seconds=MAX_AGE)
+    StudyGuideCacheEntry.objects.filter(created_at__lt=cutoff).delete()
+
+    total = StudyGuideCacheEntry.objects.aggregate(total=Sum('size'))['total'] or 0
+    if total <= MAX_BYTES:
+        return
+
+    doomed = []
+    for entry_id, size in StudyGuideCacheEntry.objects.order_by('last_used_at').values_list('id', 'size').iterator():
+        if total <= MAX_BYTES:
+            break
+        doomed.append(entry_id)
+        total -= size
+    StudyGuideCacheEntry.objects.filter(id__in=doomed).delete()
+
+
+def invalidate_question(question_id):
+    """Deletes every entry built from this question."""
+    StudyGuideCacheEntry.objects.filter(questions__id=question_id).delete()
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Runs one of the benchmarks in quiz_app/benchmarks/ against a throwaway database."
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest='benchmark', metavar='<benchmark>')
+        for name, module in sorted(benchmarks.available().items()):
+            subparser = subparsers.add_parser(name, help=(module.__doc__ or '').strip().split('\n')[0])
+            subparser.add_argument('--json', dest='json_path', help="Also write the results to this JSON file.")
+            if hasattr(module, 'add_arguments'):
+                module.add_arguments(subparser)
+
+    def handle(self, *args, **options):
+        name = options['benchmark']
+        available = benchmarks.available()
+        if name not in available:
+            raise CommandError(f"Choose a benchmark: {', '.join(sorted(available))}")
+
+        rows = available[name].run(options)
+        self.print_table(rows)
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'benchmark': name, 'results': rows}, f, indent=2, default=str)
+            self.stdout.write(f"Wrote {options['json_path']}")
+
+    def print_table(self, rows):
+        if not rows:
+            return
+        columns = list(rows[0])
+        cells = [[self.format(row.get(c)) for c in columns] for row in rows]
+        widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+        self.stdout.write('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+        for r in cells:
+            self.stdout.write('  '.join(v.ljust(w) for v, w in zip(r, widths)))
+
+    def format(self, value):
+        if isinstance(value, float):
+            return f"{value:.3f}"
+        return str(value)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from quiz_app import outbox
+
+
+class Command(BaseCommand):
+    help = "Sends every email that is due in the outbox, a batch at a time."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.BATCH_SIZE,
+                            help="Emails sent over one backend connection.")
+
+    def handle(self, *args, **options):
+        totals = outbox.drain(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Sent {totals['sent']} emails ({totals['retried']} will be retried, {totals['dead']} given up on)."
+        ))
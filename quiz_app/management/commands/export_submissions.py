@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app.exports import CHUNK_SIZE, write_submissions_csv
+from quiz_app.models import Quiz, Submission
+
+
+class Command(BaseCommand):
+    help = "Writes submissions to a CSV file, reading them from the database in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help="Path of the CSV file to write.")
+        parser.add_argument('--quiz', dest='access_code', help="Only export submissions for this access code.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        submissions = Submission.objects.all()
+        if options['access_code']:
+            code = options['access_code'].upper()
+            if not Quiz.objects.filter(access_code=code).exists():
+                raise CommandError(f"No quiz with access code {code}.")
+            submissions = submissions.filter(quiz__access_code=code)
+
+        with open(options['output'], 'w', newline='') as f:
+            count = write_submissions_csv(submissions, f, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} submissions to {options['output']}"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from quiz_app import question_bank
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the question bank index (quiz_app/question_bank.py) from every saved question."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Questions indexed per INSERT.")
+
+    def handle(self, *args, **options):
+        count = question_bank.rebuild(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} questions."))
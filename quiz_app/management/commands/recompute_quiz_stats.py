@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import stats
+from quiz_app.models import Quiz
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the per-quiz submission stats from the Submission table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', dest='access_code', help="Only rebuild this quiz's stats.")
+
+    def handle(self, *args, **options):
+        quiz_ids = None
+        if options['access_code']:
+            code = options['access_code'].upper()
+            quiz_ids = list(Quiz.objects.filter(access_code=code).values_list('pk', flat=True))
+            if not quiz_ids:
+                raise CommandError(f"No quiz with access code {code}.")
+
+        count = stats.recompute(quiz_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt stats for {count} quizzes."))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from quiz_app import rescore
+from quiz_app.models import Quiz
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-scores a quiz's submissions against its current questions (e.g. after fixing a "
+        "correct_index). An interrupted run continues where it stopped when run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', dest='access_code', required=True, help="Access code of the quiz to rescore.")
+        parser.add_argument('--chunk-size', type=int, default=rescore.CHUNK_SIZE,
+                            help="Submissions read and written per query.")
+
+    def handle(self, *args, **options):
+        code = options['access_code'].upper()
+        quiz_id = Quiz.objects.filter(access_code=code).values_list('pk', flat=True).first()
+        if quiz_id is None:
+            raise CommandError(f"No quiz with access code {code}.")
+
+        job = rescore.start(quiz_id)
+        if job.processed:
+            self.stdout.write(f"Resuming: {job.processed}/{job.total} submissions already rescored.")
+
+        def progress(job):
+            self.stdout.write(f"Rescored {job.processed}/{job.total} submissions ({job.changed} scores changed)")
+
+        job = rescore.run(job, chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f"Rescored {job.processed} submissions of {code}; {job.changed} scores changed."
+        ))
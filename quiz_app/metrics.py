@@ -0,0 +1,335 @@
+# In quiz_app/metrics.py
+# Simple in-process counters (e.g. cache hits and misses), gauges and latency
+# histograms (how long each stage of a request or task took).
+#
+# Time a block of code with:
+#   with metrics.span('score'):
+#       ...
+# The time goes into the stage_seconds histogram, and, inside a request,
+# into its Server-Timing header (config.middleware.ServerTimingMiddleware).
+# GET /metrics returns everything in Prometheus' text format.
+#
+# Every process (each gunicorn worker, and process_tasks, which serves no
+# HTTP at all) keeps its own numbers. With METRICS_DIR set, each one also
+# writes them to a file of its own in that directory, from a background
+# thread every METRICS_DUMP_INTERVAL seconds and when it exits, and GET
+# /metrics adds up all the files, so a scrape sees every worker and the
+# study-guide pipeline stages (llm, pdf, email, retrieval) too. Without it, a scrape only sees
+# the web worker that happened to answer it.
+import atexit
+import contextvars
+import glob
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# Gauges (e.g. requests in flight) in files that haven't been written for
+# this long are left out: the process has probably gone away.
+GAUGE_MAX_AGE = 60  # seconds
+
+
+class Counter:
+    def __init__(self, name, help_text=''):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+        if not _dump_thread_started:
+            start_dump_thread()
+
+
+_counters = {}
+_registry_lock = threading.Lock()
+
+
+def counter(name, help_text=''):
+    """Returns the counter with this name, creating it the first time."""
+    with _registry_lock:
+        if name not in _counters:
+            _counters[name] = Counter(name, help_text)
+        return _counters[name]
+
+
+class Gauge:
+    """A value that goes up and down (e.g. requests in flight), read when asked for."""
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    @property
+    def value(self):
+        return self.read()
+
+
+_gauges = {}
+
+
+def gauge(name, help_text, read):
+    """Registers a gauge whose value is `read()`, replacing any earlier one of that name."""
+    with _registry_lock:
+        _gauges[name] = Gauge(name, help_text, read)
+        return _gauges[name]
+
+
+def snapshot():
+    """The current value of every counter and gauge, by name."""
+    values = {name: c.value for name, c in _counters.items()}
+    values.update((name, g.value) for name, g in _gauges.items())
+    return dict(sorted(values.items()))
+
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, separately for each value of
+    one label (e.g. stage="score"), like a Prometheus histogram.
+    """
+
+    def __init__(self, name, help_text='', label='stage', buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}  # label value -> {'counts': [per bucket, then +Inf], 'sum': s, 'count': n}
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=''):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def quantile(self, q, label_value=''):
+        """
+        Estimates the q-quantile (0.99 = p99) from the buckets, the way
+        Prometheus' histogram_quantile() does. None if nothing was observed.
+        """
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None or not series['count']:
+                return None
+            counts = list(series['counts'])
+            total = series['count']
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # in the +Inf bucket
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+_histograms = {}
+
+
+def histogram(name, help_text='', label='stage'):
+    """Returns the histogram with this name, creating it the first time."""
+    with _registry_lock:
+        if name not in _histograms:
+            _histograms[name] = Histogram(name, help_text, label)
+        return _histograms[name]
+
+
+stage_seconds = histogram('stage_seconds', 'Time spent in each stage of requests and tasks')
+
+# The (stage, seconds) list of the request being handled, if any.
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+def start_request_timings():
+    """Starts collecting spans for a Server-Timing header. Returns the list they go in."""
+    timings = []
+    return timings, _request_timings.set(timings)
+
+
+def stop_request_timings(token):
+    _request_timings.reset(token)
+
+
+def record(stage, seconds):
+    """Records a stage's time that was measured some other way."""
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+    if not _dump_thread_started:
+        start_dump_thread()
+
+
+@contextmanager
+def span(stage):
+    """Times the block as `stage`, even when it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def server_timing(timings):
+    """A Server-Timing header value; a stage timed more than once is added up."""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+
+def state():
+    """This process's counters, gauges and histograms as plain data (what dump() writes)."""
+    with _registry_lock:
+        counters, gauges, histograms = list(_counters.values()), list(_gauges.values()), list(_histograms.values())
+    data = {
+        'counters': {c.name: [c.help_text, c.value] for c in counters},
+        'gauges': {g.name: [g.help_text, g.value] for g in gauges},
+        'histograms': {},
+    }
+    for h in histograms:
+        with h._lock:
+            series = {value: {'counts': list(s['counts']), 'sum': s['sum'], 'count': s['count']}
+                      for value, s in h.series.items()}
+        data['histograms'][h.name] = {'help': h.help_text, 'label': h.label, 'buckets': list(h.buckets), 'series': series}
+    return data
+
+
+def dump_path(directory):
+    return os.path.join(directory, f"{socket.gethostname()}-{os.getpid()}.json")
+
+
+def dump():
+    """Writes this process's numbers to its file in METRICS_DIR (if set)."""
+    directory = getattr(settings, 'METRICS_DIR', '')
+    if not directory:
+        return
+    data = state()
+    data['updated'] = time.time()
+    path = dump_path(directory)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f)
+        # Readers never see a half-written file.
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"!!! METRICS: Could not write {path}: {e}")
+
+
+_dump_thread_started = False
+_dump_lock = threading.Lock()
+
+
+def dump_every_interval():
+    while True:
+        time.sleep(getattr(settings, 'METRICS_DUMP_INTERVAL', 5))
+        dump()
+
+
+def start_dump_thread():
+    """
+    Starts a daemon thread that calls dump() every METRICS_DUMP_INTERVAL
+    seconds, so no request or task ever waits for the file to be written.
+    Called on the first inc() or record() in each process.
+    """
+    global _dump_thread_started
+    with _dump_lock:
+        if _dump_thread_started:
+            return
+        _dump_thread_started = True
+    if getattr(settings, 'METRICS_DIR', ''):
+        threading.Thread(target=dump_every_interval, name='metrics-dump', daemon=True).start()
+
+
+def _forget_dump_thread():
+    # A forked child (e.g. a gunicorn worker) has its parent's flag, but not its threads.
+    global _dump_thread_started
+    _dump_thread_started = False
+
+
+os.register_at_fork(after_in_child=_forget_dump_thread)
+atexit.register(dump)
+
+
+def add(total, data, with_gauges=True):
+    """Adds one process's state() into `total`."""
+    for name, (help_text, value) in data['counters'].items():
+        total['counters'][name] = [help_text, total['counters'].get(name, [help_text, 0])[1] + value]
+    if with_gauges:
+        for name, (help_text, value) in data['gauges'].items():
+            total['gauges'][name] = [help_text, total['gauges'].get(name, [help_text, 0])[1] + value]
+    for name, h in data['histograms'].items():
+        merged = total['histograms'].setdefault(name, {**h, 'series': {}})
+        if merged['buckets'] != h['buckets']:
+            continue
+        for value, s in h['series'].items():
+            into = merged['series'].setdefault(value, {'counts': [0] * len(s['counts']), 'sum': 0.0, 'count': 0})
+            into['counts'] = [a + b for a, b in zip(into['counts'], s['counts'])]
+            into['sum'] += s['sum']
+            into['count'] += s['count']
+
+
+def collect():
+    """
+    Every process's numbers added up, from the files in METRICS_DIR (this
+    process's own are written first). Just this process's if it isn't set.
+    """
+    directory = getattr(settings, 'METRICS_DIR', '')
+    if not directory:
+        return state()
+    dump()
+    total = {'counters': {}, 'gauges': {}, 'histograms': {}}
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue  # removed or replaced while reading
+        add(total, data, with_gauges=time.time() - data.get('updated', 0) < GAUGE_MAX_AGE)
+    return total
+
+
+def prometheus_text(data=None):
+    """Every counter, gauge and histogram (default: collect()) in Prometheus' text exposition format."""
+    data = collect() if data is None else data
+    lines = []
+    for name, (help_text, value) in sorted(data['counters'].items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name} {value}")
+    for name, (help_text, value) in sorted(data['gauges'].items()):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    for name, h in sorted(data['histograms'].items()):
+        lines.append(f"# HELP {name} {h['help']}")
+        lines.append(f"# TYPE {name} histogram")
+        for value, s in sorted(h['series'].items()):
+            label = f'{h["label"]}="{value}"'
+            cumulative = 0
+            for bound, n in zip(h['buckets'] + ['+Inf'], s['counts']):
+                cumulative += n
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label}}} {s['sum']}")
+            lines.append(f"{name}_count{{{label}}} {s['count']}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='submission',
+            options={'ordering': ['-submitted_at']},
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='answers',
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='score',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='submission',
+            name='student_name',
+            field=models.CharField(max_length=255),
+        ),
+        migrations.CreateModel(
+            name='StudyGuide',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('missed_question_ids', models.JSONField(default=list)),
+                ('stages', models.JSONField(default=dict)),
+                ('text', models.TextField(blank=True)),
+                ('pdf', models.BinaryField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('submission', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='study_guide', to='quiz_app.submission')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('quiz_app', '0003_submission_newest_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studyguide',
+            name='cache_key',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.CreateModel(
+            name='StudyGuideCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('text', models.TextField()),
+                ('pdf', models.BinaryField()),
+                ('size', models.PositiveIntegerField()),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+                ('questions', models.ManyToManyField(related_name='study_guide_cache', to='accounts.question')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='study_guide_cache', to='accounts.quiz')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='guide_cache_lru_idx'), models.Index(fields=['created_at'], name='guide_cache_age_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-17 00:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_stats(apps, schema_editor):
+    Quiz = apps.get_model('accounts', 'Quiz')
+    QuizStats = apps.get_model('quiz_app', 'QuizStats')
+    Submission = apps.get_model('quiz_app', 'Submission')
+
+    distributions = {quiz_id: {} for quiz_id in Quiz.objects.values_list('pk', flat=True)}
+    counts = Submission.objects.order_by().values_list('quiz', 'score').annotate(n=Count('id'))
+    for quiz_id, score, n in counts:
+        distributions[quiz_id][str(score)] = n
+
+    QuizStats.objects.bulk_create([
+        QuizStats(
+            quiz_id=quiz_id,
+            submission_count=sum(distribution.values()),
+            score_total=sum(int(score) * n for score, n in distribution.items()),
+            score_distribution=distribution,
+        )
+        for quiz_id, distribution in distributions.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_access_code_sequence'),
+        ('quiz_app', '0004_study_guide_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizStats',
+            fields=[
+                ('quiz', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='accounts.quiz')),
+                ('submission_count', models.PositiveIntegerField(default=0)),
+                ('score_total', models.PositiveBigIntegerField(default=0)),
+                ('score_distribution', models.JSONField(default=dict)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0005_quizstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='studyguide',
+            name='batch_id',
+            field=models.CharField(blank=True, db_index=True, max_length=32),
+        ),
+    ]
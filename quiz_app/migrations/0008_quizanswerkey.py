@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_access_code_sequence'),
+        ('quiz_app', '0007_outbox_email'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizAnswerKey',
+            fields=[
+                ('quiz', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='answer_key', serialize=False, to='accounts.quiz')),
+                ('question_ids', models.JSONField(default=list)),
+                ('correct_indices', models.JSONField(default=list)),
+                ('option_indices', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
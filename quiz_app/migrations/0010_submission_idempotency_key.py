@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_access_code_sequence'),
+        ('quiz_app', '0009_rescorejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='submission',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='submission',
+            constraint=models.UniqueConstraint(fields=('quiz', 'idempotency_key'), name='submission_idempotency_key_uniq'),
+        ),
+    ]
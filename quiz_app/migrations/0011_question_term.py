@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 01:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_access_code_sequence'),
+        ('quiz_app', '0010_submission_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('count', models.PositiveSmallIntegerField()),
+                ('doc_length', models.PositiveSmallIntegerField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='index_terms', to='accounts.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term'], name='question_term_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0011_question_term'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizanswerkey',
+            name='quiz_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quiz_app', '0012_answer_key_quiz_version'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='questionterm',
+            name='question_term_idx',
+        ),
+        migrations.AddIndex(
+            model_name='questionterm',
+            index=models.Index(fields=['term', '-count', 'doc_length'], name='question_term_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from accounts.models import Quiz, Question
 # Create your models here.
 
@@ -27,9 +28,261 @@ class Submission(models.Model):
     score = models.PositiveIntegerField()
     submitted_at = models.DateTimeField(auto_now_add=True)
 
+    # Sent by the quiz page as an Idempotency-Key header, the same for every
+    # retry of one attempt, so a retried submit finds this row instead of
+    # making another one (see process_submission).
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+
     def __str__(self):
         return f"Submission by {self.student_name} for '{self.quiz.title}'"
 
     class Meta:
         # This makes sure the newest submissions appear at the top
-        ordering = ['-submitted_at']
\ No newline at end of file
+        ordering = ['-submitted_at']
+        indexes = [
+            # Backs the dashboard's keyset pagination (newest first).
+            models.Index(fields=['-submitted_at', '-id'], name='submission_newest_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['quiz', 'idempotency_key'], name='submission_idempotency_key_uniq'),
+        ]
+
+class StudyGuide(models.Model):
+    """
+    Tracks one submission through the study-guide pipeline.
+    'score' and 'persist' happen inside the submit request; the rest of the
+    stages run in the background worker (see quiz_app/tasks.py).
+    """
+    STAGES = ['score', 'persist', 'generate', 'render', 'deliver']
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    submission = models.OneToOneField(
+        Submission,
+        related_name='study_guide',
+        on_delete=models.CASCADE
+    )
+
+    # The questions the student got wrong, in quiz order.
+    missed_question_ids = models.JSONField(default=list)
+
+    # The status of every stage, e.g. {'score': 'done', 'generate': 'running', ...}
+    stages = models.JSONField(default=dict)
+
+    # Which StudyGuideCacheEntry this guide can be served from / stored as.
+    cache_key = models.CharField(max_length=64, blank=True)
+
+    # Set when a 'generate' task claims this guide for a batched LLM call,
+    # so no other task generates it too (see tasks.claim_batch).
+    batch_id = models.CharField(max_length=32, blank=True, db_index=True)
+
+    # Output of the 'generate' and 'render' stages, handed to the next stage.
+    text = models.TextField(blank=True)
+    pdf = models.BinaryField(blank=True, null=True)
+
+    error = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Study guide for submission {self.submission_id}"
+
+    def mark(self, stage, status, error=''):
+        """Records the status of a single stage and saves it right away."""
+        self.stages[stage] = status
+        self.error = error
+        self.save(update_fields=['stages', 'error', 'updated_at'])
+
+    @property
+    def is_sent(self):
+        return self.stages.get('deliver') == self.DONE
+
+
+class StudyGuideCacheEntry(models.Model):
+    """
+    A generated study guide (text and PDF) that can be re-sent to any student
+    who missed the same questions on the same quiz. See quiz_app/guide_cache.py.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    quiz = models.ForeignKey(Quiz, related_name='study_guide_cache', on_delete=models.CASCADE)
+
+    # Editing or deleting any of these questions throws the entry away.
+    questions = models.ManyToManyField(Question, related_name='study_guide_cache')
+
+    text = models.TextField()
+    pdf = models.BinaryField()
+    size = models.PositiveIntegerField()
+
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Cached study guide {self.key[:12]} for '{self.quiz.title}'"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_used_at'], name='guide_cache_lru_idx'),
+            models.Index(fields=['created_at'], name='guide_cache_age_idx'),
+        ]
+
+
+class QuizStats(models.Model):
+    """
+    Running totals for a quiz's submissions, kept up to date as submissions
+    come in (see quiz_app/stats.py) so the dashboard never has to scan them.
+    """
+    quiz = models.OneToOneField(
+        Quiz,
+        primary_key=True,
+        related_name='stats',
+        on_delete=models.CASCADE
+    )
+    submission_count = models.PositiveIntegerField(default=0)
+    score_total = models.PositiveBigIntegerField(default=0)
+
+    # How many students got each score, e.g. {'7': 3, '8': 10}
+    score_distribution = models.JSONField(default=dict)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Stats for '{self.quiz.title}'"
+
+    @property
+    def mean_score(self):
+        if not self.submission_count:
+            return None
+        return self.score_total / self.submission_count
+
+
+class OutboxEmail(models.Model):
+    """
+    An email waiting to be sent, or already sent, by the outbox worker.
+    Emails are sent in batches over one backend connection; see quiz_app/outbox.py.
+    """
+    QUEUED = 'queued'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'  # gave up after OUTBOX_MAX_ATTEMPTS tries
+
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (SENDING, 'Sending'), (SENT, 'Sent'), (DEAD, 'Dead')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254, blank=True)
+    to = models.JSONField(default=list)
+
+    attachment_name = models.CharField(max_length=255, blank=True)
+    attachment = models.BinaryField(blank=True, null=True)
+    attachment_type = models.CharField(max_length=100, blank=True)
+
+    # The study guide this email delivers; its 'deliver' stage follows the email.
+    study_guide = models.ForeignKey(
+        StudyGuide,
+        related_name='emails',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    # When the email may be (re)tried. While SENDING, when the claim runs out.
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    # The worker batch that is sending it (see outbox.claim).
+    claimed_by = models.CharField(max_length=32, blank=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Email to {', '.join(self.to)}: {self.subject} ({self.status})"
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+
+class QuizAnswerKey(models.Model):
+    """
+    A quiz's answer key, compiled from its questions so a submission can be
+    scored without loading them. See quiz_app/answer_key.py.
+    """
+    quiz = models.OneToOneField(
+        Quiz,
+        primary_key=True,
+        related_name='answer_key',
+        on_delete=models.CASCADE
+    )
+    # The order the questions are shown and scored in; answer '0' is question_ids[0].
+    question_ids = models.JSONField(default=list)
+    # The correct option's index for each question (-1 if the question is broken).
+    correct_indices = models.JSONField(default=list)
+    # For each question, {option text: index}.
+    option_indices = models.JSONField(default=list)
+    # The Quiz.version it was compiled at; a key for any other version isn't used.
+    quiz_version = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Answer key for '{self.quiz.title}'"
+
+
+class RescoreJob(models.Model):
+    """
+    Re-scoring every submission of a quiz against its current answer key,
+    e.g. after a teacher fixes a question's correct_index. Progress is saved
+    after every chunk, so an interrupted job picks up where it stopped.
+    See quiz_app/rescore.py.
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+
+    STATUS_CHOICES = [(RUNNING, 'Running'), (DONE, 'Done')]
+
+    quiz = models.ForeignKey(Quiz, related_name='rescore_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=RUNNING)
+    # Which answer key the job scores against; if the key changes, the job starts over.
+    key_hash = models.CharField(max_length=64)
+    # Submissions are rescored in ID order; everything up to here is done.
+    last_submission_id = models.PositiveBigIntegerField(default=0)
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    changed = models.PositiveIntegerField(default=0)
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Rescore '{self.quiz.title}': {self.processed}/{self.total} ({self.status})"
+
+
+class QuestionTerm(models.Model):
+    """
+    One posting of the question bank's inverted index: `term` appears
+    `count` times in the question's text and options. doc_length is the
+    question's total term count (the same on all its rows), which BM25
+    needs for every match. See quiz_app/question_bank.py.
+    """
+    term = models.CharField(max_length=64)
+    question = models.ForeignKey(Question, related_name='index_terms', on_delete=models.CASCADE)
+    count = models.PositiveSmallIntegerField()
+    doc_length = models.PositiveSmallIntegerField()
+
+    class Meta:
+        indexes = [
+            # Looking a term up must not scan the whole index, and its best
+            # postings (question_bank.rank) come first.
+            models.Index(fields=['term', '-count', 'doc_length'], name='question_term_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} x{self.count} in question {self.question_id}"
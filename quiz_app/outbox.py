@@ -0,0 +1,203 @@
+# In quiz_app/outbox.py
+# A persistent outbox for outgoing email.
+#
+# Code that wants to send an email calls enqueue(), which only writes an
+# OutboxEmail row. The worker (tasks.send_outbox, or
+# `python manage.py deliver_outbox`) then claims due emails OUTBOX_BATCH_SIZE
+# at a time and sends each batch over a single backend connection, instead
+# of opening a new connection (a new Brevo/SMTP session) per email.
+#
+# A failed email is retried after OUTBOX_RETRY_BACKOFF seconds, doubling
+# (with jitter) every attempt. After OUTBOX_MAX_ATTEMPTS attempts it is
+# dead-lettered: left in the table with status DEAD and its last error, for
+# a person to look at (and retry from the admin).
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from . import metrics
+from .models import OutboxEmail, StudyGuide
+
+BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 50)
+MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 6)
+RETRY_BACKOFF = getattr(settings, 'OUTBOX_RETRY_BACKOFF', 60)  # seconds
+# A batch still SENDING after this long belongs to a worker that died; it is sent again.
+CLAIM_TIMEOUT = getattr(settings, 'OUTBOX_CLAIM_TIMEOUT', 300)  # seconds
+
+sent_counter = metrics.counter('outbox_sent', 'Emails sent from the outbox')
+retried_counter = metrics.counter('outbox_retried', 'Outbox emails that failed and will be retried')
+dead_counter = metrics.counter('outbox_dead', 'Outbox emails given up on')
+connections_counter = metrics.counter('outbox_connections', 'Email backend connections opened by the outbox')
+
+
+def enqueue(subject, body, to, from_email=None, attachment=None, study_guide=None):
+    """
+    Adds an email to the outbox. `attachment` is an optional
+    (filename, content bytes, mimetype) tuple.
+    """
+    name, content, mimetype = attachment or ('', None, '')
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL or '',
+        to=list(to),
+        attachment_name=name,
+        attachment=content,
+        attachment_type=mimetype,
+        study_guide=study_guide,
+    )
+
+
+def due():
+    """Emails that are ready to be sent now, oldest first."""
+    return OutboxEmail.objects.filter(
+        status__in=[OutboxEmail.QUEUED, OutboxEmail.SENDING],
+        next_attempt_at__lte=timezone.now(),
+    ).order_by('next_attempt_at', 'id')
+
+
+def claim(batch_size=BATCH_SIZE):
+    """
+    Claims up to batch_size due emails for this worker. The claim is a
+    conditional update, so two workers never send the same email.
+    """
+    ids = list(due().values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    now = timezone.now()
+    claim_id = uuid.uuid4().hex
+    due().filter(pk__in=ids).order_by().update(
+        status=OutboxEmail.SENDING,
+        next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT),
+        claimed_by=claim_id,
+    )
+    return list(OutboxEmail.objects.filter(pk__in=ids, claimed_by=claim_id).select_related('study_guide'))
+
+
+def to_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or None,
+        to=email.to,
+        connection=connection,
+    )
+    if email.attachment_name:
+        message.attach(email.attachment_name, bytes(email.attachment), email.attachment_type or None)
+    return message
+
+
+def retry_delay(attempts):
+    """Seconds to wait before the next try, after `attempts` failed tries."""
+    return RETRY_BACKOFF * 2 ** (attempts - 1) * random.uniform(0.5, 1.0)
+
+
+def deliver_batch(batch_size=BATCH_SIZE, connection=None):
+    """
+    Claims one batch and sends it over a single connection.
+    Returns {'sent': n, 'retried': n, 'dead': n}; all zero when nothing was due.
+    """
+    result = {'sent': 0, 'retried': 0, 'dead': 0}
+    emails = claim(batch_size)
+    if not emails:
+        return result
+
+    connection = connection or get_connection()
+    sent, failed = [], []
+    with metrics.span('email'):
+        try:
+            connection.open()
+            connections_counter.inc()
+        except Exception as e:
+            print(f"!!! OUTBOX: could not connect to the email backend: {e}")
+            failed = [(email, e) for email in emails]
+        else:
+            try:
+                for email in emails:
+                    try:
+                        if not connection.send_messages([to_message(email, connection)]):
+                            raise RuntimeError("The email backend did not send the message.")
+                    except Exception as e:
+                        failed.append((email, e))
+                    else:
+                        sent.append(email)
+            finally:
+                connection.close()
+
+    with transaction.atomic():
+        record_sent(sent)
+        for email, error in failed:
+            result['dead' if record_failure(email, error) else 'retried'] += 1
+    result['sent'] = len(sent)
+    print(f"OUTBOX: sent {result['sent']}, will retry {result['retried']}, gave up on {result['dead']}")
+    return result
+
+
+def record_sent(emails):
+    if not emails:
+        return
+    now = timezone.now()
+    OutboxEmail.objects.filter(pk__in=[e.pk for e in emails]).update(
+        status=OutboxEmail.SENT, sent_at=now, last_error='', claimed_by='',
+    )
+    guides = [e.study_guide for e in emails if e.study_guide is not None]
+    for guide in guides:
+        guide.stages['deliver'] = StudyGuide.DONE
+        guide.error = ''
+        guide.updated_at = now
+    StudyGuide.objects.bulk_update(guides, ['stages', 'error', 'updated_at'])
+    sent_counter.inc(len(emails))
+
+
+def record_failure(email, error):
+    """Schedules a retry, or dead-letters the email. Returns True if it is dead."""
+    email.attempts += 1
+    email.last_error = str(error) or error.__class__.__name__
+    dead = email.attempts >= MAX_ATTEMPTS
+    if dead:
+        email.status = OutboxEmail.DEAD
+        dead_counter.inc()
+        print(f"!!! OUTBOX: giving up on email {email.pk} to {email.to}: {email.last_error}")
+    else:
+        email.status = OutboxEmail.QUEUED
+        email.next_attempt_at = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+        retried_counter.inc()
+    email.claimed_by = ''
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at', 'claimed_by'])
+
+    if email.study_guide is not None:
+        # The stage stays 'running' while retries are pending.
+        status = StudyGuide.FAILED if dead else StudyGuide.RUNNING
+        email.study_guide.mark('deliver', status, error=email.last_error)
+    return dead
+
+
+def drain(batch_size=BATCH_SIZE):
+    """Sends batches until nothing is due. Returns the totals."""
+    totals = {'sent': 0, 'retried': 0, 'dead': 0}
+    while True:
+        result = deliver_batch(batch_size)
+        if not any(result.values()):
+            return totals
+        for key in totals:
+            totals[key] += result[key]
+
+
+def next_attempt_at():
+    """When the next queued email is due, or None if the outbox is empty."""
+    return OutboxEmail.objects.filter(
+        status__in=[OutboxEmail.QUEUED, OutboxEmail.SENDING],
+    ).aggregate(at=Min('next_attempt_at'))['at']
+
+
+def requeue_dead(queryset):
+    """Gives dead-lettered emails a fresh set of attempts. Returns how many."""
+    return queryset.filter(status=OutboxEmail.DEAD).update(
+        status=OutboxEmail.QUEUED, attempts=0, next_attempt_at=timezone.now(),
+    )
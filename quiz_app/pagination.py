@@ -0,0 +1,46 @@
+# In quiz_app/pagination.py
+# Keyset ("cursor") pagination for the dashboard API.
+# Pages are ordered newest first by (timestamp, id). The cursor is the last
+# row's (timestamp, id), so fetching page N costs the same as page 1 and
+# rows inserted while paging are never skipped or repeated.
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(timestamp, pk):
+    raw = f"{timestamp.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def keyset_page(queryset, time_field, cursor=None, limit=50):
+    """
+    Returns (rows, next_cursor) for a queryset of .values() dicts.
+    next_cursor is None on the last page.
+    """
+    queryset = queryset.order_by(f'-{time_field}', '-id')
+    if cursor:
+        timestamp, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(**{f'{time_field}__lt': timestamp}) | Q(**{time_field: timestamp, 'id__lt': pk})
+        )
+
+    # Fetch one extra row to find out whether there is another page.
+    rows = list(queryset[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1][time_field], rows[-1]['id'])
@@ -0,0 +1,238 @@
+# In quiz_app/question_bank.py
+# Study guides made from questions teachers already wrote.
+#
+# Every Question's text and options are indexed as QuestionTerm rows (an
+# inverted index: term -> questions). The index is updated when a question
+# is saved (signals.py, and build_quiz for bulk-created quizzes); rows go
+# with their question when it is deleted. `python manage.py index_questions`
+# (re)builds it for questions saved before it existed.
+#
+# For a student's missed questions, study_guide() ranks the bank by BM25
+# against each missed question and takes the best matches from other
+# quizzes, round-robin, as the five practice questions. Only quizzes whose
+# teacher ticked share_in_question_bank are used: the practice questions
+# come with their answers. A match's
+# confidence is its score divided by the score the missed question would
+# get against itself, so 1.0 is "the same words" and 0 is "nothing in
+# common". If five matches above STUDY_GUIDE_BANK_MIN_CONFIDENCE can't be
+# found, it returns None and the generate stage asks the LLM as before.
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from accounts.models import Question
+from . import metrics
+from .models import QuestionTerm
+from .study_guide_parser import LETTERS, MAX_QUESTIONS, questions_to_json
+
+MIN_CONFIDENCE = getattr(settings, 'STUDY_GUIDE_BANK_MIN_CONFIDENCE', 0.3)
+# Candidates looked at per missed question.
+CANDIDATES = 20
+# Postings read per query term. A word many questions use adds little to a
+# score, and reading all of its postings would make lookups as slow as the
+# bank is big.
+POSTINGS_PER_TERM = 100
+# BM25's usual parameters: term frequency saturation and length normalization.
+K1 = 1.2
+B = 0.75
+# N and the average question length change slowly; they're cached this long.
+STATS_TIMEOUT = 60  # seconds
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset("""
+    a about after all also an and any are as at be been before but by can could did do does each for from had has
+    have how if in into is it its many may more most much no not of on one or other over same so some such than that
+    the their them then there these they this those to under up was we were what when where which while who whom
+    whose why will with would you your
+""".split())
+
+from_bank = metrics.counter('study_guides_from_bank', 'Study guides made from the question bank instead of the LLM')
+bank_misses = metrics.counter('study_guide_bank_misses', 'Study guides the question bank had too few good matches for')
+
+
+def tokenize(text):
+    """
+    Lowercase words, without stopwords, with plurals folded ('fractions' ->
+    'fraction'). Numbers are left out: two questions about 2/3 and 2.5 have
+    nothing else in common.
+    """
+    terms = []
+    for word in TOKEN.findall(text.lower()):
+        if word in STOPWORDS or len(word) == 1 or word.isdigit():
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        terms.append(word[:64])
+    return terms
+
+
+def question_terms(text, options):
+    options = options if isinstance(options, list) else []
+    return Counter(tokenize(' '.join([text or '', *(o for o in options if isinstance(o, str))])))
+
+
+def postings(question):
+    terms = question_terms(question.text, question.options)
+    length = min(sum(terms.values()), 32767)
+    return [
+        QuestionTerm(term=term, question_id=question.pk, count=min(count, 32767), doc_length=length)
+        for term, count in terms.items()
+    ]
+
+
+def add(questions):
+    """Indexes new questions (one INSERT for all of them)."""
+    QuestionTerm.objects.bulk_create([row for question in questions for row in postings(question)])
+
+
+def update(question):
+    """Re-indexes a question that was edited."""
+    QuestionTerm.objects.filter(question_id=question.pk).delete()
+    add([question])
+
+
+def rebuild(batch_size=1000):
+    """
+    Indexes every question from scratch, in one transaction so lookups
+    never see a half-built index. Returns how many were indexed.
+    """
+    total = 0
+    batch = []
+    with transaction.atomic():
+        QuestionTerm.objects.all().delete()
+        for question in Question.objects.only('id', 'text', 'options').order_by('id').iterator(chunk_size=batch_size):
+            batch.append(question)
+            if len(batch) == batch_size:
+                add(batch)
+                total += len(batch)
+                batch = []
+        add(batch)
+    return total + len(batch)
+
+
+def bank_stats():
+    """(number of indexed questions, their average length in terms)."""
+    stats = cache.get('question_bank:stats')
+    if stats is None:
+        row = QuestionTerm.objects.aggregate(docs=Count('question_id', distinct=True), terms=Sum('count'))
+        stats = (row['docs'], (row['terms'] or 0) / row['docs'] if row['docs'] else 0.0)
+        cache.set('question_bank:stats', stats, STATS_TIMEOUT)
+    return stats
+
+
+def bm25(tf, doc_length, idf, avg_length):
+    return idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * doc_length / avg_length))
+
+
+def rank(queries, exclude_quiz_id=None):
+    """
+    For each query (a Counter of terms), the shared questions best matching
+    it as [(confidence, question_id)], best first.
+    """
+    docs, avg_length = bank_stats()
+    terms = set().union(*queries)
+    if not docs or not terms:
+        return [[] for _ in queries]
+
+    df = dict(QuestionTerm.objects.filter(term__in=terms).values('term').annotate(n=Count('id')).values_list('term', 'n'))
+    idf = {term: math.log(1 + (docs - n + 0.5) / (n + 0.5)) for term, n in df.items()}
+    rows = QuestionTerm.objects.filter(question__quiz__share_in_question_bank=True)
+    if exclude_quiz_id is not None:
+        rows = rows.exclude(question__quiz_id=exclude_quiz_id)
+    # Terms in more than POSTINGS_PER_TERM questions only bring their best
+    # postings (most occurrences in the shortest questions, read in that
+    # order from question_term_idx), so a lookup reads about the same
+    # number of rows however big the bank gets. Still one query.
+    wanted = Q(term__in=[term for term, n in df.items() if n <= POSTINGS_PER_TERM])
+    for term, n in df.items():
+        if n > POSTINGS_PER_TERM:
+            best_postings = rows.filter(term=term).order_by('-count', 'doc_length').values('pk')[:POSTINGS_PER_TERM]
+            wanted |= Q(pk__in=best_postings)
+    matches = defaultdict(list)  # term -> [(question_id, count, doc_length)]
+    for term, question_id, count, doc_length in rows.filter(wanted).values_list('term', 'question_id', 'count', 'doc_length'):
+        matches[term].append((question_id, count, doc_length))
+
+    ranked = []
+    for query in queries:
+        query_length = sum(query.values())
+        # What the query would score against itself: the best a match can do.
+        best = sum(qtf * bm25(qtf, query_length, idf.get(term, 0.0), avg_length) for term, qtf in query.items())
+        scores = defaultdict(float)
+        for term, qtf in query.items():
+            for question_id, count, doc_length in matches.get(term, ()):
+                scores[question_id] += qtf * bm25(count, doc_length, idf[term], avg_length)
+        top = sorted(scores.items(), key=lambda item: -item[1])[:CANDIDATES]
+        ranked.append([(min(score / best, 1.0) if best else 0.0, question_id) for question_id, score in top])
+    return ranked
+
+
+def practice_question(question):
+    """A bank question in STUDY_GUIDE_SCHEMA form, or None if it doesn't fit (it needs 4 options)."""
+    options = question.options
+    if not (isinstance(options, list) and len(options) == len(LETTERS) and all(isinstance(o, str) for o in options)):
+        return None
+    if not 0 <= question.correct_index < len(LETTERS):
+        return None
+    return {
+        'topic': question.quiz.title,
+        'text': question.text,
+        'options': options,
+        'answer': LETTERS[question.correct_index],
+    }
+
+
+def pick(ranked, questions, min_confidence):
+    """
+    Takes the best match for each missed question in turn (so every missed
+    question gets practice) until there are MAX_QUESTIONS. Returns them, or
+    None if there aren't enough good ones.
+    """
+    picked, seen_texts = [], set()
+    lists = [iter(matches) for matches in ranked]
+    while lists and len(picked) < MAX_QUESTIONS:
+        for matches in list(lists):
+            for confidence, question_id in matches:
+                if confidence < min_confidence:
+                    lists.remove(matches)
+                    break
+                question = questions.get(question_id)
+                text = question['text'].strip().lower() if question else None
+                if question and text not in seen_texts:
+                    seen_texts.add(text)
+                    picked.append(question)
+                    break
+            else:
+                lists.remove(matches)
+            if len(picked) == MAX_QUESTIONS:
+                break
+    return picked if len(picked) == MAX_QUESTIONS else None
+
+
+def study_guide(wrong_questions, quiz_id, min_confidence=None):
+    """
+    A study guide (STUDY_GUIDE_SCHEMA JSON) of bank questions like the
+    missed ones, from shared quizzes other than the student's; None if the bank
+    doesn't have five good matches.
+    """
+    if min_confidence is None:
+        min_confidence = MIN_CONFIDENCE
+    queries = [question_terms(q.text, q.options) for q in wrong_questions]
+    with metrics.span('retrieval'):
+        ranked = rank([q for q in queries if q], exclude_quiz_id=quiz_id)
+        ids = {question_id for matches in ranked for confidence, question_id in matches if confidence >= min_confidence}
+        questions = {}
+        for question in Question.objects.filter(pk__in=ids).select_related('quiz'):
+            practice = practice_question(question)
+            if practice is not None:
+                questions[question.pk] = practice
+        picked = pick(ranked, questions, min_confidence)
+    if picked is None:
+        bank_misses.inc()
+        return None
+    from_bank.inc()
+    return questions_to_json(picked)
@@ -0,0 +1,55 @@
+# In quiz_app/quiz_builder.py
+# The one place quizzes get written to the database.
+# Used by both the manual quiz builder and the AI generator.
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from . import question_bank
+from .models import Quiz, Question
+
+
+def validate_questions(questions_data):
+    """
+    Turns a list of {'text', 'options', 'correct_index'} dicts into unsaved
+    Question objects, checking every one with the same rules as the admin
+    (Question.clean). Raises one ValidationError listing every bad question.
+    """
+    questions = []
+    errors = {}
+    for i, q_data in enumerate(questions_data):
+        question = Question(
+            text=q_data.get('text'),
+            options=q_data.get('options'),
+            correct_index=q_data.get('correct_index'),
+        )
+        try:
+            # The quiz doesn't exist yet, so skip the foreign key check.
+            question.clean_fields(exclude=['quiz'])
+            question.clean()
+        except ValidationError as e:
+            errors[f"question {i + 1}"] = e.messages
+        questions.append(question)
+
+    if not questions:
+        errors['questions'] = ['A quiz needs at least one question.']
+    if errors:
+        raise ValidationError(errors)
+    return questions
+
+
+def build_quiz(title, questions_data, class_name=None, share_in_question_bank=False):
+    """
+    Validates every question first, then saves the Quiz and all its
+    Questions in one transaction: either the whole quiz is saved or nothing is.
+    """
+    questions = validate_questions(questions_data)
+
+    with transaction.atomic():
+        quiz = Quiz.objects.create(title=title, class_name=class_name or None,
+                                   share_in_question_bank=bool(share_in_question_bank))
+        for question in questions:
+            question.quiz = quiz
+        Question.objects.bulk_create(questions)
+        # bulk_create doesn't send post_save, so index them here.
+        question_bank.add(questions)
+    return quiz
@@ -0,0 +1,99 @@
+# In quiz_app/quiz_stream.py
+# Reads the AI quiz generator's JSON answer while it is still being written.
+#
+# The model answers with {"questions": [{...}, {...}, ...]}. Instead of
+# waiting for the whole thing, QuestionStreamParser finds the "questions"
+# array and hands back each {...} question object as soon as its closing
+# brace arrives. A broken question (or a cut-off ending) only loses that
+# question, not the ones before it.
+import json
+import re
+
+QUESTIONS_ARRAY = re.compile(r'"questions"\s*:\s*\[')
+
+
+class QuestionStreamParser:
+    """
+    parser = QuestionStreamParser()
+    for chunk in chunks:
+        for question in parser.feed(chunk):
+            ...
+    Objects that aren't valid JSON are skipped and counted in `errors`.
+    Every character is only scanned once, however the text is chunked.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0             # next character to scan
+        self.in_array = False    # found '"questions": [' yet?
+        self.depth = 0           # brace depth inside the array
+        self.in_string = False
+        self.escaped = False
+        self.start = None        # where the current question object began
+        self.done = False        # reached the array's closing ']'
+        self.errors = 0
+
+    def feed(self, text):
+        """Adds more text; returns the question dicts completed by it."""
+        if self.done:
+            return []
+        self.buffer += text
+        if not self.in_array and not self._find_array():
+            return []
+
+        questions = []
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            char = buffer[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char == '{':
+                if self.depth == 0:
+                    self.start = i
+                self.depth += 1
+            elif char == '}' and self.depth:
+                self.depth -= 1
+                if self.depth == 0:
+                    question = self._decode(buffer[self.start:i + 1])
+                    if question is not None:
+                        questions.append(question)
+                    self.start = None
+            elif char == ']' and self.depth == 0:
+                self.done = True
+                break
+
+        # Forget everything before the question still being read.
+        keep = self.start if self.start is not None else len(buffer)
+        self.buffer = buffer[keep:]
+        self.start = 0 if self.start is not None else None
+        self.pos = len(self.buffer)
+        return questions
+
+    def _find_array(self):
+        match = QUESTIONS_ARRAY.search(self.buffer)
+        if match is None:
+            # The key may be split across chunks; keep a short tail to retry on.
+            self.buffer = self.buffer[-32:]
+            return False
+        self.in_array = True
+        self.buffer = self.buffer[match.end():]
+        self.pos = 0
+        return True
+
+    def _decode(self, text):
+        try:
+            question = json.loads(text)
+        except ValueError:
+            self.errors += 1
+            return None
+        if not isinstance(question, dict):
+            self.errors += 1
+            return None
+        return question
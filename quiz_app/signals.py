@@ -0,0 +1,85 @@
+# In quiz_app/signals.py
+# Keeps derived data in sync when a teacher edits a quiz.
+# Connected in QuizAppConfig.ready().
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import Quiz, Question
+from . import answer_key, guide_cache, question_bank, stats
+from .models import Submission
+
+
+def deleting_whole_quiz(origin):
+    """
+    True when a delete signal comes from deleting quizzes (a Quiz or a Quiz
+    queryset). Everything a quiz's questions and submissions feed (its stats,
+    cached guides and answer key) is deleted along with it, so the per-row
+    receivers below can skip their queries.
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is Quiz
+    return isinstance(origin, Quiz)
+
+
+@receiver(post_save, sender=Question)
+@receiver(pre_delete, sender=Question)
+def drop_cached_study_guides(sender, instance, created=False, origin=None, **kwargs):
+    if created or deleting_whole_quiz(origin):
+        return
+    # pre_delete, because the cache entry's link to the question is gone after the delete.
+    guide_cache.invalidate_question(instance.id)
+
+
+def quiz_changed(quiz_id):
+    """
+    Bumps the quiz's version. Cached copies of the quiz (display_cache.py)
+    are keyed by it, so no worker uses its old copy once this commits.
+    """
+    Quiz.objects.filter(pk=quiz_id).update(version=F('version') + 1)
+
+
+@receiver(post_save, sender=Quiz)
+def bump_quiz_version(sender, instance, created=False, **kwargs):
+    if not created:
+        quiz_changed(instance.pk)
+
+
+@receiver(post_delete, sender=Quiz)
+def drop_cached_answer_key(sender, instance, **kwargs):
+    answer_key.invalidate(instance.id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def bump_quiz_version_for_question(sender, instance, origin=None, **kwargs):
+    if deleting_whole_quiz(origin):
+        return  # the quiz and everything cached about it are gone
+    answer_key.invalidate(instance.quiz_id)
+    quiz_changed(instance.quiz_id)
+
+
+def questions_added(quiz_id, questions):
+    """
+    What the Question receivers above do for new questions, done once for
+    questions saved with bulk_create() (which sends no signals).
+    """
+    question_bank.add(questions)
+    answer_key.invalidate(quiz_id)
+    quiz_changed(quiz_id)
+
+
+@receiver(post_save, sender=Question)
+def index_question(sender, instance, created=False, **kwargs):
+    # Deleted questions leave the index with their QuestionTerm rows (cascade).
+    if created:
+        question_bank.add([instance])
+    else:
+        question_bank.update(instance)
+
+
+@receiver(post_delete, sender=Submission)
+def remove_submission_from_stats(sender, instance, origin=None, **kwargs):
+    # Runs inside the delete's transaction. When a whole quiz is deleted its stats go with it.
+    if not deleting_whole_quiz(origin) and Quiz.objects.filter(pk=instance.quiz_id).exists():
+        stats.record_submission(instance.quiz_id, instance.score, change=-1)
@@ -0,0 +1,52 @@
+# In quiz_app/stats.py
+# Keeps QuizStats in step with the Submission table.
+#
+# record_submission() must run in the same transaction as the Submission
+# insert (or delete). It locks the quiz's stats row, so concurrent
+# submissions to one quiz are counted one after another. recompute() rebuilds
+# the totals from scratch (see `manage.py recompute_quiz_stats`).
+from django.db import transaction
+from django.db.models import Count
+
+from .models import Quiz, QuizStats, Submission
+
+
+def record_submission(quiz_id, score, change=1):
+    """Adds (change=1) or removes (change=-1) one submission from the totals."""
+    stats, _ = QuizStats.objects.select_for_update().get_or_create(quiz_id=quiz_id)
+    stats.submission_count = max(stats.submission_count + change, 0)
+    stats.score_total = max(stats.score_total + change * score, 0)
+
+    key = str(score)
+    remaining = stats.score_distribution.get(key, 0) + change
+    if remaining > 0:
+        stats.score_distribution[key] = remaining
+    else:
+        stats.score_distribution.pop(key, None)
+    stats.save()
+
+
+def recompute(quiz_ids=None):
+    """
+    Rebuilds the stats of the given quizzes (default: all) from their
+    submissions, one quiz per transaction. Returns how many were rebuilt.
+    """
+    quizzes = Quiz.objects.order_by('pk')
+    if quiz_ids is not None:
+        quizzes = quizzes.filter(pk__in=quiz_ids)
+
+    updated = 0
+    for quiz_id in quizzes.values_list('pk', flat=True).iterator():
+        with transaction.atomic():
+            # Hold the row lock while counting so no new submission is missed or counted twice.
+            stats, _ = QuizStats.objects.select_for_update().get_or_create(quiz_id=quiz_id)
+            counts = (
+                Submission.objects.filter(quiz_id=quiz_id).order_by()
+                .values_list('score').annotate(n=Count('id'))
+            )
+            stats.score_distribution = {str(score): n for score, n in counts}
+            stats.submission_count = sum(stats.score_distribution.values())
+            stats.score_total = sum(int(score) * n for score, n in stats.score_distribution.items())
+            stats.save()
+        updated += 1
+    return updated
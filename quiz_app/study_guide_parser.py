@@ -0,0 +1,175 @@
+# In quiz_app/study_guide_parser.py
+# Turns the LLM's study guide answer into practice question data.
+#
+# Study guides are asked for as JSON that follows STUDY_GUIDE_SCHEMA (the
+# LLM's structured output mode), which is decoded and checked in one pass.
+# Plain-text guides (older guides, replayed answers, or a model that ignored
+# the schema) go through a line-by-line parser instead. Both take time in
+# proportion to the length of the text, however it is malformed: no regex
+# here can backtrack across lines.
+import json
+import re
+
+MAX_QUESTIONS = 5
+LETTERS = 'ABCD'
+
+# The JSON the LLM is asked for (Gemini's responseSchema format).
+QUESTIONS_SCHEMA = {
+    'type': 'ARRAY',
+    'minItems': MAX_QUESTIONS,
+    'maxItems': MAX_QUESTIONS,
+    'items': {
+        'type': 'OBJECT',
+        'properties': {
+            'topic': {'type': 'STRING'},
+            'text': {'type': 'STRING'},
+            'options': {'type': 'ARRAY', 'items': {'type': 'STRING'}, 'minItems': 4, 'maxItems': 4},
+            'answer': {'type': 'STRING', 'enum': list(LETTERS)},
+        },
+        'required': ['topic', 'text', 'options', 'answer'],
+        'propertyOrdering': ['topic', 'text', 'options', 'answer'],
+    },
+}
+STUDY_GUIDE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'questions': QUESTIONS_SCHEMA},
+    'required': ['questions'],
+}
+# Several students' guides from one call; see tasks.build_batch_prompt.
+BATCH_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'guides': {
+            'type': 'ARRAY',
+            'items': {
+                'type': 'OBJECT',
+                'properties': {'student': {'type': 'INTEGER'}, 'questions': QUESTIONS_SCHEMA},
+                'required': ['student', 'questions'],
+            },
+        },
+    },
+    'required': ['guides'],
+}
+
+# One line of a plain-text guide, e.g. "Practice Question: ..." or "B) ...".
+# Only ever matched at the start of a single line.
+LINE = re.compile(
+    r'[*#\s]*(?:(fundamental topic|practice question|correct answer)[*\s]*:|([a-d])\s*\))[*\s]*(.*)',
+    re.IGNORECASE,
+)
+# The order a question's lines come in.
+FIELDS = ['topic', 'text', 'A', 'B', 'C', 'D', 'answer']
+KEYS = {'fundamental topic': 'topic', 'practice question': 'text', 'correct answer': 'answer'}
+
+
+def parse_study_guide_text(text):
+    """
+    Parses an AI study guide into a list of up to five practice questions:
+    [{'topic': ..., 'text': ..., 'options': [4 strings], 'answer': 'A'-'D'}]
+
+    `text` is either JSON following STUDY_GUIDE_SCHEMA, or plain text like:
+    Fundamental Topic: [Topic Title]
+    Practice Question: [Question Text]
+    A) [Option A]
+    B) [Option B]
+    C) [Option C]
+    D) [Option D]
+    Correct Answer: [A, B, C, or D]
+    """
+    if text.lstrip().startswith('{'):
+        return parse_structured(text)
+    return parse_lines(text)
+
+
+def load_json(text):
+    """The decoded JSON, or None if it isn't valid JSON."""
+    try:
+        return json.loads(text)
+    except (ValueError, RecursionError):
+        return None
+
+
+def parse_structured(text):
+    data = load_json(text)
+    if not isinstance(data, dict):
+        return []
+    return clean_questions(data.get('questions'))
+
+
+def clean_questions(items):
+    """Keeps the well-formed questions of a decoded 'questions' list."""
+    questions = []
+    if not isinstance(items, list):
+        return questions
+    for item in items:
+        question = clean_question(item)
+        if question is not None:
+            questions.append(question)
+            if len(questions) == MAX_QUESTIONS:
+                break
+    return questions
+
+
+def clean_question(item):
+    if not isinstance(item, dict):
+        return None
+    topic, text, options, answer = (item.get(key) for key in ('topic', 'text', 'options', 'answer'))
+    if not (isinstance(topic, str) and isinstance(text, str) and isinstance(answer, str)):
+        return None
+    if not (isinstance(options, list) and len(options) == 4 and all(isinstance(o, str) for o in options)):
+        return None
+    answer = answer.strip().upper()[:1]
+    if not answer or answer not in LETTERS:
+        return None
+    return {
+        'topic': topic.strip(),
+        'text': text.strip(),
+        'options': [o.strip() for o in options],
+        'answer': answer,
+    }
+
+
+def parse_lines(text):
+    """
+    The plain-text parser. A question is the seven lines in FIELDS order;
+    lines that don't start a field continue the one before. A question
+    that comes out of order is dropped, like the old regex did.
+    """
+    questions = []
+    parts = None  # field -> list of lines, for the question being read
+    field = None
+    for line in text.splitlines():
+        match = LINE.match(line)
+        if match is None:
+            if parts is not None and line.strip():
+                parts[field].append(line.strip())
+            continue
+
+        key, letter, value = match.groups()
+        new_field = letter.upper() if letter else KEYS[key.lower()]
+        if new_field == 'topic':
+            parts = {}
+        elif parts is None or FIELDS.index(new_field) != FIELDS.index(field) + 1:
+            parts = None  # out of order
+            continue
+        field = new_field
+        parts[field] = [value.strip().strip('*').strip()]
+
+        if field == 'answer':
+            answer = parts['answer'][0][:1].upper()
+            if answer and answer in LETTERS:
+                questions.append({
+                    'topic': ' '.join(parts['topic']),
+                    'text': ' '.join(parts['text']),
+                    'options': [' '.join(parts[letter]) for letter in LETTERS],
+                    'answer': answer,
+                })
+                if len(questions) == MAX_QUESTIONS:
+                    break
+            parts = None
+    return questions
+
+
+def questions_to_json(questions):
+    """One student's guide in the STUDY_GUIDE_SCHEMA format."""
+    return json.dumps({'questions': questions})
@@ -0,0 +1,140 @@
+# In quiz_app/study_guide_pdf.py
+# Renders a study guide straight to PDF bytes in memory (no temp files).
+#
+# The guide is laid out from the questions parse_study_guide_text finds
+# (topic, question, options, then an answer key at the end); if the text
+# can't be parsed, its paragraphs are printed as they are.
+#
+# fpdf's multi_cell re-measures the whole line each time it adds a
+# character, which made it most of the render time. Here each font's
+# character widths are looked up once per process, text is wrapped with a
+# running width, and every finished line is written with a single cell().
+# The page layout (margins, fonts, header and footer) is set up once, in
+# the StudyGuidePDF class.
+from functools import lru_cache
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos
+from fpdf.fonts import CORE_FONTS_CHARWIDTHS
+
+from .study_guide_parser import parse_study_guide_text
+
+PAGE_MARGIN = 15  # mm
+LINE_WIDTH = 210 - 2 * PAGE_MARGIN  # A4, in mm
+OPTION_INDENT = 8  # mm
+
+# (family, style, size in pt, line height in mm)
+TITLE_FONT = ('helvetica', 'B', 16, 9)
+HEADING_FONT = ('helvetica', 'B', 12, 7)
+BODY_FONT = ('helvetica', '', 11, 6)
+SMALL_FONT = ('helvetica', 'I', 8, 4)
+
+# The built-in PDF fonts only cover Latin-1; map the usual LLM punctuation.
+PUNCTUATION = str.maketrans({
+    '\u2018': "'", '\u2019': "'", '\u201c': '"', '\u201d': '"',
+    '\u2013': '-', '\u2014': '-', '\u2026': '...', '\u2022': '-', '\u00a0': ' ',
+})
+
+
+@lru_cache(maxsize=None)
+def char_widths(family, style, size):
+    """Width in mm of every character in a built-in font, at `size` pt."""
+    scale = size / 1000 * 25.4 / 72
+    return {char: width * scale for char, width in CORE_FONTS_CHARWIDTHS[family + style].items()}
+
+
+def clean(text):
+    text = text.translate(PUNCTUATION)
+    return text.encode('latin-1', 'replace').decode('latin-1')
+
+
+def wrap(text, font, width):
+    """Splits one paragraph into lines no wider than `width` mm."""
+    widths = char_widths(*font[:3])
+    space = widths[' ']
+    lines = []
+    line, line_width = [], 0.0
+    for word in text.split():
+        word_width = sum(widths[c] for c in word)
+        if line and line_width + space + word_width > width:
+            lines.append(' '.join(line))
+            line, line_width = [], 0.0
+        # A word longer than a whole line is cut wherever it has to be.
+        while word_width > width:
+            cut, cut_width = 0, 0.0
+            while cut < len(word) and cut_width + widths[word[cut]] <= width:
+                cut_width += widths[word[cut]]
+                cut += 1
+            cut = max(cut, 1)
+            lines.append(word[:cut])
+            word = word[cut:]
+            word_width = sum(widths[c] for c in word)
+        if word:
+            line_width += (space if line else 0) + word_width
+            line.append(word)
+    if line:
+        lines.append(' '.join(line))
+    return lines
+
+
+class StudyGuidePDF(FPDF):
+    """One study guide: A4, fixed margins, the quiz title and page number on every page."""
+
+    def __init__(self, quiz_title):
+        super().__init__(format='A4')
+        self.quiz_title = quiz_title
+        self.set_margins(PAGE_MARGIN, PAGE_MARGIN, PAGE_MARGIN)
+        self.set_auto_page_break(True, margin=PAGE_MARGIN)
+        self.set_title(f"Study Guide for {quiz_title}")
+        self.add_page()
+
+    def use(self, font):
+        family, style, size, _ = font
+        self.set_font(family, style, size)
+
+    def header(self):
+        if self.page_no() > 1:
+            self.use(SMALL_FONT)
+            self.cell(0, SMALL_FONT[3], f"Study Guide for {self.quiz_title}", new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+            self.ln(2)
+
+    def footer(self):
+        self.set_y(-PAGE_MARGIN + 5)
+        self.use(SMALL_FONT)
+        self.cell(0, SMALL_FONT[3], f"Page {self.page_no()}", align='C')
+
+    def write_lines(self, text, font, indent=0, align='L'):
+        """Writes a paragraph, wrapped to the page width."""
+        self.use(font)
+        for line in wrap(text, font, LINE_WIDTH - indent):
+            self.set_x(PAGE_MARGIN + indent)
+            self.cell(LINE_WIDTH - indent, font[3], line, align=align, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+
+def render_pdf(quiz_title, study_guide_text):
+    """Returns the study guide as PDF bytes."""
+    quiz_title = clean(quiz_title)
+    study_guide_text = clean(study_guide_text)
+    questions = parse_study_guide_text(study_guide_text)
+
+    pdf = StudyGuidePDF(quiz_title)
+    pdf.write_lines(f"Study Guide for {quiz_title}", TITLE_FONT, align='C')
+    pdf.ln(4)
+
+    if questions:
+        for n, question in enumerate(questions, start=1):
+            pdf.write_lines(f"{n}. {question['topic']}", HEADING_FONT)
+            pdf.write_lines(question['text'], BODY_FONT)
+            for letter, option in zip('ABCD', question['options']):
+                pdf.write_lines(f"{letter}) {option}", BODY_FONT, indent=OPTION_INDENT)
+            pdf.ln(4)
+        pdf.write_lines("Answers", HEADING_FONT)
+        pdf.write_lines('   '.join(f"{n}. {q['answer']}" for n, q in enumerate(questions, start=1)), BODY_FONT)
+    else:
+        for paragraph in study_guide_text.split('\n'):
+            if paragraph.strip():
+                pdf.write_lines(paragraph, BODY_FONT)
+            else:
+                pdf.ln(BODY_FONT[3])
+
+    return bytes(pdf.output())
@@ -0,0 +1,340 @@
+# In quiz_app/tasks.py
+# The background half of the study-guide pipeline:
+#   score -> persist (in the request) -> generate -> render -> deliver (here)
+# Each stage is its own background task. It stores its output on the
+# StudyGuide row and then queues the next stage, so a slow or failing LLM or
+# email call only ever retries its own stage. Run the worker with:
+#   python manage.py process_tasks
+
+import re
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from background_task import background
+from background_task.models import Task
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import ai, guide_cache, metrics, outbox, question_bank, rescore
+from .study_guide_parser import BATCH_SCHEMA, STUDY_GUIDE_SCHEMA, clean_questions, load_json, questions_to_json
+from .models import RescoreJob, StudyGuide
+from accounts.models import Question
+
+
+@contextmanager
+def run_stage(guide, stage):
+    """
+    Marks a stage as running, then done or failed.
+    Errors are re-raised so background_task reschedules the task.
+    """
+    guide.mark(stage, StudyGuide.RUNNING)
+    try:
+        yield
+    except Exception as e:
+        print(f"!!! TASK ERROR ({stage}) for submission {guide.submission_id}: {e}")
+        guide.mark(stage, StudyGuide.FAILED, error=str(e))
+        raise
+    guide.mark(stage, StudyGuide.DONE)
+
+
+@contextmanager
+def run_batch_stage(guides, stage):
+    """
+    run_stage for several guides at once. If it fails, every guide is
+    marked failed and released, so the retried task can claim them again.
+    """
+    for guide in guides:
+        guide.mark(stage, StudyGuide.RUNNING)
+    try:
+        yield
+    except Exception as e:
+        print(f"!!! TASK ERROR ({stage}) for {len(guides)} study guide(s): {e}")
+        StudyGuide.objects.filter(pk__in=[guide.pk for guide in guides]).update(batch_id='')
+        for guide in guides:
+            guide.mark(stage, StudyGuide.FAILED, error=str(e))
+        raise
+    for guide in guides:
+        guide.mark(stage, StudyGuide.DONE)
+
+
+def get_guide(guide_id):
+    return StudyGuide.objects.select_related('submission__quiz').get(pk=guide_id)
+
+
+def build_study_guide_prompt(wrong_questions):
+    prompt_text = "The following are questions a student answered incorrectly:\n\n"
+    for q in wrong_questions:
+        prompt_text += f"- Question: {q.text}\n"
+    prompt_text += "\nPlease generate exactly *five multiple choice questions* and nothing else no header, no introduction, just multiple choice questions..."
+    return prompt_text
+
+
+def render_study_guide_pdf(quiz_title, study_guide_text):
+    # fpdf is slow to import, and only the worker ever needs it.
+    from .study_guide_pdf import render_pdf
+
+    with metrics.span('pdf'):
+        return render_pdf(quiz_title, study_guide_text)
+
+
+# --- Stage 3: generate the study guide text ---
+# When a whole class submits at once, the guides for one quiz are generated
+# together: the first generate task to run claims every pending guide for
+# that quiz (up to STUDY_GUIDE_BATCH_MAX_SIZE), and one LLM call writes a
+# section per distinct set of missed questions. The other students' tasks
+# then find their guide already claimed and do nothing.
+BATCH_WINDOW = getattr(settings, 'STUDY_GUIDE_BATCH_WINDOW', 10)
+BATCH_MAX_SIZE = getattr(settings, 'STUDY_GUIDE_BATCH_MAX_SIZE', 10)
+# A claim older than this belongs to a worker that died mid-batch.
+STALE_CLAIM_AGE = timedelta(seconds=getattr(settings, 'MAX_RUN_TIME', 3600))
+
+# Ask for JSON study guides (see study_guide_parser.py) instead of plain text.
+STRUCTURED_OUTPUT = getattr(settings, 'STUDY_GUIDE_STRUCTURED_OUTPUT', True)
+# Try the question bank (see question_bank.py) before the LLM.
+FROM_QUESTION_BANK = getattr(settings, 'STUDY_GUIDE_FROM_QUESTION_BANK', True)
+
+SECTION_HEADER = re.compile(r'^=== STUDENT (\d+) ===[ \t]*$', re.MULTILINE)
+
+batches = metrics.counter('study_guide_batches', 'Batched study-guide generate runs')
+batched_guides = metrics.counter('study_guide_batched_guides', 'Study guides generated in batches')
+llm_calls = metrics.counter('study_guide_llm_calls', 'LLM calls made for study guides')
+llm_calls_saved = metrics.counter('study_guide_llm_calls_saved', 'LLM calls saved by batching and the guide cache')
+
+
+def queue_study_guide(guide_id):
+    """Queues the generate stage, leaving time for classmates' guides to join its batch."""
+    generate_study_guide(guide_id, schedule=BATCH_WINDOW)
+
+
+def claim_batch(guide):
+    """
+    Claims `guide` and the other guides for the same quiz still waiting to
+    be generated. Returns the claimed guides, or [] if another task already
+    claimed `guide`.
+    """
+    waiting = (
+        StudyGuide.objects
+        .filter(submission__quiz_id=guide.submission.quiz_id, batch_id='',
+                stages__generate__in=[StudyGuide.PENDING, StudyGuide.FAILED])
+        .exclude(pk=guide.pk)
+        .order_by('id')
+        .values_list('id', flat=True)[:BATCH_MAX_SIZE - 1]
+    )
+    batch_id = uuid.uuid4().hex
+    # The batch_id='' filter makes the claim atomic: a guide claimed by
+    # another task in the meantime is simply not updated here.
+    StudyGuide.objects.filter(pk__in=[guide.pk, *waiting], batch_id='').update(batch_id=batch_id)
+    guides = list(StudyGuide.objects.select_related('submission__quiz').filter(batch_id=batch_id).order_by('id'))
+    if guide.pk not in {g.pk for g in guides}:
+        StudyGuide.objects.filter(batch_id=batch_id).update(batch_id='')
+        return []
+    return guides
+
+
+def build_batch_prompt(groups):
+    """One prompt asking for a separate study guide per set of missed questions."""
+    prompt_text = "Below are the questions several students answered incorrectly, one list per student.\n"
+    if STRUCTURED_OUTPUT:
+        prompt_text += "Write a separate study guide for each student, with the student's number below as 'student'.\n\n"
+    else:
+        prompt_text += (
+            "Write a separate study guide for each student. Start each one with a line "
+            "'=== STUDENT n ===' (n is the student's number below) and write nothing before the first one.\n\n"
+        )
+    for n, wrong_questions in enumerate(groups, start=1):
+        prompt_text += f"=== STUDENT {n} ===\n"
+        for q in wrong_questions:
+            prompt_text += f"- Question: {q.text}\n"
+        prompt_text += "\n"
+    prompt_text += "For each student, generate exactly *five multiple choice questions* and nothing else no header, no introduction, just multiple choice questions..."
+    return prompt_text
+
+
+def split_batch_answer(text, count):
+    """Maps each student number (1..count) to its section of a batched answer."""
+    sections = {}
+    if text.lstrip().startswith('{'):
+        data = load_json(text)
+        guides = data.get('guides') if isinstance(data, dict) else None
+        for guide in guides if isinstance(guides, list) else []:
+            n = guide.get('student') if isinstance(guide, dict) else None
+            questions = clean_questions(guide.get('questions')) if isinstance(n, int) else []
+            if questions and 1 <= n <= count:
+                sections[n] = questions_to_json(questions)
+        return sections
+    headers = list(SECTION_HEADER.finditer(text))
+    for header, following in zip(headers, headers[1:] + [None]):
+        n = int(header.group(1))
+        body = text[header.end():following.start() if following else len(text)].strip()
+        if 1 <= n <= count and body:
+            sections[n] = body
+    return sections
+
+
+def generate_texts(groups):
+    """
+    Returns (texts, LLM calls made): the study guide text for each list of
+    missed questions, using one LLM call for all of them. Sections missing
+    from the batched answer are generated one by one.
+    """
+    schema = STUDY_GUIDE_SCHEMA if STRUCTURED_OUTPUT else None
+    if len(groups) == 1:
+        return [ai.generate_content(build_study_guide_prompt(groups[0]), schema=schema)], 1
+
+    # Streamed, so a long batched answer isn't cut off by the per-request timeout.
+    answer = ''.join(ai.stream_content(build_batch_prompt(groups), schema=BATCH_SCHEMA if schema else None))
+    sections = split_batch_answer(answer, len(groups))
+    calls = 1
+    texts = []
+    for n, wrong_questions in enumerate(groups, start=1):
+        if n not in sections:
+            print(f"TASK: Batched answer had no section {n}, generating it on its own.")
+            sections[n] = ai.generate_content(build_study_guide_prompt(wrong_questions), schema=schema)
+            calls += 1
+        texts.append(sections[n])
+    return texts, calls
+
+
+@background(schedule=0)
+def generate_study_guide(guide_id):
+    guide = get_guide(guide_id)
+    if guide.stages.get('generate') == StudyGuide.DONE:
+        # Already generated in another task's batch.
+        return
+    if guide.batch_id:
+        if guide.updated_at > timezone.now() - STALE_CLAIM_AGE:
+            return  # another task is generating it right now
+        StudyGuide.objects.filter(batch_id=guide.batch_id).update(batch_id='')
+        guide.batch_id = ''
+    guides = claim_batch(guide)
+    if not guides:
+        return
+
+    cached, groups, calls = [], {}, 0
+    with run_batch_stage(guides, 'generate'):
+        for g in guides:
+            # Keep the quiz order of the missed questions.
+            by_id = Question.objects.in_bulk(g.missed_question_ids)
+            wrong_questions = [by_id[pk] for pk in g.missed_question_ids if pk in by_id]
+
+            # Another student who missed the same questions may already have a guide.
+            g.cache_key = guide_cache.cache_key(g.submission.quiz, wrong_questions)
+            hit = guide_cache.get(g.cache_key)
+            if hit:
+                print(f"TASK: Reusing cached study guide for {g.submission.student_name}")
+                g.text, g.pdf = hit
+                g.save(update_fields=['cache_key', 'text', 'pdf', 'updated_at'])
+                cached.append(g)
+            else:
+                # Students who missed the same questions share one section.
+                groups.setdefault(g.cache_key, (wrong_questions, []))[1].append(g)
+
+        # Teachers may already have written questions like the missed ones.
+        for key, (wrong_questions, members) in list(groups.items()):
+            text = question_bank.study_guide(wrong_questions, guide.submission.quiz_id) if FROM_QUESTION_BANK else None
+            if text:
+                print(f"TASK: Made study guide for {len(members)} student(s) from the question bank")
+                for g in members:
+                    g.text = text
+                    g.save(update_fields=['cache_key', 'text', 'updated_at'])
+                del groups[key]
+
+        if groups:
+            print(f"TASK: Generating AI text for {len(groups)} missed-question set(s) ({len(guides)} guides)")
+            texts, calls = generate_texts([wrong_questions for wrong_questions, _ in groups.values()])
+            llm_calls.inc(calls)
+            for text, (_, members) in zip(texts, groups.values()):
+                for g in members:
+                    g.text = text
+                    g.save(update_fields=['cache_key', 'text', 'updated_at'])
+            print("TASK: AI content received.")
+
+    if len(guides) > 1:
+        batches.inc()
+        batched_guides.inc(len(guides))
+        print(f"TASK: Batched {len(guides)} study guides into {calls} LLM call(s).")
+    llm_calls_saved.inc(len(guides) - calls)
+
+    for g in guides:
+        if g in cached:
+            g.mark('render', StudyGuide.DONE)
+            deliver_study_guide(g.id)
+        else:
+            render_study_guide(g.id)
+
+
+# --- Stage 4: render the PDF ---
+@background(schedule=0)
+def render_study_guide(guide_id):
+    guide = get_guide(guide_id)
+    quiz = guide.submission.quiz
+    with run_stage(guide, 'render'):
+        guide.pdf = render_study_guide_pdf(quiz.title, guide.text)
+        guide.save(update_fields=['pdf', 'updated_at'])
+        print("TASK: PDF created.")
+
+        if guide.cache_key:
+            guide_cache.put(guide.cache_key, quiz, guide.missed_question_ids, guide.text, guide.pdf)
+
+    deliver_study_guide(guide_id)
+
+
+# --- Stage 5: email the PDF to the student ---
+# The email goes into the outbox (quiz_app/outbox.py); send_outbox sends
+# everything that is queued in batches over one connection. The 'deliver'
+# stage is marked done when the email has actually been sent.
+OUTBOX_FLUSH_DELAY = getattr(settings, 'OUTBOX_FLUSH_DELAY', 5)  # seconds
+
+
+@background(schedule=0)
+def deliver_study_guide(guide_id):
+    guide = get_guide(guide_id)
+    submission = guide.submission
+    if guide.emails.exists():
+        print(f"TASK: Study guide for {submission.student_email} is already in the outbox")
+        return
+    with transaction.atomic():
+        outbox.enqueue(
+            subject=f"Your Personalized Study Guide for '{submission.quiz.title}'",
+            body=f"Hello {submission.student_name},\n\nHere is your study guide...",
+            to=[submission.student_email],
+            attachment=('study_guide.pdf', bytes(guide.pdf), 'application/pdf'),
+            study_guide=guide,
+        )
+        guide.mark('deliver', StudyGuide.RUNNING)
+    print(f"TASK: Queued study guide email to {submission.student_email}")
+    schedule_send_outbox(OUTBOX_FLUSH_DELAY)
+
+
+def schedule_send_outbox(delay):
+    """
+    Queues a send_outbox run `delay` seconds from now, unless one is already
+    queued to run by then (so a class submitting at once shares one run).
+    """
+    run_at = timezone.now() + timedelta(seconds=delay)
+    already_queued = Task.objects.filter(
+        task_name=send_outbox.name, locked_by__isnull=True, run_at__lte=run_at,
+    ).exists()
+    if not already_queued:
+        send_outbox(schedule=run_at)
+
+
+@background(schedule=0)
+def send_outbox():
+    totals = outbox.drain()
+    print(f"TASK: Outbox sent {totals['sent']}, will retry {totals['retried']}, gave up on {totals['dead']}")
+    retry_at = outbox.next_attempt_at()
+    if retry_at is not None:
+        schedule_send_outbox(max((retry_at - timezone.now()).total_seconds(), 0))
+
+
+# --- Rescoring a quiz after a question is fixed (see quiz_app/rescore.py) ---
+@background(schedule=0)
+def rescore_quiz(job_id):
+    # Progress is saved per chunk, so when this task is retried it resumes.
+    job = RescoreJob.objects.filter(pk=job_id, status=RescoreJob.RUNNING).first()
+    if job is None:
+        return
+    rescore.run(job, progress=lambda j: print(f"TASK: Rescored {j.processed}/{j.total} submissions for quiz {j.quiz_id}"))
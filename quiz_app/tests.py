@@ -1,3 +1,1615 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from background_task.models import Task
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import AccessCodeAllocator, generate_access_code
+from config.middleware import query_budget
+
+from .models import Quiz, Question, OutboxEmail, QuestionTerm, QuizAnswerKey, QuizStats, RescoreJob, Submission, StudyGuide, StudyGuideCacheEntry
+from . import admission, ai, answer_key, question_bank, display_cache, guide_cache, metrics, outbox, rescore, stats, study_guide_pdf, tasks
+from . import urls as quiz_urls
+from .exports import stream_submissions_csv
+from .quiz_builder import build_quiz
+from .quiz_stream import QuestionStreamParser
+from .study_guide_parser import parse_study_guide_text
+from .views import build_ai_quiz_prompt, process_submission
+
+
+def make_quiz(title='Fractions', num_questions=3):
+    quiz = Quiz.objects.create(title=title)
+    for i in range(num_questions):
+        Question.objects.create(
+            quiz=quiz,
+            text=f"Question {i}",
+            options=['A', 'B', 'C', 'D'],
+            correct_index=0,
+        )
+    return quiz
+
+
+def post_submission(client, quiz, answers, email='sam@example.com', url='quiz_app:submit_quiz', **headers):
+    """
+    Posts answers the way the quiz page does. Keyword arguments left over are
+    sent as headers: idempotency_key='k' becomes Idempotency-Key: k.
+    """
+    return client.post(
+        reverse(url), content_type='application/json',
+        data=json.dumps({'access_code': quiz.access_code, 'name': 'Sam', 'email': email, 'answers': answers}),
+        headers={name.replace('_', '-').title(): value for name, value in headers.items()},
+    )
+
+
+FAKE_AI_TEXT = "1. Practice question\nA) a\nB) b\nC) c\nD) d\nAnswer: A"
+
+
+class SubmitQuizPipelineTests(TestCase):
+
+    def setUp(self):
+        self.quiz = make_quiz()
+
+    def test_submit_returns_after_persisting_and_queues_generation(self):
+        with mock.patch('quiz_app.ai.generate_content') as generate:
+            response = post_submission(self.client, self.quiz, {'0': 'A', '1': 'B', '2': 'A'})
+            generate.assert_not_called()
+
+        data = response.json()
+        self.assertEqual(data['status'], 'success')
+        submission = Submission.objects.get(pk=data['submission_id'])
+        self.assertEqual(submission.score, 2)
+
+        guide = submission.study_guide
+        self.assertEqual(guide.stages['persist'], StudyGuide.DONE)
+        self.assertEqual(guide.stages['generate'], StudyGuide.PENDING)
+        self.assertEqual(len(guide.missed_question_ids), 1)
+        self.assertEqual(Task.objects.filter(task_name='quiz_app.tasks.generate_study_guide').count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_perfect_score_skips_the_background_stages(self):
+        response = post_submission(self.client, self.quiz, {'0': 'A', '1': 'A', '2': 'A'})
+
+        guide = StudyGuide.objects.get(submission_id=response.json()['submission_id'])
+        self.assertEqual(guide.stages['deliver'], StudyGuide.SKIPPED)
+        self.assertFalse(Task.objects.exists())
+
+    def test_background_stages_email_the_pdf(self):
+        response = post_submission(self.client, self.quiz, {'0': 'B', '1': 'B', '2': 'A'})
+        submission_id = response.json()['submission_id']
+        guide = StudyGuide.objects.get(submission_id=submission_id)
+
+        with mock.patch('quiz_app.ai.generate_content', return_value=FAKE_AI_TEXT):
+            tasks.generate_study_guide.now(guide.id)
+        tasks.render_study_guide.now(guide.id)
+        tasks.deliver_study_guide.now(guide.id)
+        self.assertEqual(len(mail.outbox), 0)  # queued, not sent yet
+        tasks.send_outbox.now()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['sam@example.com'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'study_guide.pdf')
+
+        status = self.client.get(reverse('quiz_app:api_submission_status', args=[submission_id])).json()
+        self.assertEqual(set(status['stages'].values()), {StudyGuide.DONE})
+        self.assertTrue(status['study_guide_sent'])
+
+    def test_failed_stage_is_reported_and_reraised(self):
+        response = post_submission(self.client, self.quiz, {'0': 'B', '1': 'B', '2': 'B'})
+        guide = StudyGuide.objects.get(submission_id=response.json()['submission_id'])
+
+        with mock.patch('quiz_app.ai.generate_content', side_effect=RuntimeError('quota exceeded')):
+            with self.assertRaises(RuntimeError):
+                tasks.generate_study_guide.now(guide.id)
+
+        guide.refresh_from_db()
+        self.assertEqual(guide.stages['generate'], StudyGuide.FAILED)
+        self.assertEqual(guide.error, 'quota exceeded')
+
+
+class DashboardDataTests(TestCase):
+
+    def setUp(self):
+        self.url = reverse('quiz_app:api_dashboard_data')
+
+    def make_submissions(self, quiz, count):
+        Submission.objects.bulk_create([
+            Submission(quiz=quiz, student_name=f"Student {i}", student_email='s@example.com', score=i % 3)
+            for i in range(count)
+        ])
+        # bulk_create skips the running totals, so rebuild them.
+        stats.recompute([quiz.id])
+
+    def test_query_count_does_not_grow_with_submissions(self):
+        quiz = make_quiz()
+        self.make_submissions(quiz, 5)
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+
+        self.make_submissions(make_quiz('Decimals', 7), 40)
+        with self.assertNumQueries(4):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['totals'], {'quizzes': 2, 'results': 45})
+        self.assertEqual({r['total_questions'] for r in data['results']}, {3, 7})
+        self.assertEqual(
+            {q['code']: q['submission_count'] for q in data['quizzes']},
+            {quiz.access_code: 5, Quiz.objects.get(title='Decimals').access_code: 40},
+        )
+
+    def test_cursor_walks_every_result_exactly_once(self):
+        self.make_submissions(make_quiz(), 23)
+
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 10}
+            if cursor:
+                params['results_cursor'] = cursor
+            data = self.client.get(self.url, params).json()
+            self.assertLessEqual(len(data['results']), 10)
+            seen += [r['student_name'] for r in data['results']]
+            cursor = data['next_results_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen), 23)
+        self.assertEqual(len(set(seen)), 23)
+
+    def test_page_size_is_capped(self):
+        self.make_submissions(make_quiz(), 5)
+        with mock.patch('quiz_app.views.DASHBOARD_MAX_PAGE_SIZE', 3):
+            data = self.client.get(self.url, {'limit': 10_000}).json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertIsNotNone(data['next_results_cursor'])
+
+    def test_bad_cursor_is_rejected(self):
+        response = self.client.get(self.url, {'results_cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_pages_are_not_grouped_and_later_pages_skip_the_totals(self):
+        self.make_submissions(make_quiz(), 5)
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(self.url, {'limit': 2}).json()
+        pages = [q['sql'] for q in queries.captured_queries if 'ORDER BY' in q['sql']]
+        self.assertEqual(len(pages), 2)
+        for sql in pages:
+            self.assertNotIn('GROUP BY', sql)
+
+        with self.assertNumQueries(3):
+            more = self.client.get(self.url, {'limit': 2, 'results_cursor': data['next_results_cursor']}).json()
+        self.assertIsNone(more['totals'])
+        self.assertEqual({r['total_questions'] for r in more['results']}, {3})
+
+
+class StudyGuideCacheTests(TestCase):
+
+    def setUp(self):
+        self.quiz = make_quiz()
+        self.questions = list(self.quiz.questions.order_by('id'))
+
+    def run_pipeline(self, answers):
+        submission = Submission.objects.create(
+            quiz=self.quiz, student_name='Sam', student_email='sam@example.com', answers=answers, score=0,
+        )
+        missed = [q.id for i, q in enumerate(self.questions) if answers.get(str(i)) != 'A']
+        guide = StudyGuide.objects.create(submission=submission, missed_question_ids=missed)
+        with mock.patch('quiz_app.ai.generate_content', return_value=FAKE_AI_TEXT) as generate:
+            tasks.generate_study_guide.now(guide.id)
+        guide.refresh_from_db()
+        if guide.stages.get('render') != StudyGuide.DONE:
+            # Only a cache miss goes through the render stage.
+            tasks.render_study_guide.now(guide.id)
+        tasks.deliver_study_guide.now(guide.id)
+        tasks.send_outbox.now()
+        return generate
+
+    def test_same_missed_questions_skip_the_llm(self):
+        first = self.run_pipeline({'0': 'B', '1': 'A', '2': 'C'})
+        second = self.run_pipeline({'2': 'D', '0': 'D', '1': 'A'})
+
+        self.assertEqual(first.call_count, 1)
+        self.assertEqual(second.call_count, 0)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].attachments[0][1], mail.outbox[1].attachments[0][1])
+        self.assertEqual(StudyGuideCacheEntry.objects.get().hits, 1)
+
+    def test_different_missed_questions_miss_the_cache(self):
+        self.run_pipeline({'0': 'B', '1': 'A', '2': 'A'})
+        generate = self.run_pipeline({'0': 'A', '1': 'B', '2': 'A'})
+        self.assertEqual(generate.call_count, 1)
+
+    def test_editing_a_question_invalidates_its_entries(self):
+        self.run_pipeline({'0': 'B', '1': 'A', '2': 'A'})
+        self.assertEqual(StudyGuideCacheEntry.objects.count(), 1)
+
+        question = self.questions[0]
+        question.text = 'A clearer question'
+        question.save()
+        self.assertFalse(StudyGuideCacheEntry.objects.exists())
+
+    def test_size_limit_evicts_least_recently_used(self):
+        key_a = guide_cache.cache_key(self.quiz, self.questions[:1])
+        key_b = guide_cache.cache_key(self.quiz, self.questions[1:2])
+        guide_cache.put(key_a, self.quiz, [self.questions[0].id], 'a', b'x' * 100)
+        with mock.patch('quiz_app.guide_cache.MAX_BYTES', 150):
+            guide_cache.put(key_b, self.quiz, [self.questions[1].id], 'b', b'y' * 100)
+
+        self.assertIsNone(guide_cache.get(key_a))
+        self.assertEqual(guide_cache.get(key_b), ('b', b'y' * 100))
+
+    def test_old_entries_expire(self):
+        key = guide_cache.cache_key(self.quiz, self.questions[:1])
+        guide_cache.put(key, self.quiz, [self.questions[0].id], 'a', b'x')
+        with mock.patch('quiz_app.guide_cache.MAX_AGE', -1):
+            self.assertIsNone(guide_cache.get(key))
+
+
+class QuizBuilderTests(TestCase):
+
+    def questions_data(self, count):
+        return [{'text': f"Q{i}", 'options': ['a', 'b'], 'correct_index': 1} for i in range(count)]
+
+    def test_quiz_is_written_in_constant_queries(self):
+        # Reserve a block of access codes up front so the count is stable
+        # (the block is only kept once the reservation commits).
+        with mock.patch('accounts.models.access_code_allocator', AccessCodeAllocator(block_size=100)):
+            with self.captureOnCommitCallbacks(execute=True):
+                generate_access_code()
+            # The quiz, its questions and their question bank index rows: one INSERT each.
+            with self.assertNumQueries(7):
+                build_quiz('Small', self.questions_data(3))
+            with self.assertNumQueries(7):
+                quiz = build_quiz('Large', self.questions_data(60))
+        self.assertEqual(quiz.questions.count(), 60)
+
+    def test_one_bad_question_saves_nothing(self):
+        data = self.questions_data(3)
+        data[1]['correct_index'] = 5
+        data[2]['options'] = []
+        with self.assertRaises(ValidationError) as cm:
+            build_quiz('Broken', data)
+
+        self.assertEqual(set(cm.exception.message_dict), {'question 2', 'question 3'})
+        self.assertFalse(Quiz.objects.exists())
+        self.assertFalse(Question.objects.exists())
+
+    def test_save_quiz_view_reports_validation_errors(self):
+        response = self.client.post(
+            reverse('quiz_app:api_save_quiz'),
+            data=json.dumps({'title': 'Manual', 'questions': [{'q': 'Q', 'options': ['a'], 'correctIndex': 3}]}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('question 1', response.json()['errors'])
+        self.assertFalse(Quiz.objects.exists())
+
+
+class QuizDisplayCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.quiz = make_quiz()
+        self.url = reverse('quiz_app:quiz_display', args=[self.quiz.access_code.lower()])
+
+    def test_second_visit_only_reads_the_quiz_row(self):
+        hits, misses = display_cache.hits.value, display_cache.misses.value
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+
+        self.assertContains(response, 'Question 2')
+        self.assertEqual(display_cache.hits.value - hits, 1)
+        self.assertEqual(display_cache.misses.value - misses, 1)
+
+    def test_editing_a_question_shows_up_right_away(self):
+        self.client.get(self.url)
+        question = self.quiz.questions.first()
+        question.text = 'Edited question'
+        question.save()
+        self.assertContains(self.client.get(self.url), 'Edited question')
+
+    def test_another_workers_old_copy_is_not_used(self):
+        self.client.get(self.url)
+        old_key = display_cache.cache_key(self.quiz.id, Quiz.objects.get(pk=self.quiz.pk).version)
+        old_copy = cache.get(old_key)
+
+        question = self.quiz.questions.first()
+        question.text = 'Edited question'
+        question.save()
+        # Signals only run in the worker that made the edit; the others still have their copy.
+        cache.set(old_key, old_copy)
+        self.assertContains(self.client.get(self.url), 'Edited question')
+
+    def test_saving_a_stale_quiz_instance_does_not_undo_a_version_bump(self):
+        stale = Quiz.objects.get(pk=self.quiz.pk)
+        question = self.quiz.questions.first()
+        question.text = 'Edited question'
+        question.save()
+        version = Quiz.objects.get(pk=self.quiz.pk).version
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(Quiz.objects.get(pk=self.quiz.pk).version, version + 1)
+
+    def test_deleting_the_quiz_clears_the_page(self):
+        self.client.get(self.url)
+        self.quiz.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class AnswerKeyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.quiz = make_quiz()
+        self.questions = list(self.quiz.questions.order_by('id'))
+
+    def test_scoring_does_not_load_questions(self):
+        post_submission(self.client, self.quiz, {'0': 'A'}).json()
+        with CaptureQueriesContext(connection) as queries:
+            response = post_submission(self.client, self.quiz, {'0': 'A', '1': 'B', '2': 'A'}).json()
+        self.assertFalse([q for q in queries.captured_queries if 'accounts_question' in q['sql']])
+
+        submission = Submission.objects.get(pk=response['submission_id'])
+        self.assertEqual(submission.score, 2)
+        self.assertEqual(submission.study_guide.missed_question_ids, [self.questions[1].id])
+
+    def test_editing_a_question_rebuilds_the_key(self):
+        post_submission(self.client, self.quiz, {'0': 'A'}).json()
+        question = self.questions[0]
+        question.correct_index = 2
+        question.save()
+
+        key = answer_key.get(self.quiz.id)
+        self.assertEqual(key['correct'], [2, 0, 0])
+        self.assertEqual(QuizAnswerKey.objects.get(pk=self.quiz.pk).correct_indices, [2, 0, 0])
+        self.assertEqual(answer_key.score(key, {'0': 'C', '1': 'A', '2': 'D'}), (2, [self.questions[2].id]))
+
+    def test_another_workers_old_key_is_not_used(self):
+        post_submission(self.client, self.quiz, {'0': 'A'}).json()
+        old_version = Quiz.objects.get(pk=self.quiz.pk).version
+        old_key = cache.get(answer_key.cache_key(self.quiz.id, old_version))
+
+        question = self.questions[0]
+        question.correct_index = 2
+        question.save()
+        # Signals only run in the worker that made the edit; the others still have their copy.
+        cache.set(answer_key.cache_key(self.quiz.id, old_version), old_key)
+
+        response = post_submission(self.client, self.quiz, {'0': 'C', '1': 'A', '2': 'A'}).json()
+        self.assertEqual(Submission.objects.get(pk=response['submission_id']).score, 3)
+
+    def test_a_stored_key_from_an_older_version_is_recompiled(self):
+        answer_key.get(self.quiz.id)
+        # As if the edit landed while another worker was compiling the key.
+        Question.objects.filter(pk=self.questions[0].pk).update(correct_index=2)
+        Quiz.objects.filter(pk=self.quiz.pk).update(version=F('version') + 1)
+        self.assertEqual(answer_key.get(self.quiz.id)['correct'], [2, 0, 0])
+
+    def test_broken_and_duplicate_options(self):
+        Question.objects.filter(pk=self.questions[0].pk).update(options=['same', 'same'], correct_index=1)
+        Question.objects.filter(pk=self.questions[1].pk).update(correct_index=9)
+        key = answer_key.compile_key(self.quiz.id)
+        self.assertEqual(key['correct'], [1, -1, 0])
+        self.assertEqual(answer_key.score(key, {'0': 'same', '1': 'A', '2': ['A']}), (1, [self.questions[1].id, self.questions[2].id]))
+
+    def test_key_follows_the_quiz_page_order(self):
+        page = display_cache.get_quiz_display(self.quiz.access_code)
+        key = answer_key.get(self.quiz.id)
+        texts = Question.objects.in_bulk(key['question_ids'])
+        self.assertEqual([q['text'] for q in page['questions_for_js']], [texts[pk].text for pk in key['question_ids']])
+
+
+class RescoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.quiz = make_quiz()
+        self.question = self.quiz.questions.order_by('id').first()
+        for i in range(10):
+            # Half the class picked 'B' for the first question.
+            answers = {'0': 'AB'[i % 2], '1': 'A', '2': 'A'}
+            process_submission({'access_code': self.quiz.access_code, 'name': 'Sam', 'email': 's@example.com', 'answers': answers})
+
+    def fix_first_question(self):
+        self.question.correct_index = 1
+        self.question.save()
+
+    def test_fixed_question_rescores_in_chunks(self):
+        self.fix_first_question()
+        job = rescore.start(self.quiz.id)
+        with CaptureQueriesContext(connection) as queries:
+            job = rescore.run(job, chunk_size=4)
+
+        self.assertEqual((job.status, job.processed, job.changed), (RescoreJob.DONE, 10, 10))
+        self.assertEqual(sorted(Submission.objects.values_list('score', flat=True)), [2] * 5 + [3] * 5)
+        self.assertEqual(QuizStats.objects.get(quiz=self.quiz).score_distribution, {'2': 5, '3': 5})
+        # One UPDATE per new score value per chunk of 4, not one per submission.
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "quiz_app_submission"')]
+        self.assertEqual(len(updates), 6)
+
+    def test_interrupted_job_resumes_where_it_stopped(self):
+        self.fix_first_question()
+
+        def interrupt(job):
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            rescore.run(rescore.start(self.quiz.id), chunk_size=4, progress=interrupt)
+
+        job = rescore.start(self.quiz.id)
+        self.assertEqual(job.processed, 4)
+        job = rescore.run(job, chunk_size=4)
+        self.assertEqual((job.processed, job.changed), (10, 10))
+        self.assertEqual(RescoreJob.objects.count(), 1)
+
+    def test_rescoring_ignores_cached_keys(self):
+        old_key = answer_key.get(self.quiz.id)
+        self.fix_first_question()
+        # Whatever this process has cached, the rescore reads the questions themselves.
+        cache.set(answer_key.cache_key(self.quiz.id, Quiz.objects.get(pk=self.quiz.pk).version), old_key)
+
+        job = rescore.run(rescore.start(self.quiz.id))
+        self.assertEqual(job.changed, 10)
+        self.assertEqual(sorted(Submission.objects.values_list('score', flat=True)), [2] * 5 + [3] * 5)
+
+    def test_editing_again_starts_over(self):
+        self.fix_first_question()
+        job = rescore.start(self.quiz.id)
+        RescoreJob.objects.filter(pk=job.pk).update(processed=4, last_submission_id=10 ** 9)
+        self.question.correct_index = 0
+        self.question.save()
+
+        job = rescore.run(rescore.start(self.quiz.id))
+        self.assertEqual((job.processed, job.changed), (10, 0))
+
+    def test_command_and_admin_action(self):
+        self.fix_first_question()
+        out = io.StringIO()
+        call_command('rescore_submissions', '--quiz', self.quiz.access_code, '--chunk-size', '5', stdout=out)
+        self.assertIn('Rescored 5/10', out.getvalue())
+        self.assertIn('10 scores changed', out.getvalue())
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        self.client.login(username='admin', password='pw')
+        self.client.post(reverse('admin:accounts_quiz_changelist'),
+                         {'action': 'rescore_submissions', '_selected_action': [self.quiz.pk]})
+        self.assertTrue(Task.objects.filter(task_name=tasks.rescore_quiz.name).exists())
+
+
+class SubmissionExportTests(TestCase):
+
+    def setUp(self):
+        self.quiz = make_quiz('Algebra')
+        Submission.objects.bulk_create([
+            Submission(quiz=self.quiz, student_name=f"Student {i}", student_email='s@example.com', score=i)
+            for i in range(25)
+        ])
+
+    def test_streamed_export_reads_all_rows_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = stream_submissions_csv(Submission.objects.all(), chunk_size=10)
+            content = b''.join(response.streaming_content).decode()
+
+        rows = list(csv.reader(io.StringIO(content)))
+        self.assertEqual(rows[0], ['Quiz Title', 'Student Name', 'Email', 'Score', 'Submitted At'])
+        self.assertEqual(len(rows), 26)
+        self.assertEqual({row[0] for row in rows[1:]}, {'Algebra'})
+
+    def test_management_command_writes_a_file(self):
+        make_quiz('Other')
+        with tempfile.TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'out.csv')
+            call_command('export_submissions', path, quiz=self.quiz.access_code, stdout=io.StringIO())
+            with open(path, newline='') as f:
+                self.assertEqual(len(list(csv.reader(f))), 26)
+
+
+class QuizStatsTests(TestCase):
+
+    def setUp(self):
+        self.quiz = make_quiz()
+
+    def test_each_submission_updates_the_totals(self):
+        post_submission(self.client, self.quiz, {'0': 'A', '1': 'A', '2': 'A'}).json()
+        post_submission(self.client, self.quiz, {'0': 'A', '1': 'B', '2': 'B'}).json()
+        post_submission(self.client, self.quiz, {'0': 'A', '1': 'A', '2': 'A'}).json()
+
+        quiz_stats = QuizStats.objects.get(quiz=self.quiz)
+        self.assertEqual(quiz_stats.submission_count, 3)
+        self.assertEqual(quiz_stats.mean_score, 7 / 3)
+        self.assertEqual(quiz_stats.score_distribution, {'3': 2, '1': 1})
+
+    def test_deleting_a_submission_updates_the_totals(self):
+        submission_id = post_submission(self.client, self.quiz, {'0': 'A', '1': 'A', '2': 'A'}).json()['submission_id']
+        post_submission(self.client, self.quiz, {'0': 'B', '1': 'B', '2': 'B'}).json()
+        Submission.objects.get(pk=submission_id).delete()
+
+        quiz_stats = QuizStats.objects.get(quiz=self.quiz)
+        self.assertEqual((quiz_stats.submission_count, quiz_stats.score_total), (1, 0))
+        self.assertEqual(quiz_stats.score_distribution, {'0': 1})
+
+    def test_recompute_matches_the_running_totals(self):
+        for answers in ({'0': 'A'}, {'0': 'A', '1': 'A'}, {}):
+            post_submission(self.client, self.quiz, answers).json()
+        running = QuizStats.objects.values().get(quiz=self.quiz)
+        QuizStats.objects.all().delete()
+
+        call_command('recompute_quiz_stats', stdout=io.StringIO())
+        rebuilt = QuizStats.objects.values().get(quiz=self.quiz)
+        running.pop('updated_at'), rebuilt.pop('updated_at')
+        self.assertEqual(running, rebuilt)
+
+
+class ItemAnalysisTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_metrics_for_a_small_class(self):
+        quiz = make_quiz(num_questions=2)
+        # Question 0 is answered right by the two strongest students only;
+        # everyone gets question 1 right except one blank.
+        for answers in ({'0': 'A', '1': 'A'}, {'0': 'A', '1': 'A'}, {'0': 'B', '1': 'A'}, {'0': 'C'}):
+            Submission.objects.create(quiz=quiz, student_name='S', student_email='s@example.com', answers=answers, score=0)
+
+        data = self.client.get(reverse('quiz_app:api_item_analysis', args=[quiz.access_code])).json()
+
+        self.assertEqual(data['students'], 4)
+        first, second = data['questions']
+        self.assertEqual(first['difficulty'], 0.5)
+        self.assertEqual(first['discrimination'], 1.0)
+        self.assertGreater(first['point_biserial'], 0)
+        self.assertEqual([o['count'] for o in first['options']], [2, 1, 1, 0])
+        self.assertEqual(second['difficulty'], 0.75)
+        self.assertEqual(second['blank'], 1)
+
+    def test_answers_are_read_the_way_they_were_scored(self):
+        quiz = Quiz.objects.create(title='Duplicates')
+        # The correct option's text appears twice, and one option isn't text.
+        Question.objects.create(quiz=quiz, text="Pick 4", options=['4', '5', 6, '4'], correct_index=0)
+        response = post_submission(self.client, quiz, {'0': '4'})
+        self.assertEqual(Submission.objects.get(pk=response.json()['submission_id']).score, 1)
+
+        data = self.client.get(reverse('quiz_app:api_item_analysis', args=[quiz.access_code])).json()
+        [item] = data['questions']
+        self.assertEqual(item['difficulty'], 1.0)
+        self.assertEqual([o['count'] for o in item['options']], [1, 0, 0, 0])
+
+    def test_quiz_without_submissions(self):
+        quiz = make_quiz()
+        data = self.client.get(reverse('quiz_app:api_item_analysis', args=[quiz.access_code])).json()
+        self.assertEqual(data['students'], 0)
+        self.assertEqual(data['questions'][0]['difficulty'], 0.0)
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.async_client = AsyncClient()
+
+    async def test_generate_ai_quiz_async(self):
+        ai_text = '```json\n{"questions": [{"text": "2+2?", "options": ["3", "4"], "correctIndex": 1}]}\n```'
+        with mock.patch.object(ai, 'agenerate_content', mock.AsyncMock(return_value=ai_text)) as generate:
+            response = await self.async_client.post(
+                reverse('quiz_app:api_generate_ai_async'),
+                data=json.dumps({'subject': 'Math', 'subtopic': 'addition', 'gradelevel': '2', 'count': 1}),
+                content_type='application/json',
+            )
+
+        self.assertEqual(response.status_code, 200)
+        generate.assert_awaited_once()
+        quiz = await Quiz.objects.aget(access_code=response.json()['code'])
+        self.assertEqual(await quiz.questions.acount(), 1)
+
+    async def test_generate_ai_quiz_async_reports_ai_errors(self):
+        with mock.patch.object(ai, 'agenerate_content', mock.AsyncMock(side_effect=ai.AIResponseError('boom'))):
+            response = await self.async_client.post(
+                reverse('quiz_app:api_generate_ai_async'),
+                data=json.dumps({'subject': 'Math'}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(await Quiz.objects.acount(), 0)
+
+    async def test_submit_async(self):
+        quiz = await Quiz.objects.acreate(title='Async')
+        await Question.objects.acreate(quiz=quiz, text='Q', options=['A', 'B'], correct_index=0)
+        response = await post_submission(self.async_client, quiz, {'0': 'A'}, url='quiz_app:submit_quiz_async')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((await Submission.objects.aget(quiz=quiz)).score, 1)
+
+
+class FlakyBackend:
+    """Fails with each error in `errors` in turn, then answers 'ok'."""
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.timeouts = []
+
+    def generate(self, prompt, timeout, schema=None):
+        self.timeouts.append(timeout)
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+    def close(self):
+        pass
+
+
+class LLMClientTests(TestCase):
+
+    def make_client(self, backend, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        return ai.LLMClient(backend, **kwargs)
+
+    def test_transient_errors_are_retried(self):
+        backend = FlakyBackend(ai.RetryableError('503'), ai.RetryableError('timeout'))
+        self.assertEqual(self.make_client(backend).generate('hi'), 'ok')
+        self.assertEqual(len(backend.timeouts), 3)
+
+    def test_gives_up_after_max_retries(self):
+        backend = FlakyBackend(*[ai.RetryableError('503')] * 5)
+        with self.assertRaises(ai.AIUnavailableError):
+            self.make_client(backend, max_retries=2).generate('hi')
+        self.assertEqual(len(backend.timeouts), 3)
+
+    def test_bad_answers_are_not_retried(self):
+        backend = FlakyBackend(ai.AIResponseError('HTTP 400'))
+        with self.assertRaises(ai.AIResponseError):
+            self.make_client(backend).generate('hi')
+        self.assertEqual(len(backend.timeouts), 1)
+
+    def test_attempts_never_outlive_the_deadline(self):
+        now = [0.0]
+        backend = FlakyBackend(*[ai.RetryableError('timeout')] * 5)
+        original = backend.generate
+
+        def slow_generate(prompt, timeout, schema=None):
+            now[0] += timeout
+            return original(prompt, timeout)
+        backend.generate = slow_generate
+
+        client = self.make_client(backend, deadline=10, attempt_timeout=4, max_retries=5, clock=lambda: now[0])
+        with self.assertRaises(ai.AIUnavailableError):
+            client.generate('hi')
+        self.assertEqual(backend.timeouts, [4, 4, 2])
+
+    def test_a_spent_deadline_gives_up_with_a_reason(self):
+        backend = FlakyBackend()
+        with self.assertRaises(ai.AIUnavailableError) as raised:
+            self.make_client(backend, deadline=0).generate('hi')
+        self.assertEqual(backend.timeouts, [])
+        self.assertNotIn('None', str(raised.exception))
+        self.assertIn('deadline', str(raised.exception.__cause__))
+
+    def test_circuit_breaker_fails_fast_then_recovers(self):
+        now = [0.0]
+        breaker = ai.CircuitBreaker(threshold=2, reset_timeout=30, clock=lambda: now[0])
+        backend = FlakyBackend(*[ai.RetryableError('503')] * 2)
+        client = self.make_client(backend, max_retries=0, breaker=breaker)
+
+        for _ in range(2):
+            with self.assertRaises(ai.AIUnavailableError):
+                client.generate('hi')
+        self.assertEqual(breaker.state, ai.CircuitBreaker.OPEN)
+        with self.assertRaises(ai.AIUnavailableError):
+            client.generate('hi')
+        self.assertEqual(len(backend.timeouts), 2)
+
+        now[0] = 31
+        self.assertEqual(breaker.state, ai.CircuitBreaker.HALF_OPEN)
+        self.assertEqual(client.generate('hi'), 'ok')
+        self.assertEqual(breaker.state, ai.CircuitBreaker.CLOSED)
+
+    def test_gemini_status_codes(self):
+        backend = ai.GeminiBackend('key', 'model', 'http://gemini.test', 1)
+        ok = {'candidates': [{'content': {'parts': [{'text': 'hello'}]}}]}
+        self.assertEqual(backend.handle_response(httpx.Response(200, json=ok)), 'hello')
+        with self.assertRaises(ai.RetryableError):
+            backend.handle_response(httpx.Response(503))
+        with self.assertRaises(ai.RetryableError):
+            backend.handle_response(httpx.Response(429))
+        with self.assertRaises(ai.AIResponseError):
+            backend.handle_response(httpx.Response(400, text='bad key'))
+
+    def test_stub_backend_is_deterministic_and_replays_recordings(self):
+        prompt = build_ai_quiz_prompt({'subject': 'Math', 'count': 3})
+        stub = ai.StubBackend()
+        self.assertEqual(stub.answer(prompt), stub.answer(prompt))
+        self.assertEqual(len(json.loads(stub.answer(prompt))['questions']), 3)
+
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({ai.prompt_key(prompt): 'recorded answer'}, f)
+        self.addCleanup(os.remove, f.name)
+        self.assertEqual(ai.StubBackend(replay_file=f.name).answer(prompt), 'recorded answer')
+
+    @override_settings(LLM_BACKEND='stub')
+    def test_views_run_offline_with_the_stub_backend(self):
+        response = self.client.post(
+            reverse('quiz_app:api_generate_ai'),
+            data=json.dumps({'subject': 'Math', 'subtopic': 'Fractions', 'gradelevel': '5', 'count': 4}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        quiz = Quiz.objects.get(access_code=response.json()['code'])
+        self.assertEqual(quiz.questions.count(), 4)
+
+    @override_settings(LLM_BACKEND='stub')
+    def test_open_breaker_returns_503(self):
+        ai.get_client().breaker.opened_at = time.monotonic()
+        response = self.client.post(reverse('quiz_app:api_generate_ai'), data='{}', content_type='application/json')
+        self.assertEqual(response.status_code, 503)
+
+
+class StartupImportTests(TestCase):
+
+    def test_heavy_dependencies_are_not_imported_at_startup(self):
+        from .benchmarks import startup
+
+        _, modules = startup.measure_once()
+        self.assertIn('quiz_app.views', modules)
+        self.assertEqual([m for m in startup.LAZY_MODULES if m in modules], [])
+
+
+class QuestionStreamParserTests(TestCase):
+
+    ANSWER = (
+        '```json\n{"questions": ['
+        '{"text": "Which is {not} a prime?", "options": ["2", "3", "9", "5"], "correctIndex": 2},'
+        '{"text": "Say \\"hi\\" in French", "options": ["salut", "hola", "ciao", "hallo"], "correctIndex": 0}'
+        ']}\n```'
+    )
+
+    def parse(self, chunks):
+        parser = QuestionStreamParser()
+        questions = []
+        for chunk in chunks:
+            questions.extend(parser.feed(chunk))
+        return parser, questions
+
+    def test_same_questions_however_the_text_is_split(self):
+        _, whole = self.parse([self.ANSWER])
+        self.assertEqual([q['correctIndex'] for q in whole], [2, 0])
+        self.assertEqual(whole[1]['text'], 'Say "hi" in French')
+        for size in (1, 2, 7, 40):
+            chunks = [self.ANSWER[i:i + size] for i in range(0, len(self.ANSWER), size)]
+            self.assertEqual(self.parse(chunks)[1], whole)
+
+    def test_questions_are_returned_as_soon_as_they_close(self):
+        cut = self.ANSWER.index('},') + 1
+        parser = QuestionStreamParser()
+        self.assertEqual(len(parser.feed(self.ANSWER[:cut])), 1)
+        self.assertEqual(len(parser.feed(self.ANSWER[cut:])), 1)
+
+    def test_broken_or_cut_off_questions_only_lose_themselves(self):
+        answer = '{"questions": [{"text": "ok", "options": ["a"], "correctIndex": 0}, {"text": oops}, {"text": "cut'
+        parser, questions = self.parse([answer])
+        self.assertEqual([q['text'] for q in questions], ['ok'])
+        self.assertEqual(parser.errors, 1)
+
+
+class StreamingAIQuizTests(TestCase):
+
+    def setUp(self):
+        admission.reset_limiter()
+
+    def stream(self, data):
+        response = self.client.post(
+            reverse('quiz_app:api_generate_ai_stream'), data=json.dumps(data), content_type='application/json',
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = []
+        for raw in b''.join(response.streaming_content).decode().split('\n\n'):
+            if raw:
+                event, data = raw.split('\n')
+                events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    @override_settings(LLM_BACKEND='stub')
+    def test_questions_are_saved_and_sent_one_by_one(self):
+        events = self.stream({'subject': 'Math', 'gradelevel': '5', 'count': 3})
+
+        self.assertEqual([e for e, _ in events], ['quiz', 'question', 'question', 'question', 'done'])
+        quiz = Quiz.objects.get(access_code=events[0][1]['code'])
+        self.assertEqual(quiz.title, 'Math(5)')
+        self.assertEqual(quiz.questions.count(), 3)
+        self.assertEqual(events[-1][1], {'code': quiz.access_code, 'count': 3, 'skipped': 0})
+
+    def test_a_failure_mid_stream_keeps_the_finished_questions(self):
+        def chunks(prompt):
+            yield '{"questions": [{"text": "Q1", "options": ["a", "b"], "correctIndex": 1}, '
+            yield '{"text": "Q2", "options": ["a", "b"], "correctIndex": 7}, {"text": "Q3", '
+            raise ai.AIUnavailableError('connection dropped')
+
+        with mock.patch.object(ai, 'stream_content', side_effect=chunks):
+            events = self.stream({'subject': 'Math'})
+
+        self.assertEqual([e for e, _ in events], ['quiz', 'question', 'error'])
+        self.assertEqual(list(Question.objects.values_list('text', flat=True)), ['Q1'])
+
+    def test_stream_retries_only_before_the_first_chunk(self):
+        class Backend(FlakyBackend):
+            def stream(self, prompt, timeout, schema=None):
+                self.timeouts.append(timeout)
+                if self.errors:
+                    raise self.errors.pop(0)
+                yield 'one'
+                raise ai.RetryableError('reset')
+
+        backend = Backend(ai.RetryableError('503'))
+        client = ai.LLMClient(backend, backoff=0)
+        received = []
+        with self.assertRaises(ai.AIUnavailableError):
+            for chunk in client.stream('hi'):
+                received.append(chunk)
+        self.assertEqual(received, ['one'])
+        self.assertEqual(len(backend.timeouts), 2)
+
+
+class StudyGuideBatchTests(TestCase):
+
+    def setUp(self):
+        self.quiz = make_quiz()
+        self.questions = list(self.quiz.questions.order_by('id'))
+
+    def add_guide(self, missed):
+        submission = Submission.objects.create(
+            quiz=self.quiz, student_name='Sam', student_email='sam@example.com', answers={}, score=0,
+        )
+        return StudyGuide.objects.create(
+            submission=submission,
+            missed_question_ids=[self.questions[i].id for i in missed],
+            stages={'generate': StudyGuide.PENDING},
+        )
+
+    @override_settings(LLM_BACKEND='stub')
+    def test_one_llm_call_for_the_whole_class(self):
+        guides = [self.add_guide(m) for m in ([0], [1], [0, 2], [0])]
+
+        with mock.patch.object(ai, 'stream_content', wraps=ai.stream_content) as stream, \
+                mock.patch.object(ai, 'generate_content', wraps=ai.generate_content) as generate:
+            for guide in guides:
+                tasks.generate_study_guide.now(guide.id)
+
+        self.assertEqual(stream.call_count, 1)
+        self.assertEqual(generate.call_count, 0)
+        texts = {}
+        for guide in guides:
+            guide.refresh_from_db()
+            self.assertEqual(guide.stages['generate'], StudyGuide.DONE)
+            self.assertEqual(len(parse_study_guide_text(guide.text)), 5)
+            texts[tuple(guide.missed_question_ids)] = guide.text
+        # Students who missed the same questions share a section; the others don't.
+        self.assertEqual(guides[0].text, guides[3].text)
+        self.assertEqual(len(set(texts.values())), 3)
+        self.assertEqual(Task.objects.filter(task_name='quiz_app.tasks.render_study_guide').count(), 4)
+
+    def test_missing_sections_are_generated_one_by_one(self):
+        guides = [self.add_guide([0]), self.add_guide([1])]
+        answer = "=== STUDENT 1 ===\nFirst guide\n"
+        with mock.patch.object(ai, 'stream_content', return_value=iter([answer])), \
+                mock.patch.object(ai, 'generate_content', return_value='Second guide') as generate:
+            tasks.generate_study_guide.now(guides[0].id)
+
+        generate.assert_called_once()
+        self.assertEqual([StudyGuide.objects.get(pk=g.pk).text for g in guides], ['First guide', 'Second guide'])
+
+    def test_failed_batch_is_released_for_the_retry(self):
+        guides = [self.add_guide([0]), self.add_guide([1])]
+        with mock.patch.object(ai, 'stream_content', side_effect=ai.AIUnavailableError('down')):
+            with self.assertRaises(ai.AIUnavailableError):
+                tasks.generate_study_guide.now(guides[0].id)
+
+        for guide in guides:
+            guide.refresh_from_db()
+            self.assertEqual(guide.stages['generate'], StudyGuide.FAILED)
+            self.assertEqual(guide.batch_id, '')
+
+    def test_submissions_wait_for_the_batch_window(self):
+        with override_settings(LLM_BACKEND='stub'):
+            post_submission(self.client, self.quiz, {'0': 'B'})
+        task = Task.objects.get(task_name='quiz_app.tasks.generate_study_guide')
+        self.assertGreaterEqual((task.run_at - timezone.now()).total_seconds(), tasks.BATCH_WINDOW - 2)
+
+
+class StudyGuidePDFTests(TestCase):
+
+    TEXT = ai.StubBackend().study_guide('pdf', 0)
+
+    def test_wrapped_lines_fit_the_page(self):
+        text = "A rather long sentence about fractions and decimals " * 20 + "x" * 400
+        lines = study_guide_pdf.wrap(text, study_guide_pdf.BODY_FONT, 100)
+        widths = study_guide_pdf.char_widths(*study_guide_pdf.BODY_FONT[:3])
+        self.assertGreater(len(lines), 10)
+        for line in lines:
+            self.assertLessEqual(sum(widths[c] for c in line), 100)
+        self.assertEqual(''.join(lines).replace(' ', ''), text.replace(' ', ''))
+
+    def test_renders_parsed_questions_to_bytes(self):
+        pdf = study_guide_pdf.render_pdf('Fractions', self.TEXT)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+    def test_unicode_and_unparsed_text_still_render(self):
+        text = "The “best” answer — ✓ " * 400
+        pdf = study_guide_pdf.render_pdf('Étude • 1', text)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+
+
+class CountingBackend(locmem.EmailBackend):
+    """locmem backend that counts connections and can fail on demand."""
+    opened = 0
+    fail_open = False
+    fail_to = ()
+
+    def open(self):
+        if self.fail_open:
+            raise ConnectionError('connection refused')
+        CountingBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        if any(address in self.fail_to for m in messages for address in m.to):
+            raise ConnectionError('mailbox unavailable')
+        return super().send_messages(messages)
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        CountingBackend.opened = 0
+
+    def queue(self, count, **kwargs):
+        return [outbox.enqueue(f"Email {i}", "Hello", [f"s{i}@example.com"], **kwargs) for i in range(count)]
+
+    def deliver(self, batch_size=outbox.BATCH_SIZE, **failures):
+        connection = CountingBackend()
+        connection.__dict__.update(failures)
+        return outbox.deliver_batch(batch_size, connection=connection)
+
+    def test_batch_is_sent_over_one_connection(self):
+        self.queue(5, attachment=('guide.pdf', b'%PDF', 'application/pdf'))
+        with override_settings(EMAIL_BACKEND='quiz_app.tests.CountingBackend'):
+            result = outbox.drain(2)
+
+        self.assertEqual(result, {'sent': 5, 'retried': 0, 'dead': 0})
+        self.assertEqual(CountingBackend.opened, 3)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'guide.pdf')
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
+
+    def test_failed_email_is_retried_later_with_backoff(self):
+        self.queue(3)
+        result = self.deliver(fail_to=('s1@example.com',))
+        self.assertEqual(result, {'sent': 2, 'retried': 1, 'dead': 0})
+
+        failed = OutboxEmail.objects.get(status=OutboxEmail.QUEUED)
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_error, 'mailbox unavailable')
+        self.assertGreater(failed.next_attempt_at, timezone.now())
+        # Not due yet, so nothing is sent.
+        self.assertEqual(self.deliver(), {'sent': 0, 'retried': 0, 'dead': 0})
+
+        OutboxEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(self.deliver()['sent'], 1)
+
+    def test_email_is_dead_lettered_after_max_attempts(self):
+        submission = Submission.objects.create(
+            quiz=make_quiz(), student_name='Sam', student_email='sam@example.com', answers={}, score=0,
+        )
+        guide = StudyGuide.objects.create(submission=submission, missed_question_ids=[])
+        self.queue(1, study_guide=guide)
+
+        with mock.patch.object(outbox, 'MAX_ATTEMPTS', 3):
+            for _ in range(3):
+                OutboxEmail.objects.update(next_attempt_at=timezone.now())
+                result = self.deliver(fail_open=True)
+
+        self.assertEqual(result, {'sent': 0, 'retried': 0, 'dead': 1})
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboxEmail.DEAD, 3))
+        guide.refresh_from_db()
+        self.assertEqual(guide.stages['deliver'], StudyGuide.FAILED)
+
+        self.assertEqual(outbox.requeue_dead(OutboxEmail.objects.all()), 1)
+        self.assertEqual(self.deliver()['sent'], 1)
+        guide.refresh_from_db()
+        self.assertTrue(guide.is_sent)
+
+    def test_a_class_shares_one_send_outbox_task(self):
+        self.queue(1)
+        tasks.schedule_send_outbox(5)
+        tasks.schedule_send_outbox(5)
+        self.assertEqual(Task.objects.filter(task_name=tasks.send_outbox.name).count(), 1)
+
+
+class StudyGuideParserTests(TestCase):
+
+    STUB = ai.StubBackend()
+
+    def test_plain_text_and_structured_guides_parse_the_same(self):
+        plain = parse_study_guide_text(self.STUB.study_guide('x', 0))
+        structured = parse_study_guide_text(json.dumps({'questions': self.STUB.study_guide_questions('x', 0)}))
+        self.assertEqual(len(plain), 5)
+        self.assertEqual(plain, structured)
+        self.assertEqual(plain[1]['options'], ['Option A', 'Option B', 'Option C', 'Option D'])
+        self.assertEqual([q['answer'] for q in plain], ['A', 'B', 'C', 'D', 'A'])
+
+    def test_malformed_structured_questions_are_dropped(self):
+        good = {'topic': 'T', 'text': 'Q?', 'options': ['a', 'b', 'c', 'd'], 'answer': 'b'}
+        data = {'questions': [good, {**good, 'options': ['a']}, {**good, 'answer': 'E'}, 'junk', {**good, 'topic': 3}]}
+        self.assertEqual(parse_study_guide_text(json.dumps(data)), [{**good, 'answer': 'B'}])
+        self.assertEqual(parse_study_guide_text('{"questions": ['), [])
+        self.assertEqual(parse_study_guide_text('{' * 100000), [])
+
+    def test_plain_text_lines(self):
+        text = (
+            "**Fundamental Topic:** Fractions\n"
+            "Practice Question: What is 1/2 +\n  1/4?\n"
+            "A) 3/4\nB) 1/6\nC) 2/6\nD ) 1\n"
+            "Correct Answer: A) 3/4\n"
+            "Fundamental Topic: Out of order\nA) 1\nPractice Question: Where is B?\n"
+        )
+        self.assertEqual(parse_study_guide_text(text), [{
+            'topic': 'Fractions', 'text': 'What is 1/2 + 1/4?', 'options': ['3/4', '1/6', '2/6', '1'], 'answer': 'A',
+        }])
+
+    def test_structured_batch_answer_is_split_per_student(self):
+        answer = self.STUB.answer("=== STUDENT 1 ===\n=== STUDENT 2 ===\n", schema=tasks.BATCH_SCHEMA)
+        sections = tasks.split_batch_answer(answer, 1)
+        self.assertEqual(list(sections), [1])
+        self.assertEqual(len(parse_study_guide_text(sections[1])), 5)
+
+    def test_fuzzed_input_never_breaks_the_parser(self):
+        rng = random.Random(0)
+        pieces = ['Fundamental Topic:', 'Practice Question:', 'A)', 'B)', 'c )', 'D)', 'Correct Answer:',
+                  ' B', '\n', '\n\n', '**', 'text', '{', '"questions"', ':', '[', ']', '}', ' ' * 20, 'é']
+        for _ in range(500):
+            text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 60)))
+            for question in parse_study_guide_text(text):
+                self.assertEqual(len(question['options']), 4)
+                self.assertIn(question['answer'], 'ABCD')
+
+    def test_adversarial_input_takes_linear_time(self):
+        # The old DOTALL regex rescanned the rest of the text from every "Fundamental Topic:",
+        # so four times the input took sixteen times as long. Compares times, not a fixed limit.
+        def best_time(text):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                self.assertEqual(parse_study_guide_text(text), [])
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        for make in (lambda n: "Fundamental Topic: x\n" * n, lambda n: "Fundamental Topic: " + "a " * (100 * n)):
+            small, large = best_time(make(5000)), best_time(make(20000))
+            self.assertLess(large / small, 8)
+
+
+class QueryBudgetTests(TestCase):
+    """
+    Every URL in quiz_app/urls.py, called against a quiz with enough
+    questions and submissions that an N+1 query would show up, must stay
+    within its budget in settings.QUERY_BUDGETS.
+    """
+
+    def setUp(self):
+        cache.clear()
+        admission.reset_limiter()  # the generate calls below spend a user's question budget
+        self.quiz = make_quiz(num_questions=10)
+        for i in range(20):
+            process_submission({'access_code': self.quiz.access_code, 'name': f"Student {i}", 'email': 's@example.com',
+                                'answers': {str(q): 'AB'[(i + q) % 2] for q in range(10)}})
+        self.submission = Submission.objects.first()
+
+    def post_json(self, name, data, **kwargs):
+        return self.client.post(reverse(name, **kwargs), data=json.dumps(data), content_type='application/json')
+
+    def save_quiz(self):
+        questions = [{'q': f"Q{i}", 'options': ['A', 'B', 'C', 'D'], 'correctIndex': 0} for i in range(10)]
+        return self.post_json('quiz_app:api_save_quiz', {'title': 'Saved', 'questions': questions})
+
+    def generate(self, name, count=10):
+        with override_settings(LLM_BACKEND='stub'):
+            response = self.post_json(name, {'subject': 'Math', 'subtopic': 'Fractions', 'gradelevel': '5', 'count': count})
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response
+
+    # URL name -> how to call it
+    REQUESTS = {
+        # Like the quiz page, which sends a fresh Idempotency-Key with every attempt.
+        'quiz_app:submit_quiz': lambda self: post_submission(
+            self.client, self.quiz, {'0': 'B'}, idempotency_key=uuid.uuid4().hex),
+        'quiz_app:submit_quiz_async': lambda self: post_submission(
+            self.client, self.quiz, {'0': 'B'}, url='quiz_app:submit_quiz_async', idempotency_key=uuid.uuid4().hex),
+        'quiz_app:api_dashboard_data': lambda self: self.client.get(reverse('quiz_app:api_dashboard_data')),
+        'quiz_app:api_save_quiz': save_quiz,
+        'quiz_app:api_generate_ai': lambda self: self.generate('quiz_app:api_generate_ai'),
+        'quiz_app:api_generate_ai_async': lambda self: self.generate('quiz_app:api_generate_ai_async'),
+        'quiz_app:api_generate_ai_stream': lambda self: self.generate('quiz_app:api_generate_ai_stream'),
+        'quiz_app:api_item_analysis': lambda self: self.client.get(
+            reverse('quiz_app:api_item_analysis', args=[self.quiz.access_code])),
+        'quiz_app:api_cache_stats': lambda self: self.client.get(reverse('quiz_app:api_cache_stats')),
+        'quiz_app:api_submission_status': lambda self: self.client.get(
+            reverse('quiz_app:api_submission_status', args=[self.submission.id])),
+        'quiz_app:quiz_display': lambda self: self.client.get(reverse('quiz_app:quiz_display', args=[self.quiz.access_code])),
+        # Last, since it deletes the quiz the others use.
+        'quiz_app:api_delete_quiz': lambda self: self.post_json('quiz_app:api_delete_quiz', {'code': self.quiz.access_code}),
+    }
+
+    def assertWithinQueryBudget(self, name, call):
+        """Calls the URL (streamed responses are read to the end) and checks its query count."""
+        budget = query_budget(name)
+        with CaptureQueriesContext(connection) as queries:
+            response = call(self)
+        self.assertLess(response.status_code, 400, name)
+        self.assertLessEqual(
+            len(queries), budget,
+            f"{name} ran {len(queries)} queries, budget {budget}:\n" + '\n'.join(q['sql'] for q in queries),
+        )
+
+    def test_every_url_has_a_budget(self):
+        names = {f"quiz_app:{pattern.name}" for pattern in quiz_urls.urlpatterns}
+        self.assertEqual(names, set(self.REQUESTS))
+        self.assertLessEqual(names, set(settings.QUERY_BUDGETS))
+
+    def test_every_url_stays_within_its_budget(self):
+        for name, call in self.REQUESTS.items():
+            with self.subTest(name):
+                self.assertWithinQueryBudget(name, call)
+
+    def test_first_submission_to_a_new_quiz_stays_within_budget(self):
+        # setUp's submissions warmed up self.quiz; a new quiz has no answer key or stats yet.
+        cold = make_quiz('Decimals', num_questions=10)
+        for name in ('quiz_app:submit_quiz', 'quiz_app:submit_quiz_async'):
+            with self.subTest(name):
+                cache.clear()
+                Quiz.objects.filter(pk=cold.pk).update(version=F('version') + 1)
+                self.assertWithinQueryBudget(name, lambda self: post_submission(
+                    self.client, cold, {'0': 'B'}, url=name, idempotency_key=uuid.uuid4().hex))
+
+    def test_warm_submission_runs_9_queries(self):
+        with self.assertNumQueries(9):
+            post_submission(self.client, self.quiz, {'0': 'B'}, idempotency_key=uuid.uuid4().hex)
+
+    def test_over_budget_requests_are_logged_and_counted(self):
+        url = reverse('quiz_app:api_submission_status', args=[self.submission.id])
+        before = metrics.snapshot()['query_budget_exceeded']
+        with override_settings(QUERY_BUDGETS={'quiz_app:api_submission_status': 0}), \
+                mock.patch('builtins.print') as log:
+            response = self.client.get(url)
+        self.assertNotIn('X-DB-Queries', response)
+        self.assertIn('QUERY BUDGET', log.call_args[0][0])
+        self.assertEqual(metrics.snapshot()['query_budget_exceeded'], before + 1)
+
+    def test_streamed_queries_are_checked_when_the_stream_ends(self):
+        before = metrics.snapshot()['query_budget_exceeded']
+        with override_settings(QUERY_BUDGETS={'quiz_app:api_generate_ai_stream': 10}), \
+                mock.patch('builtins.print') as log:
+            self.generate('quiz_app:api_generate_ai_stream')
+        self.assertTrue(any('QUERY BUDGET' in str(call.args[0]) for call in log.call_args_list if call.args))
+        self.assertEqual(metrics.snapshot()['query_budget_exceeded'], before + 1)
+
+    def test_each_streamed_question_is_one_insert(self):
+        counts = []
+        for count in (10, 20):
+            with CaptureQueriesContext(connection) as queries:
+                self.generate('quiz_app:api_generate_ai_stream', count=count)
+            counts.append(len(queries))
+        self.assertEqual(counts[1] - counts[0], 10)
+
+    @override_settings(DEBUG=True)
+    def test_debug_responses_carry_the_query_count(self):
+        response = self.client.get(reverse('quiz_app:api_submission_status', args=[self.submission.id]))
+        self.assertEqual(response['X-DB-Queries'], '1')
+        self.assertEqual(response['X-DB-Query-Budget'], str(settings.QUERY_BUDGETS['quiz_app:api_submission_status']))
+        self.assertIn('X-DB-Time-Ms', response)
+
+
+class StageTimingTests(TestCase):
+    """metrics.span(), the Server-Timing header and GET /metrics."""
+
+    def setUp(self):
+        self.quiz = make_quiz()
+
+    def test_histogram_quantiles_interpolate_within_buckets(self):
+        h = metrics.Histogram('test_seconds', buckets=(0.1, 0.2, 0.4))
+        self.assertIsNone(h.quantile(0.5, 'x'))
+        for value in [0.05] * 50 + [0.15] * 49 + [0.3]:
+            h.observe(value, 'x')
+        self.assertAlmostEqual(h.quantile(0.5, 'x'), 0.1)
+        self.assertAlmostEqual(h.quantile(0.99, 'x'), 0.2)
+        self.assertAlmostEqual(h.quantile(1.0, 'x'), 0.4)
+        h.observe(10, 'x')  # past the last bucket
+        self.assertEqual(h.quantile(1.0, 'x'), 0.4)
+
+    def test_span_records_even_when_the_block_raises(self):
+        before = metrics.stage_seconds.series.get('test-stage', {}).get('count', 0)
+        with self.assertRaises(ValueError), metrics.span('test-stage'):
+            raise ValueError
+        self.assertEqual(metrics.stage_seconds.series['test-stage']['count'], before + 1)
+
+    def test_submission_response_has_server_timing(self):
+        response = post_submission(self.client, self.quiz, {'0': 'B'})
+        self.assertEqual(response.status_code, 200)
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['score', 'persist', 'queue', 'db', 'total'])
+        self.assertRegex(response['Server-Timing'], r'^score;dur=\d+\.\d\d, ')
+
+    def test_pdf_and_llm_calls_are_timed(self):
+        before = {stage: metrics.stage_seconds.series.get(stage, {}).get('count', 0) for stage in ('llm', 'pdf')}
+        with override_settings(LLM_BACKEND='stub'):
+            tasks.render_study_guide_pdf('Fractions', ai.generate_content('Write a study guide'))
+        for stage, count in before.items():
+            self.assertEqual(metrics.stage_seconds.series[stage]['count'], count + 1, stage)
+
+    def test_metrics_endpoint_serves_prometheus_text(self):
+        post_submission(self.client, self.quiz, {'0': 'B'})
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE stage_seconds histogram', text)
+        self.assertRegex(text, r'stage_seconds_bucket\{stage="score",le="\+Inf"\} [1-9]')
+        self.assertRegex(text, r'stage_seconds_count\{stage="persist"\} [1-9]')
+        self.assertIn('# TYPE outbox_sent counter', text)
+
+    def test_metrics_endpoint_adds_up_every_process_in_metrics_dir(self):
+        post_submission(self.client, self.quiz, {'0': 'B'})
+        worker = {
+            'counters': {'outbox_sent': ['Emails sent', 7]},
+            'gauges': {'ai_in_flight': ['LLM requests running in this worker', 2]},
+            'histograms': {'stage_seconds': {'help': '', 'label': 'stage', 'buckets': list(metrics.BUCKETS), 'series': {
+                'llm': {'counts': [0] * 10 + [3] + [0] * 5, 'sum': 6.0, 'count': 3},
+            }}},
+        }
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory):
+            # What process_tasks wrote, and a web worker that went away an hour ago.
+            with open(os.path.join(directory, 'worker-1.json'), 'w') as f:
+                json.dump({**worker, 'updated': time.time()}, f)
+            with open(os.path.join(directory, 'web-2.json'), 'w') as f:
+                json.dump({**worker, 'updated': time.time() - 3600}, f)
+            text = self.client.get('/metrics').content.decode()
+            self.assertTrue(os.path.exists(metrics.dump_path(directory)))
+
+        self.assertIn(f"outbox_sent {metrics.counter('outbox_sent').value + 14}\n", text)
+        self.assertIn(f"ai_in_flight {admission.get_limiter().in_flight + 2}\n", text)
+        llm = metrics.stage_seconds.series.get('llm', {}).get('count', 0)
+        self.assertIn(f'stage_seconds_count{{stage="llm"}} {llm + 6}\n', text)
+        self.assertRegex(text, r'stage_seconds_count\{stage="persist"\} [1-9]')
+
+    def test_counters_and_spans_leave_writing_the_file_to_a_thread(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_DIR=directory), \
+                mock.patch.object(metrics, '_dump_thread_started', False), \
+                mock.patch.object(metrics.threading, 'Thread') as thread, \
+                mock.patch.object(metrics, 'dump') as dump:
+            metrics.counter('outbox_sent').inc()
+            with metrics.span('score'):
+                pass
+        dump.assert_not_called()
+        thread.assert_called_once_with(target=metrics.dump_every_interval, name='metrics-dump', daemon=True)
+        thread.return_value.start.assert_called_once()
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_metrics_endpoint_can_require_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class AdmissionTests(TestCase):
+    """Per-user question budgets and the in-flight cap on the AI generator."""
+
+    def generate(self, name='quiz_app:api_generate_ai', count=10):
+        return self.client.post(reverse(name), content_type='application/json', data=json.dumps(
+            {'subject': 'Math', 'subtopic': 'Fractions', 'gradelevel': '5', 'count': count}))
+
+    def test_token_bucket_refills_over_time(self):
+        clock = FakeClock()
+        bucket = admission.TokenBucket(rate=1, capacity=10, clock=clock)
+        self.assertEqual(bucket.take(10), 0)
+        self.assertAlmostEqual(bucket.take(4), 4)
+        clock.now += 4
+        self.assertEqual(bucket.take(4), 0)
+        self.assertEqual(bucket.take(11), float('inf'))
+
+    def test_queued_requests_get_the_next_free_slot(self):
+        limiter = admission.Limiter(max_in_flight=1, max_queued=1, queue_timeout=5)
+        limiter.admit('a', 1)
+        waiting = threading.Thread(target=limiter.admit, args=('b', 1))
+        waiting.start()
+        while not limiter.waiters:
+            time.sleep(0.001)
+        with self.assertRaises(admission.Rejected):
+            limiter.admit('c', 1)  # the queue is full
+        self.assertEqual(limiter.buckets['c'].tokens, limiter.burst)  # and it cost c nothing
+
+        limiter.release()
+        waiting.join(1)
+        self.assertFalse(waiting.is_alive())
+        self.assertEqual(limiter.state()['in_flight'], 1)
+        limiter.release()
+        self.assertEqual(limiter.state()['in_flight'], 0)
+
+    def test_waiting_too_long_is_rejected(self):
+        limiter = admission.Limiter(max_in_flight=1, max_queued=4, queue_timeout=0.01)
+        limiter.admit('a', 1)
+        with self.assertRaises(admission.Rejected) as caught:
+            limiter.admit('b', 1)
+        self.assertEqual(caught.exception.retry_after, 1)
+        self.assertEqual(limiter.state()['queued'], 0)
+
+    async def test_async_waiters_do_not_block_the_event_loop(self):
+        limiter = admission.Limiter(max_in_flight=1, max_queued=1, queue_timeout=5)
+        await limiter.aadmit('a', 1)
+        asyncio.get_running_loop().call_later(0.01, limiter.release)
+        await limiter.aadmit('b', 1)
+        self.assertEqual(limiter.state(), {'in_flight': 1, 'queued': 0, 'max_in_flight': 1, 'max_queued': 1,
+                                           'users': 2})
+
+    async def test_cancelled_async_waiter_leaves_the_queue(self):
+        limiter = admission.Limiter(max_in_flight=1, max_queued=1, queue_timeout=5)
+        await limiter.aadmit('a', 1)
+        waiting = asyncio.create_task(limiter.aadmit('b', 1))
+        while not limiter.waiters:
+            await asyncio.sleep(0)
+        waiting.cancel()  # the client disconnected
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+
+        self.assertEqual(limiter.state()['queued'], 0)
+        self.assertEqual(limiter.buckets['b'].tokens, limiter.burst)
+        limiter.release()
+        self.assertEqual(limiter.state()['in_flight'], 0)
+
+    async def test_waiter_cancelled_after_its_grant_releases_the_slot(self):
+        limiter = admission.Limiter(max_in_flight=1, max_queued=1, queue_timeout=5)
+        await limiter.aadmit('a', 1)
+        waiting = asyncio.create_task(limiter.aadmit('b', 1))
+        while not limiter.waiters:
+            await asyncio.sleep(0)
+        limiter.release()  # hands the slot to b...
+        waiting.cancel()  # ...which goes away before it runs
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(limiter.state()['in_flight'], 0)
+
+    @override_settings(LLM_BACKEND='stub', AI_QUESTIONS_BURST=10, AI_QUESTIONS_PER_MINUTE=60)
+    def test_over_budget_requests_get_429_with_retry_after(self):
+        self.assertEqual(self.generate(count=10).status_code, 200)
+        response = self.generate(count=5)
+        self.assertEqual(response.status_code, 429)
+        self.assertTrue(1 <= int(response['Retry-After']) <= 5)
+        self.assertEqual(Quiz.objects.count(), 1)
+
+    @override_settings(LLM_BACKEND='stub', AI_MAX_QUESTIONS=50)
+    def test_count_must_be_in_range(self):
+        for count in (0, 51, 'lots', [3]):
+            with self.subTest(count=count):
+                self.assertEqual(self.generate(count=count).status_code, 400)
+
+    @override_settings(LLM_BACKEND='stub', AI_MAX_IN_FLIGHT=1, AI_MAX_QUEUED=0)
+    def test_full_generator_turns_streams_away_at_once(self):
+        limiter = admission.get_limiter()
+        limiter.admit('someone else', 1)
+        response = self.generate('quiz_app:api_generate_ai_stream', count=3)
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('ai_in_flight 1', self.client.get('/metrics').content.decode())
+        limiter.release()
+
+        response = self.generate('quiz_app:api_generate_ai_stream', count=3)
+        self.assertEqual(limiter.state()['in_flight'], 1)  # held while streaming
+        b''.join(response.streaming_content)
+        self.assertEqual(limiter.state()['in_flight'], 0)
+
+    @override_settings(LLM_BACKEND='stub', AI_MAX_IN_FLIGHT=1, AI_MAX_QUEUED=0)
+    def test_closed_stream_gives_its_slot_back(self):
+        response = self.generate('quiz_app:api_generate_ai_stream', count=3)
+        response.close()  # the client went away before the first event
+        self.assertEqual(admission.get_limiter().state()['in_flight'], 0)
+
+
+class IdempotentSubmissionTests(TestCase):
+    """Retried submits with the same Idempotency-Key are saved (and followed up) once."""
+
+    ANSWERS = {'0': 'A', '1': 'B', '2': 'A'}
+
+    def setUp(self):
+        self.quiz = make_quiz()
+
+    def test_retry_replays_the_first_response(self):
+        first = post_submission(self.client, self.quiz, self.ANSWERS, idempotency_key='attempt-1').json()
+        with CaptureQueriesContext(connection) as queries:
+            retry = post_submission(self.client, self.quiz, self.ANSWERS, idempotency_key='attempt-1').json()
+
+        self.assertEqual(retry, {**first, 'replayed': True})
+        self.assertEqual(len(queries), 2)  # the quiz, then the submission by its key
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(Task.objects.filter(task_name='quiz_app.tasks.generate_study_guide').count(), 1)
+        self.assertEqual(QuizStats.objects.get(quiz=self.quiz).submission_count, 1)
+
+    def test_perfect_score_replay_keeps_its_message(self):
+        perfect = {'0': 'A', '1': 'A', '2': 'A'}
+        first = post_submission(self.client, self.quiz, perfect, idempotency_key='attempt-1').json()
+        retry = post_submission(self.client, self.quiz, perfect, idempotency_key='attempt-1').json()
+        self.assertEqual(retry['message'], first['message'])
+
+    def test_new_attempts_and_other_quizzes_are_separate(self):
+        post_submission(self.client, self.quiz, {'0': 'A'}, idempotency_key='attempt-1')
+        post_submission(self.client, self.quiz, {'0': 'A'}, idempotency_key='attempt-2')
+        self.quiz = make_quiz('Decimals')
+        post_submission(self.client, self.quiz, {'0': 'A'}, idempotency_key='attempt-1')
+        self.assertEqual(Submission.objects.count(), 3)
+
+    def test_changed_answers_under_the_same_key_get_the_first_result(self):
+        # The first response was lost, so the student changed an answer and submitted again.
+        first = post_submission(self.client, self.quiz, {'0': 'A'}, idempotency_key='attempt-1').json()
+        retry = post_submission(self.client, self.quiz, {'0': 'B'}, idempotency_key='attempt-1')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()['submission_id'], first['submission_id'])
+        self.assertTrue(retry.json()['replayed'])
+        self.assertIn('first answers were kept', retry.json()['message'])
+        self.assertEqual(Submission.objects.get().answers, {'0': 'A'})
+
+    def test_overlong_key_is_refused(self):
+        response = post_submission(self.client, self.quiz, {'0': 'A'}, idempotency_key='x' * 65)
+        self.assertEqual(response.status_code, 400)
+
+    def test_racing_retry_loses_on_the_unique_constraint(self):
+        # Both requests looked for the key before either saved: the second
+        # one's insert fails and it replays the first one's result instead.
+        first = post_submission(self.client, self.quiz, self.ANSWERS, idempotency_key='attempt-1').json()
+        from . import views
+
+        real_replay = views.replay_submission
+        lookups = []
+
+        def replay(*args):
+            lookups.append(args)
+            return None if len(lookups) == 1 else real_replay(*args)
+
+        with mock.patch.object(views, 'replay_submission', side_effect=replay):
+            retry = post_submission(self.client, self.quiz, self.ANSWERS, idempotency_key='attempt-1').json()
+        self.assertEqual(len(lookups), 2)
+        self.assertEqual(retry['submission_id'], first['submission_id'])
+        self.assertEqual(Submission.objects.count(), 1)
+        self.assertEqual(StudyGuide.objects.count(), 1)
+        self.assertEqual(QuizStats.objects.get(quiz=self.quiz).submission_count, 1)
+
+    def test_quiz_page_sends_an_idempotency_key(self):
+        response = self.client.get(reverse('quiz_app:quiz_display', args=[self.quiz.access_code]))
+        self.assertContains(response, "'Idempotency-Key': idempotencyKey")
+
+
+BANK_QUESTIONS = [
+    ("What is 1/2 + 1/4 as a fraction?", ['3/4', '2/6', '1/8', '2/4'], 0),
+    ("Which fraction is equivalent to 2/4?", ['1/3', '1/2', '3/4', '2/3'], 1),
+    ("Simplify the fraction 6/8.", ['3/4', '2/3', '6/8', '1/2'], 0),
+    ("What is the denominator of the fraction 3/7?", ['3', '10', '7', '21'], 2),
+    ("Add the fractions 1/3 and 1/3.", ['1/6', '2/3', '2/6', '1/9'], 1),
+    ("What is the capital city of France?", ['Paris', 'Rome', 'Madrid', 'Berlin'], 0),
+]
+
+
+class QuestionBankTests(TestCase):
+    """The question bank index and study guides made from it."""
+
+    def setUp(self):
+        cache.clear()
+        self.bank = Quiz.objects.create(title='Fractions review', share_in_question_bank=True)
+        for text, options, correct in BANK_QUESTIONS:
+            Question.objects.create(quiz=self.bank, text=text, options=options, correct_index=correct)
+        self.quiz = Quiz.objects.create(title='Fractions test')
+        self.missed = [
+            Question.objects.create(quiz=self.quiz, text="Add the fractions 1/4 and 1/2.", options=['3/4', '2/6', '1/8', '1/2'],
+                                    correct_index=0),
+            Question.objects.create(quiz=self.quiz, text="Which fraction equals 4/8?", options=['1/2', '1/4', '2/3', '3/8'],
+                                    correct_index=0),
+        ]
+
+    def test_tokenize_drops_stopwords_and_folds_plurals(self):
+        self.assertEqual(question_bank.tokenize("What are the Fractions of 3 pizzas?"), ['fraction', 'pizza'])
+
+    def test_index_follows_question_saves_and_deletes(self):
+        question = self.missed[0]
+        self.assertIn('fraction', set(question.index_terms.values_list('term', flat=True)))
+        question.text = 'Multiply decimals'
+        question.options = ['a', 'b', 'c', 'd']
+        question.save()
+        self.assertEqual(set(question.index_terms.values_list('term', flat=True)), {'multiply', 'decimal'})
+        question.delete()
+        self.assertFalse(QuestionTerm.objects.filter(question_id=question.id).exists())
+
+    def test_rank_finds_similar_questions_in_other_quizzes(self):
+        query = question_bank.question_terms(self.missed[0].text, self.missed[0].options)
+        [ranked] = question_bank.rank([query], exclude_quiz_id=self.quiz.id)
+        texts = dict(Question.objects.values_list('id', 'text'))
+        self.assertEqual(texts[ranked[0][1]], "Add the fractions 1/3 and 1/3.")
+        self.assertTrue(0 < ranked[-1][0] <= ranked[0][0] <= 1)
+        self.assertNotIn(self.missed[0].id, [question_id for _, question_id in ranked])
+        self.assertNotIn('capital', ' '.join(texts[question_id] for _, question_id in ranked))
+
+    def test_study_guide_from_the_bank(self):
+        guide = parse_study_guide_text(question_bank.study_guide(self.missed, self.quiz.id, min_confidence=0.05))
+        self.assertEqual(len(guide), 5)
+        self.assertEqual({q['topic'] for q in guide}, {'Fractions review'})
+        self.assertIn({'topic': 'Fractions review', 'text': "What is 1/2 + 1/4 as a fraction?",
+                       'options': ['3/4', '2/6', '1/8', '2/4'], 'answer': 'A'}, guide)
+
+    def test_quizzes_that_are_not_shared_are_left_out(self):
+        # Another class's quiz, still open, has better matches than the bank.
+        other = Quiz.objects.create(title='Fractions quiz, class 5B')
+        for question in self.missed:
+            Question.objects.create(quiz=other, text=question.text, options=question.options, correct_index=0)
+        queries = [question_bank.question_terms(q.text, q.options) for q in self.missed]
+        ranked = question_bank.rank(queries, exclude_quiz_id=self.quiz.id)
+        quiz_ids = set(Question.objects.filter(pk__in=[i for matches in ranked for _, i in matches])
+                       .values_list('quiz_id', flat=True))
+        self.assertEqual(quiz_ids, {self.bank.id})
+
+        Quiz.objects.filter(pk=self.bank.pk).update(share_in_question_bank=False)
+        self.assertIsNone(question_bank.study_guide(self.missed, self.quiz.id, min_confidence=0.05))
+
+    def test_common_terms_only_bring_their_best_postings(self):
+        query = question_bank.question_terms('Fractions', [])
+        [everything] = question_bank.rank([query])
+        self.assertGreater(len(everything), 2)
+        with mock.patch.object(question_bank, 'POSTINGS_PER_TERM', 2):
+            [capped] = question_bank.rank([query])
+        self.assertEqual(len(capped), 2)
+        self.assertEqual(capped[0], everything[0])
+
+    def test_low_confidence_falls_back(self):
+        self.assertIsNone(question_bank.study_guide(self.missed, self.quiz.id, min_confidence=0.99))
+        decimals = [Question.objects.create(quiz=self.quiz, text="Round 2.75 to one decimal place.",
+                                            options=['2.8', '2.7', '3', '2'], correct_index=0)]
+        self.assertIsNone(question_bank.study_guide(decimals, self.quiz.id, min_confidence=0.05))
+
+    @override_settings(LLM_BACKEND='stub')
+    def test_generate_stage_skips_the_llm_when_the_bank_has_matches(self):
+        submission = Submission.objects.create(quiz=self.quiz, student_name='Sam', student_email='sam@example.com',
+                                               answers={}, score=0)
+        guide = StudyGuide.objects.create(submission=submission, missed_question_ids=[q.id for q in self.missed],
+                                          stages={'generate': StudyGuide.PENDING})
+        with mock.patch.object(question_bank, 'MIN_CONFIDENCE', 0.05), \
+                mock.patch.object(ai, 'generate_content') as generate:
+            tasks.generate_study_guide.now(guide.id)
+        generate.assert_not_called()
+        guide.refresh_from_db()
+        self.assertEqual(guide.stages['generate'], StudyGuide.DONE)
+        self.assertEqual(len(parse_study_guide_text(guide.text)), 5)
+
+    def test_index_questions_command_rebuilds_the_index(self):
+        Question.objects.bulk_create([Question(quiz=self.bank, text='Compare fractions 2/3 and 3/5', options=['a'],
+                                               correct_index=0)])
+        QuestionTerm.objects.filter(question_id=self.missed[0].id).delete()
+        call_command('index_questions', stdout=io.StringIO())
+        indexed = set(QuestionTerm.objects.values_list('question_id', flat=True))
+        self.assertEqual(indexed, set(Question.objects.values_list('id', flat=True)))
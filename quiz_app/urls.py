@@ -7,10 +7,16 @@ app_name = 'quiz_app'
 urlpatterns = [
     # --- SPECIFIC paths come FIRST ---
     path('submit/', views.submit_quiz_view, name='submit_quiz'),
+    path('submit/async/', views.submit_quiz_async_view, name='submit_quiz_async'),
     path('api/dashboard-data/', views.dashboard_data_view, name='api_dashboard_data'),
     path('api/quiz/save/', views.save_quiz_view, name='api_save_quiz'),
     path('api/quiz/generate-ai/', views.generate_ai_quiz_view, name='api_generate_ai'),
+    path('api/quiz/generate-ai/async/', views.generate_ai_quiz_async_view, name='api_generate_ai_async'),
+    path('api/quiz/generate-ai/stream/', views.generate_ai_quiz_stream_view, name='api_generate_ai_stream'),
     path('api/quiz/delete/', views.delete_quiz_view, name='api_delete_quiz'),
+    path('api/quiz/<str:access_code>/item-analysis/', views.item_analysis_view, name='api_item_analysis'),
+    path('api/cache-stats/', views.cache_stats_view, name='api_cache_stats'),
+    path('api/submission/<int:submission_id>/status/', views.submission_status_view, name='api_submission_status'),
 
     # --- GENERAL (variable) path comes LAST ---
     path('<str:access_code>/', views.quiz_display_view, name='quiz_display'),
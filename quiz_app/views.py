@@ -3,35 +3,27 @@
 # --- Required Imports ---
 import json
 import subprocess
-import tempfile
-import os
 import re
-import google.generativeai as genai
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.http import JsonResponse
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
-from django.core.mail import EmailMessage
-from .models import Quiz, Question, Submission
-from django.db.models import Count
+from .models import Quiz, Question, Submission, StudyGuide
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce
 from django.shortcuts import render
 from django.template.loader import render_to_string
-from fpdf import FPDF
-from background_task import background
 from django.contrib.auth.models import User
+from . import admission, ai, answer_key, display_cache, metrics, stats
+from .tasks import queue_study_guide
+from .pagination import InvalidCursor, keyset_page
+from .quiz_builder import build_quiz, validate_questions
+from .quiz_stream import QuestionStreamParser
+from .signals import questions_added
 
 
-# --- AI Model Configuration ---
-# This tells the library to use HTTP (REST) instead of gRPC globally.
-genai.configure(
-    api_key=settings.GEMINI_API_KEY, 
-    transport="rest" 
-)
-
-# 2. Instantiate the model WITHOUT the transport argument.
-model = genai.GenerativeModel(
-    model_name="gemini-2.0-flash-lite"
-)
-
 ##TESTING PURPOSES
 def create_user():
     user = User.objects.create_user(
@@ -40,33 +32,9 @@ def create_user():
     )
     user.save()
 
-# --- Helper function to parse AI plain text study guide ---
-# (This is a basic example, you might need a more robust parser)
-def parse_study_guide_text(text):
-    core_topics = ""
-    practice_questions = []
-    try:
-        core_split = re.split(r'\nPractice Questions\n', text, maxsplit=1, flags=re.IGNORECASE)
-        core_text_section = core_split[0]
-        practice_text_section = core_split[1] if len(core_split) > 1 else ""
-        core_topics = core_text_section.replace('Core Topics Explained\n', '', 1).strip()
-        question_blocks = re.split(r'\n(?=\d+\.\s)', practice_text_section.strip())
-        for block in question_blocks:
-            if not block.strip(): continue
-            lines = block.strip().split('\n')
-            if len(lines) < 6: continue
-            question_text = lines[0].split('.', 1)[1].strip()
-            options = [opt[3:].strip() for opt in lines[1:5]] # Assumes A) B) C) D) format
-            answer_line = lines[5]
-            practice_questions.append({
-                'text': question_text,
-                'options': options,
-            })
-    except Exception as e:
-        print(f"Error parsing study guide text: {e}")
-        core_topics = text # Fallback
-        practice_questions = []
-    return core_topics, practice_questions
+# The dashboard API never returns more than this many rows per list.
+DASHBOARD_PAGE_SIZE = getattr(settings, 'DASHBOARD_PAGE_SIZE', 50)
+DASHBOARD_MAX_PAGE_SIZE = getattr(settings, 'DASHBOARD_MAX_PAGE_SIZE', 200)
 
 def teacher_dashboard_view(request):
     # This view's only job is to render the dashboard template
@@ -78,28 +46,85 @@ def teacher_dashboard_view(request):
 
 def dashboard_data_view(request):
     """
-    Handles a GET request to load all necessary data for the teacher dashboard.
+    Handles a GET request to load one page of data for the teacher dashboard.
+
+    Quizzes and results are paged separately, newest first. Pass back the
+    'next_quizzes_cursor' / 'next_results_cursor' values from the previous
+    response as ?quizzes_cursor= / ?results_cursor= to load the next page.
     """
-    quizzes = Quiz.objects.annotate(question_count=Count('questions')).order_by('-created_at')
-    results = Submission.objects.order_by('-submitted_at').select_related('quiz')
+    try:
+        limit = min(int(request.GET.get('limit', DASHBOARD_PAGE_SIZE)), DASHBOARD_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'limit must be a positive number'}, status=400)
+
+    # Each page is a single query with no GROUP BY, so it walks the (timestamp, id)
+    # index. Submission totals come from the running QuizStats row, not from
+    # counting submissions, and question counts are one query for the quizzes on the page.
+    quizzes = Quiz.objects.values(
+        'id', 'title', 'access_code', 'created_at',
+        submission_count=Coalesce(F('stats__submission_count'), 0),
+        score_total=Coalesce(F('stats__score_total'), 0),
+        score_distribution=F('stats__score_distribution'),
+    )
+    results = Submission.objects.values(
+        'id', 'student_name', 'score', 'submitted_at', 'quiz_id',
+        quiz_title=F('quiz__title'),
+        quiz_code=F('quiz__access_code'),
+        guide_stages=F('study_guide__stages'),
+    )
+
+    try:
+        quiz_rows, next_quizzes_cursor = keyset_page(
+            quizzes, 'created_at', request.GET.get('quizzes_cursor'), limit)
+        result_rows, next_results_cursor = keyset_page(
+            results, 'submitted_at', request.GET.get('results_cursor'), limit)
+    except InvalidCursor as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    quiz_ids = {q['id'] for q in quiz_rows} | {r['quiz_id'] for r in result_rows}
+    question_counts = dict(
+        Question.objects.filter(quiz_id__in=quiz_ids).order_by()
+        .values_list('quiz_id').annotate(n=Count('id'))
+    ) if quiz_ids else {}
 
     quizzes_data = [{
-        'title': q.title,
-        'code': q.access_code,
-        'created_at': q.created_at,
-        'question_count': q.question_count,
-    } for q in quizzes]
+        'title': q['title'],
+        'code': q['access_code'],
+        'created_at': q['created_at'],
+        'question_count': question_counts.get(q['id'], 0),
+        'submission_count': q['submission_count'],
+        'mean_score': q['score_total'] / q['submission_count'] if q['submission_count'] else None,
+        'score_distribution': q['score_distribution'] or {},
+    } for q in quiz_rows]
 
     results_data = [{
-        'student_name': r.student_name,
-        'quiz_title': r.quiz.title,
-        'quiz_code': r.quiz.access_code,
-        'score': r.score,
-        'total_questions': r.quiz.questions.count(),
-        'study_guide_sent': True, # Placeholder, you can add a field to Submission model later
-    } for r in results]
+        'student_name': r['student_name'],
+        'quiz_title': r['quiz_title'],
+        'quiz_code': r['quiz_code'],
+        'score': r['score'],
+        'total_questions': question_counts.get(r['quiz_id'], 0),
+        'submitted_at': r['submitted_at'],
+        'study_guide_sent': (r['guide_stages'] or {}).get('deliver') == StudyGuide.DONE,
+    } for r in result_rows]
+
+    # The totals are only shown for the first page ("load more" requests pass a cursor),
+    # and come from one query over the quizzes and their running stats.
+    totals = None
+    if not request.GET.get('quizzes_cursor') and not request.GET.get('results_cursor'):
+        totals = Quiz.objects.order_by().aggregate(
+            quizzes=Count('id'),
+            results=Coalesce(Sum('stats__submission_count'), 0),
+        )
 
-    return JsonResponse({'quizzes': quizzes_data, 'results': results_data})
+    return JsonResponse({
+        'quizzes': quizzes_data,
+        'results': results_data,
+        'next_quizzes_cursor': next_quizzes_cursor,
+        'next_results_cursor': next_results_cursor,
+        'totals': totals,
+    })
 
 def save_quiz_view(request):
     """
@@ -108,16 +133,19 @@ def save_quiz_view(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            new_quiz = Quiz.objects.create(title=data.get('title'))
-            
-            for q_data in data.get('questions', []):
-                Question.objects.create(
-                    quiz=new_quiz,
-                    text=q_data.get('q'),
-                    options=q_data.get('options'),
-                    correct_index=q_data.get('correctIndex')
-                )
+            new_quiz = build_quiz(
+                title=data.get('title'),
+                class_name=data.get('class_name'),
+                share_in_question_bank=data.get('share_in_question_bank', False),
+                questions_data=[{
+                    'text': q_data.get('q'),
+                    'options': q_data.get('options'),
+                    'correct_index': q_data.get('correctIndex'),
+                } for q_data in data.get('questions', [])],
+            )
             return JsonResponse({'status': 'success', 'access_code': new_quiz.access_code})
+        except ValidationError as e:
+            return JsonResponse({'status': 'error', 'message': '; '.join(e.messages), 'errors': e.message_dict}, status=400)
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
@@ -134,53 +162,222 @@ def delete_quiz_view(request):
         except Exception as e:
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
+def build_ai_quiz_prompt(data):
+    subject = data.get('subject')
+    subtopic = data.get('subtopic')
+    gradelevel = data.get('gradelevel')
+    count = data.get('count')
+
+    # --- Prompt Engineering: Ask the AI for structured JSON ---
+    return (
+        f"Help Generate a quiz for a teacher about {subject}: The teccher describes the unit being:{subtopic} with a gradelevel of {gradelevel}. "
+        f"Create exactly {count} multiple-choice questions. "
+        "Respond with ONLY a single, raw JSON object. Do not include '```json' or any other text before or after the object. "
+        "The JSON object should have a single key 'questions', which is an array of objects. "
+        "Each question object must have two keys: "
+        "1. 'text' (string): The question text. "
+        "2. 'options' (array of 4 strings): The possible answers. "
+        "3. 'correctIndex' (integer from 0 to 3): The index of the correct answer in the 'options' array."
+    )
+
+def ai_quiz_title(data):
+    return f"{data.get('subject')}({data.get('gradelevel')})"
+
+def ai_question_data(q_data):
+    """Maps a question from the AI's JSON to the fields build_quiz expects."""
+    return {
+        'text': q_data.get('text'),
+        'options': q_data.get('options'),
+        'correct_index': q_data.get('correctIndex'),
+    }
+
+def save_ai_quiz(data, ai_text):
+    """Parses the AI's JSON answer and saves it as a new quiz."""
+    # Clean up the AI response to ensure it's valid JSON
+    cleaned_text = ai_text.strip().replace('```json', '').replace('```', '')
+    quiz_content = json.loads(cleaned_text)
+
+    # Create and save the quiz to the database
+    return build_quiz(
+        title=ai_quiz_title(data),
+        questions_data=[ai_question_data(q_data) for q_data in quiz_content.get('questions', [])],
+    )
+
+def sse_event(event, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_ai_quiz_events(data):
+    """
+    Streams the AI's answer and saves each question as soon as it has been
+    parsed, so a slow or cut-off answer still keeps every finished question.
+    Yields Server-Sent Events for the dashboard:
+      quiz     - {code, title}            once, when the first question is saved
+      question - {index, text, options}   for every saved question
+      error    - {message}                ends the stream; saved questions are kept
+      done     - {code, count, skipped}
+    """
+    parser = QuestionStreamParser()
+    quiz = None
+    saved = []
+    count = 0
+    skipped = 0
+    failed = False
+    try:
+        for chunk in ai.stream_content(build_ai_quiz_prompt(data)):
+            for q_data in parser.feed(chunk):
+                try:
+                    question = validate_questions([ai_question_data(q_data)])[0]
+                except ValidationError as e:
+                    print("VIEW: Skipping invalid AI question:", e.messages)
+                    skipped += 1
+                    continue
+                if quiz is None:
+                    quiz = Quiz.objects.create(title=ai_quiz_title(data))
+                    yield sse_event('quiz', {'code': quiz.access_code, 'title': quiz.title})
+                question.quiz = quiz
+                # One INSERT per question; the signals' work is done once, below.
+                Question.objects.bulk_create([question])
+                saved.append(question)
+                count += 1
+                yield sse_event('question', {'index': count, 'text': question.text, 'options': question.options})
+    except Exception as e:
+        print("!!! AI STREAM ERROR:", e)
+        failed = True
+        yield sse_event('error', {'message': str(e)})
+    finally:
+        # Also when the client goes away mid-stream: the saved questions stay.
+        if saved:
+            questions_added(quiz.id, saved)
+
+    if failed:
+        return
+    if quiz is None:
+        yield sse_event('error', {'message': 'The AI did not return any usable questions.'})
+        return
+    skipped += parser.errors
+    yield sse_event('done', {'code': quiz.access_code, 'count': count, 'skipped': skipped})
+
+def ai_request_data(request):
+    """
+    The JSON body of an AI generate request and what it costs (see admission.py).
+    Raises ValueError if either is invalid.
+    """
+    data = json.loads(request.body)
+    if not isinstance(data, dict):
+        raise ValueError('Invalid JSON')
+    return data, admission.request_cost(data)
+
+def too_busy_response(e):
+    """A 429 for a request admission control turned away."""
+    print("!!! AI REQUEST REJECTED:", e)
+    response = JsonResponse({'status': 'error', 'message': str(e)}, status=429)
+    response['Retry-After'] = str(e.retry_after)
+    return response
+
 def generate_ai_quiz_view(request):
     """
     Handles a POST request with topics to generate a quiz using the AI.
     """
     if request.method == 'POST':
         try:
-            data = json.loads(request.body)
-            subject = data.get('subject')
-            subtopic = data.get('subtopic')
-            gradelevel = data.get('gradelevel')
-            count = data.get('count')
-
-            # --- Prompt Engineering: Ask the AI for structured JSON ---
-            prompt = (
-                f"Help Generate a quiz for a teacher about {subject}: The teccher describes the unit being:{subtopic} with a gradelevel of {gradelevel}. "
-                f"Create exactly {count} multiple-choice questions. "
-                "Respond with ONLY a single, raw JSON object. Do not include '```json' or any other text before or after the object. "
-                "The JSON object should have a single key 'questions', which is an array of objects. "
-                "Each question object must have two keys: "
-                "1. 'text' (string): The question text. "
-                "2. 'options' (array of 4 strings): The possible answers. "
-                "3. 'correctIndex' (integer from 0 to 3): The index of the correct answer in the 'options' array."
-            )
-            
-            ai_response = model.generate_content(prompt)
-            # Clean up the AI response to ensure it's valid JSON
-            cleaned_text = ai_response.text.strip().replace('```json', '').replace('```', '')
-            quiz_content = json.loads(cleaned_text)
-
-            # Create and save the quiz to the database
-            quiz_title = f"{subject}({gradelevel})"
-            new_quiz = Quiz.objects.create(title=quiz_title)
-            
-            for q_data in quiz_content.get('questions', []):
-                Question.objects.create(
-                    quiz=new_quiz,
-                    text=q_data.get('text'),
-                    options=q_data.get('options'),
-                    correct_index=q_data.get('correctIndex')
-                )
-            
+            data, cost = ai_request_data(request)
+        except ValueError as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+        try:
+            with admission.slot(request, cost):
+                ai_text = ai.generate_content(build_ai_quiz_prompt(data))
+            new_quiz = save_ai_quiz(data, ai_text)
             return JsonResponse({'status': 'success', 'code': new_quiz.access_code})
 
+        except admission.Rejected as e:
+            return too_busy_response(e)
+        except ai.AIUnavailableError as e:
+            print("!!! AI UNAVAILABLE:", e)
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
         except Exception as e:
             print("!!! AI GENERATION ERROR:", e)
             return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+def generate_ai_quiz_stream_view(request):
+    """
+    Handles a POST request like generate_ai_quiz_view, but sends each
+    question back (as a Server-Sent Event) as soon as the AI has written it.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        data, cost = ai_request_data(request)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    try:
+        # The slot is held until the last event has been sent.
+        events = admission.hold_while_streaming(request, cost, stream_ai_quiz_events(data))
+    except admission.Rejected as e:
+        return too_busy_response(e)
+
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tell nginx-style proxies not to hold the events back.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+async def generate_ai_quiz_async_view(request):
+    """
+    Async version of generate_ai_quiz_view for ASGI servers. The worker
+    keeps serving other requests while it waits for Gemini.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+    try:
+        data, cost = ai_request_data(request)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    try:
+        async with admission.aslot(request, cost):
+            ai_text = await ai.agenerate_content(build_ai_quiz_prompt(data))
+        new_quiz = await sync_to_async(save_ai_quiz)(data, ai_text)
+        return JsonResponse({'status': 'success', 'code': new_quiz.access_code})
+
+    except admission.Rejected as e:
+        return too_busy_response(e)
+    except ai.AIUnavailableError as e:
+        print("!!! AI UNAVAILABLE:", e)
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+    except Exception as e:
+        print("!!! AI GENERATION ERROR:", e)
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+def item_analysis_view(request, access_code):
+    """
+    Handles a GET request for the per-question item analysis of a quiz
+    (difficulty, discrimination and how often each option was picked).
+    """
+    # Imported here so loading the URLconf doesn't have to load NumPy.
+    from . import analytics
+
+    quiz = get_object_or_404(Quiz, access_code=access_code.upper())
+    analysis = analytics.analyze_quiz(quiz)
+    return JsonResponse({'title': quiz.title, 'code': quiz.access_code, **analysis})
+
+def cache_stats_view(request):
+    """
+    Handles a GET request for this worker's cache hit/miss counters.
+    """
+    return JsonResponse(metrics.snapshot())
+
+def metrics_view(request):
+    """
+    Handles a GET request (from Prometheus) for the counters and stage
+    latency histograms of every process writing to METRICS_DIR (of just
+    this worker if it isn't set). If METRICS_TOKEN is set, the request has
+    to send it as "Authorization: Bearer <token>".
+    """
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponse('Unauthorized', status=401)
+    return HttpResponse(metrics.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # --------------------------------------------------------------------------
 # --- VIEWS FOR STUDENT-FACING QUIZ ---
 # --------------------------------------------------------------------------
@@ -189,167 +386,165 @@ def quiz_display_view(request, access_code):
     """
     Handles a GET request to display a quiz page to a student.
     """
-    quiz = get_object_or_404(Quiz, access_code=access_code.upper())
-    questions_for_js = []
-    for question in quiz.questions.all():
-        questions_for_js.append({"text": question.text, "answers": question.options})
-    context = {'quiz': quiz, 'questions_for_js': questions_for_js}
+    context = display_cache.get_quiz_display(access_code)
     return render(request, 'quiz_app/quiz_display.html', context)
 
-# In quiz_app/views.py
+# ---
+# view function
+# ---
 
-def parse_study_guide_text(text):
-    """
-    Parses the plain text AI response into a list of practice question data.
-    
-    Expects a format like:
-    Fundamental Topic: [Topic Title]
-    Practice Question: [Question Text]
-    A) [Option A]
-    B) [Option B]
-    C) [Option C]
-    D) [Option D]
-    Correct Answer: [A, B, C, or D]
-    """
-    practice_questions_data = []
-    
-    # This regex finds all components for each question
-    pattern = re.compile(
-        r"Fundamental Topic:\s*(.*?)\n"       # 1. Topic
-        r"Practice Question:\s*(.*?)\n"      # 2. Question Text
-        r"A\)\s*(.*?)\n"                      # 3. Option A
-        r"B\)\s*(.*?)\n"                      # 4. Option B
-        r"C\)\s*(.*?)\n"                      # 5. Option C
-        r"D\s*\)\s*(.*?)\n"                   # 6. Option D (added \s* for flexibility)
-        r"Correct Answer:\s*([A-D])",         # 7. Answer (A, B, C, or D)
-        re.DOTALL | re.MULTILINE | re.IGNORECASE
+# The most characters of an Idempotency-Key header that are kept.
+IDEMPOTENCY_KEY_MAX_LENGTH = 64
+
+def submission_response(submission, wrong_answers):
+    if not wrong_answers:
+        return {
+            'status': 'success',
+            'message': 'Submission saved! Great job!',
+            'submission_id': submission.id,
+        }
+    message = 'Submission saved! Your study guide will be emailed to you shortly.'
+    return {'status': 'success', 'message': message, 'submission_id': submission.id}
+
+def replay_submission(quiz, idempotency_key, data):
+    """
+    The response for a submission already saved under this idempotency key
+    (one indexed lookup, nothing is redone), or None if there isn't one.
+
+    A key stands for one attempt, and an attempt is saved once: whatever is
+    sent again under the same key gets the saved submission's result. That
+    includes changed answers (the first response was lost, so the student
+    changed an answer and pressed submit again); the response says the
+    first answers were kept.
+    """
+    submission = (
+        Submission.objects.select_related('study_guide')
+        .filter(quiz=quiz, idempotency_key=idempotency_key)
+        .first()
     )
+    if submission is None:
+        return None
+    print(f"VIEW: Replaying submission {submission.id} for a retried request")
+    wrong_answers = submission.study_guide.stages.get('generate') != StudyGuide.SKIPPED
+    response = {**submission_response(submission, wrong_answers), 'replayed': True}
+    if submission.answers != data.get('answers', {}) or submission.student_email != data.get('email'):
+        response['message'] = 'This quiz was already submitted; your first answers were kept.'
+    return response, 200
+
+def process_submission(data, idempotency_key=None):
+    """
+    Scores and saves one submission, then queues its study guide.
+    Returns (response_data, status_code). Shared by the sync and async views.
 
-    for match in pattern.finditer(text):
-        # Unpack all 7 captured groups
-        topic, question, opt_a, opt_b, opt_c, opt_d, answer = match.groups()
-        
-        practice_questions_data.append({
-            'topic': topic.strip(),
-            'text': question.strip(),
-            'options': [opt_a.strip(), opt_b.strip(), opt_c.strip(), opt_d.strip()],
-            'answer': answer.strip().upper()
-        })
-        
-        # Stop after finding 5, as requested in the prompt
-        if len(practice_questions_data) == 5:
-            break 
-
-    # --- UPDATED: This function ONLY returns practice questions ---
-    return practice_questions_data
+    A retry that sends the same idempotency_key as an earlier request gets
+    that request's response back; no second submission, LLM call or email.
+    """
+    # Only the first two pipeline stages (score -> persist) run here.
+    # Generating, rendering and emailing the study guide happen in the
+    # background worker (see quiz_app/tasks.py), so this returns right away.
+
+    # 1. Get all the data from the request
+    try:
+        quiz = Quiz.objects.get(access_code=data.get('access_code'))
+    except Quiz.DoesNotExist:
+        return {'error': 'Quiz not found'}, 404
+    student_name = data.get('name')
+    student_email = data.get('email')
+    student_answers = data.get('answers', {})
+    if idempotency_key:
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return {'error': f'Idempotency-Key is longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters'}, 400
+        replay = replay_submission(quiz, idempotency_key, data)
+        if replay is not None:
+            return replay
+
+    # 2. Score the quiz and find wrong answers (against the compiled key, see answer_key.py)
+    with metrics.span('score'):
+        score, wrong_question_ids = answer_key.score(answer_key.get(quiz.id, quiz.version), student_answers)
+
+    # 3. Save the submission, its pipeline status and the quiz totals together
+    follow_up = StudyGuide.PENDING if wrong_question_ids else StudyGuide.SKIPPED
+    try:
+        with metrics.span('persist'), transaction.atomic():
+            new_submission = Submission.objects.create(
+                quiz=quiz,
+                student_name=student_name,
+                student_email=student_email,
+                answers=student_answers,
+                score=score,
+                idempotency_key=idempotency_key or None,
+            )
+            guide = StudyGuide.objects.create(
+                submission=new_submission,
+                missed_question_ids=wrong_question_ids,
+                stages={
+                    'score': StudyGuide.DONE,
+                    'persist': StudyGuide.DONE,
+                    'generate': follow_up,
+                    'render': follow_up,
+                    'deliver': follow_up,
+                },
+            )
+            stats.record_submission(quiz.id, score)
+    except IntegrityError:
+        # A retry of the same attempt got here first (the unique constraint on
+        # quiz + idempotency_key); everything above was rolled back.
+        replay = replay_submission(quiz, idempotency_key, data) if idempotency_key else None
+        if replay is None:
+            raise
+        return replay
+
+    # 4. Check if we need to send a guide
+    if not wrong_question_ids:
+        print("VIEW: No wrong answers. Sending success.")
+        return submission_response(new_submission, wrong_question_ids), 200
+
+    # 5. Hand the rest of the pipeline to the background worker
+    with metrics.span('queue'):
+        queue_study_guide(guide.id)
+    print(f"VIEW: Queued study guide for {student_name}")
+    return submission_response(new_submission, wrong_question_ids), 200
 
-# ---
-# view function
-# ---
 
 def submit_quiz_view(request):
     if request.method != 'POST':
         return JsonResponse({'error': 'Invalid request method'}, status=405)
 
-    # THIS IS THE ALL-IN-ONE FUNCTION
-    # The 'background' logic is now built in.
-    
     try:
-        # 1. Get all the data from the request
-        data = json.loads(request.body)
-        quiz = Quiz.objects.get(access_code=data.get('access_code'))
-        student_name = data.get('name')
-        student_email = data.get('email')
-        student_answers = data.get('answers', {})
-
-        # 2. Score the quiz and find wrong answers
-        score = 0
-        wrong_questions = []
-        questions = list(quiz.questions.all())
-
-        for i, question in enumerate(questions):
-            submitted_answer_text = student_answers.get(str(i))
-            
-            try:
-                # --- FIX #1: Handles bad data (like Question 44) ---
-                correct_answer_text = question.options[question.correct_index]
-                
-                if submitted_answer_text == correct_answer_text:
-                    score += 1
-                else:
-                    wrong_questions.append(question)
-            
-            except IndexError:
-                # If a question is broken, log it and add it to the guide
-                print(f"!!! DATA ERROR: Question ID {question.id} has invalid index.")
-                wrong_questions.append(question)
-                continue
-
-        # 3. Save the submission to the database
-        new_submission = Submission.objects.create(
-            quiz=quiz,
-            student_name=student_name,
-            student_email=student_email,
-            answers=student_answers,
-            score=score
-        )
-        
-        # 4. Check if we need to send a guide
-        if not wrong_questions:
-            print("VIEW: No wrong answers. Sending success.")
-            return JsonResponse({'status': 'success', 'message': 'Submission saved! Great job!'})
-
-        # --- 5. START STUDY GUIDE LOGIC ---
-        print(f"VIEW: Generating AI prompt for {student_name}")
-        # (Your prompt logic here...)
-        prompt_text = "The following are questions a student answered incorrectly:\n\n"
-        for q in wrong_questions:
-             prompt_text += f"- Question: {q.text}\n"
-        prompt_text += "\nPlease generate exactly *five multiple choice questions* and nothing else no header, no introduction, just multiple choice questions..."
-        
-        # 6. Call the AI Model
-        ai_response = model.generate_content(prompt_text)
-        study_guide_text = ai_response.text
-        print("VIEW: AI content received.")
-
-        # 7. Create PDF
-        pdf = FPDF() 
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.cell(200, 10, txt=f"Study Guide for {quiz.title}", ln=True, align='C')
-        pdf.multi_cell(0, 10, txt=study_guide_text)
-        print("VIEW: PDF created.")
-        
-        # --- 8. SEND THE EMAIL (This is the part that is failing) ---
-        with tempfile.TemporaryDirectory() as tempdir:
-            pdf_filename = os.path.join(tempdir, 'study_guide.pdf')
-            pdf.output(pdf_filename)
-
-            print(f"VIEW: Sending email to {student_email} from {settings.DEFAULT_FROM_EMAIL}...")
-
-            email = EmailMessage(
-                subject=f"Your Personalized Study Guide for '{quiz.title}'",
-                body=f"Hello {student_name},\n\nHere is your study guide...",
-                
-                # --- FIX #2: Uses your verified email from settings.py ---
-                from_email=settings.DEFAULT_FROM_EMAIL, 
-                
-                to=[student_email],
-            )
-            email.attach_file(pdf_filename)
-            
-            # If this line fails, the 'except' block below will catch it
-            email.send() 
-            
-            print(f"VIEW: Successfully sent guide to {student_email}")
+        response_data, status = process_submission(json.loads(request.body), request.headers.get('Idempotency-Key'))
+        return JsonResponse(response_data, status=status)
+    except Exception as e:
+        print(f"!!! SUBMISSION VIEW ERROR: {e}") 
+        return JsonResponse({'error': f'An internal error occurred: {e}'}, status=500)
 
-        message = 'Submission saved! Your study guide has been emailed to you.'
-        return JsonResponse({'status': 'success', 'message': message})
 
-    except Quiz.DoesNotExist:
-        return JsonResponse({'error': 'Quiz not found'}, status=404)
+async def submit_quiz_async_view(request):
+    """
+    Async version of submit_quiz_view for ASGI servers. The database work
+    runs in Django's sync thread so the event loop is never blocked.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request method'}, status=405)
+
+    try:
+        response_data, status = await sync_to_async(process_submission)(
+            json.loads(request.body), request.headers.get('Idempotency-Key'),
+        )
+        return JsonResponse(response_data, status=status)
     except Exception as e:
-        # --- THIS WILL FINALLY CATCH THE REAL ERROR ---
-        # Your terminal will now show 500 and the Brevo error
         print(f"!!! SUBMISSION VIEW ERROR: {e}") 
-        return JsonResponse({'error': f'An internal error occurred: {e}'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': f'An internal error occurred: {e}'}, status=500)
+
+
+def submission_status_view(request, submission_id):
+    """
+    Handles a GET request to report where a submission is in the
+    study-guide pipeline, stage by stage.
+    """
+    guide = get_object_or_404(StudyGuide, submission_id=submission_id)
+    return JsonResponse({
+        'submission_id': submission_id,
+        'stages': {stage: guide.stages.get(stage, StudyGuide.PENDING) for stage in StudyGuide.STAGES},
+        'study_guide_sent': guide.is_sent,
+        'error': guide.error,
+    })